@@ -0,0 +1,491 @@
+#!/usr/bin/python
+'''
+module AcisStandIn.py
+
+Local stand-in for the ACIS Web Services.
+Records real ACIS responses to fixture files and replays them,
+or synthesizes responses for StnMeta, StnData, MultiStnData,
+GridData and General calls from a generator,
+with configurable latency and payload size.
+AcisWS is pointed at a running stand-in server via
+settings.ACIS_STAND_IN_URL.
+
+Usage:
+python AcisStandIn.py serve [port] [fixture_dir]
+python AcisStandIn.py record requests_file [fixture_dir]
+    requests_file -- JSON list of [call_name, params] pairs, e.g.
+                     [["StnData", {"sid":"266779","sdate":"20150101",...}],
+                      ["General/state", {"id":"NV","meta":"id,name,bbox"}]]
+'''
+import sys, os
+import datetime, time
+import json, random
+import threading
+import urlparse
+import BaseHTTPServer, SocketServer
+
+import AcisWS
+
+try:
+    import my_acis.settings as settings
+except ImportError:
+    import my_acis_settings as settings
+
+###########
+#STATICS
+###########
+FIXTURE_DIR = getattr(settings, 'ACIS_FIXTURE_DIR', settings.TEMP_DIR + 'acis_fixtures/')
+#Calls the recorder and replay server know about
+ACIS_CALLS = ['StnMeta', 'StnData', 'MultiStnData', 'GridData', 'General']
+#Station meta keys returned by StnMeta if the request does not ask for specific ones
+STN_META_KEYS = ['name', 'state', 'sids', 'uid', 'll', 'elev', 'valid_daterange']
+#Value ranges of synthesized data
+ELEMENT_RANGES = {
+    'maxt':(20, 110),
+    'mint':(-10, 75),
+    'avgt':(10, 90),
+    'obst':(10, 100),
+    'pcpn':(0, 2),
+    'snow':(0, 10),
+    'snwd':(0, 30),
+    'hdd':(0, 40),
+    'cdd':(0, 30),
+    'gdd':(0, 30)
+}
+
+###########
+#FIXTURES
+###########
+def fixture_path(fixture_dir, call_name, params):
+    return os.path.join(fixture_dir, call_name.replace('/','_') + '_' + AcisWS.request_key(call_name, params) + '.json')
+
+def write_fixture(fixture_dir, call_name, params, response):
+    '''
+    Atomically writes fixture file holding call name, params and response
+    Returns path of fixture file
+    '''
+    path = fixture_path(fixture_dir, call_name, params)
+    AcisWS.atomic_write(path, lambda f: json.dump({'call':call_name, 'params':params, 'response':response}, f))
+    return path
+
+def load_fixtures(fixture_dir):
+    '''
+    Returns dictionary of serialized responses keyed on AcisWS.request_key
+    '''
+    fixtures = {}
+    if not fixture_dir or not os.path.isdir(fixture_dir):
+        return fixtures
+    for file_name in os.listdir(fixture_dir):
+        if not file_name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(fixture_dir, file_name), 'r') as f:
+                fixture = json.load(f)
+            key = AcisWS.request_key(fixture['call'], fixture['params'])
+            fixtures[key] = json.dumps(fixture['response'])
+        except Exception:
+            continue
+    return fixtures
+
+def record_fixture(call_name, params, fixture_dir=None, base_url=None):
+    '''
+    Requests call_name with params from the live ACIS servers
+    and writes the response to fixture_dir.
+    Returns path of fixture file or None if the request failed
+    '''
+    if fixture_dir is None:
+        fixture_dir = FIXTURE_DIR
+    if base_url is None:
+        base_url = settings.ACIS_BASE_URL
+    try:
+        response = AcisWS.make_request(base_url + call_name, params)
+    except Exception:
+        return None
+    if not response:
+        return None
+    return write_fixture(fixture_dir, call_name, params, response)
+
+def record_fixtures(requests_list, fixture_dir=None, base_url=None):
+    '''
+    Records fixtures for a list of [call_name, params] pairs
+    Returns list of fixture paths (None for failed requests)
+    '''
+    paths = []
+    for call_name, params in requests_list:
+        paths.append(record_fixture(call_name, params, fixture_dir=fixture_dir, base_url=base_url))
+    return paths
+
+###########
+#GENERATOR
+###########
+def _to_date(date_str):
+    return datetime.datetime.strptime(date_str.replace('-','').replace('/',''), '%Y%m%d')
+
+def _elem_names(params):
+    elems = params.get('elems', [])
+    if isinstance(elems, basestring):
+        elems = elems.replace(' ','').split(',')
+    names = []
+    for el in elems:
+        if isinstance(el, dict):
+            name = el.get('name', '')
+            if not name and 'vX' in el:
+                name = str(el['vX'])
+            names.append((name, 'add' in el))
+        else:
+            names.append((str(el), False))
+    return names
+
+def _meta_keys(params, default_keys):
+    meta = params.get('meta', default_keys)
+    if isinstance(meta, basestring):
+        meta = meta.replace(' ','').split(',')
+    return meta
+
+class ACISResponseGenerator(object):
+    '''
+    Synthesizes deterministic ACIS responses.
+    The same request always gets the same response.
+
+    Keyword arguments:
+    num_stations -- number of stations returned by StnMeta/MultiStnData
+                    requests that do not list sids
+    grid_shape   -- (rows, columns) of GridData area requests
+                    other than bbox requests
+    grid_step    -- grid spacing (degrees) of GridData bbox requests
+    missing      -- fraction of missing values
+    por          -- period of record (start, end) used for por dates
+    max_networks -- max number of networks (sids) per station
+    '''
+    def __init__(self, num_stations=10, grid_shape=(10,10), grid_step=1.0/24,
+        missing=0.05, por=('20000101','20001231'), max_networks=1):
+        self.num_stations = num_stations
+        self.max_networks = max_networks
+        self.grid_shape = grid_shape
+        self.grid_step = grid_step
+        self.missing = missing
+        self.por = por
+
+    def rng(self, call_name, params):
+        return random.Random(AcisWS.request_key(call_name, params))
+
+    def dates(self, params):
+        if 'date' in params.keys():
+            start = end = params['date']
+        else:
+            start = params.get('sdate', self.por[0])
+            end = params.get('edate', start)
+        if str(start).lower() == 'por':start = self.por[0]
+        if str(end).lower() == 'por':end = self.por[1]
+        start = _to_date(str(start));end = _to_date(str(end))
+        return [(start + datetime.timedelta(days=d)).strftime('%Y-%m-%d') \
+            for d in range((end - start).days + 1)]
+
+    def value(self, rng, name, add_flags):
+        if rng.random() < self.missing:
+            val = 'M'
+        else:
+            low, high = ELEMENT_RANGES.get(name, (0, 100))
+            if name in ['pcpn', 'snow']:
+                val = '%.2f' % rng.uniform(low, high) if rng.random() < 0.3 else '0.00'
+            else:
+                val = str(rng.randint(low, high))
+        if add_flags:
+            return [val, '']
+        return val
+
+    def station_meta(self, rng, idx, sid=None, keys=None):
+        if sid is None:
+            sid = '%06d' % (100000 + idx)
+        lon = round(rng.uniform(-124.0, -103.0), 4)
+        lat = round(rng.uniform(31.0, 49.0), 4)
+        meta = {
+            'name':'STAND-IN STATION %d' % idx,
+            'state':'NV',
+            'sids':[sid + ' 2'] + ['%s %d' % (sid, network) \
+                for network in [6, 7, 1, 3, 5][0:rng.randint(0, self.max_networks - 1)]],
+            'uid':idx + 1,
+            'll':[lon, lat],
+            'elev':round(rng.uniform(0, 10000), 1),
+            'valid_daterange':[[self.por[0][0:4] + '-01-01', self.por[1][0:4] + '-12-31']]
+        }
+        if keys is None:
+            return meta
+        return dict([(k, meta[k]) for k in keys if k in meta.keys()])
+
+    def station_ids(self, params):
+        for key in ['sids', 'sid']:
+            if key in params.keys():
+                sids = params[key]
+                if isinstance(sids, basestring):
+                    sids = sids.replace(' ','').split(',')
+                return sids
+        return [None for idx in range(self.num_stations)]
+
+    def StnMeta(self, params):
+        rng = self.rng('StnMeta', params)
+        keys = _meta_keys(params, STN_META_KEYS)
+        elems = _elem_names(params)
+        meta = []
+        for idx, sid in enumerate(self.station_ids(params)):
+            stn = self.station_meta(rng, idx, sid=sid, keys=keys)
+            if 'valid_daterange' in stn.keys() and elems:
+                #One valid_daterange per element, some elements have no data
+                stn['valid_daterange'] = [stn['valid_daterange'][0] if rng.random() > self.missing else [] \
+                    for el in elems]
+            meta.append(stn)
+        return {'meta':meta}
+
+    def StnData(self, params):
+        rng = self.rng('StnData', params)
+        elems = _elem_names(params)
+        sid = self.station_ids(params)[0]
+        data = [[date] + [self.value(rng, name, add) for name, add in elems] \
+            for date in self.dates(params)]
+        return {'meta':self.station_meta(rng, 0, sid=sid, keys=['name', 'state', 'sids', 'uid', 'll', 'elev']), 'data':data}
+
+    def MultiStnData(self, params):
+        rng = self.rng('MultiStnData', params)
+        elems = _elem_names(params)
+        keys = _meta_keys(params, ['name', 'state', 'sids', 'uid', 'll', 'elev'])
+        dates = self.dates(params)
+        data = []
+        for idx, sid in enumerate(self.station_ids(params)):
+            data.append({
+                'meta':self.station_meta(rng, idx, sid=sid, keys=keys),
+                'data':[[self.value(rng, name, add) for name, add in elems] for date in dates]
+            })
+        return {'data':data}
+
+    def grid_lls(self, params):
+        '''
+        Returns list of lats and list of lons of the requested grid
+        '''
+        if 'bbox' in params.keys():
+            bbox = params['bbox']
+            if isinstance(bbox, basestring):
+                bbox = [float(b) for b in bbox.replace(' ','').split(',')]
+            west, south, east, north = bbox
+            num_lats = max(1, int(round((north - south) / self.grid_step)) + 1)
+            num_lons = max(1, int(round((east - west) / self.grid_step)) + 1)
+            lats = [south + i*self.grid_step for i in range(num_lats)]
+            lons = [west + i*self.grid_step for i in range(num_lons)]
+        else:
+            lats = [39.0 + i*self.grid_step for i in range(self.grid_shape[0])]
+            lons = [-120.0 + i*self.grid_step for i in range(self.grid_shape[1])]
+        return lats, lons
+
+    def GridData(self, params):
+        rng = self.rng('GridData', params)
+        elems = [name for name, add in _elem_names(params)]
+        dates = self.dates(params)
+        meta_keys = _meta_keys(params, [])
+        if 'loc' in params.keys():
+            lon, lat = [float(l) for l in str(params['loc']).replace(' ','').split(',')]
+            data = [[date] + [self.value(rng, name, False) for name in elems] for date in dates]
+            meta = {'lat':lat, 'lon':lon, 'elev':round(rng.uniform(0, 10000), 1)}
+        else:
+            lats, lons = self.grid_lls(params)
+            data = []
+            for date in dates:
+                row = [date]
+                for name in elems:
+                    low, high = ELEMENT_RANGES.get(name, (0, 100))
+                    row.append([[round(rng.uniform(low, high), 2) for lon in lons] for lat in lats])
+                data.append(row)
+            meta = {
+                'lat':[[lat for lon in lons] for lat in lats],
+                'lon':[[lon for lon in lons] for lat in lats],
+                'elev':[[round(rng.uniform(0, 10000), 1) for lon in lons] for lat in lats]
+            }
+        response = {'data':data}
+        if meta_keys:
+            #ll is returned as separate lat, lon arrays
+            if 'll' in meta_keys:
+                meta_keys = meta_keys + ['lat', 'lon']
+            response['meta'] = dict([(k, meta[k]) for k in meta_keys if k in meta.keys()])
+        return response
+
+    def General(self, request_type, params):
+        rng = self.rng('General/' + request_type, params)
+        keys = _meta_keys(params, ['id', 'name'])
+        ids = params.get('id', params.get('state', ''))
+        if isinstance(ids, basestring):
+            ids = [i for i in ids.replace(' ','').split(',') if i]
+        if not ids:
+            ids = ['%s%02d' % (request_type[0:2].upper(), idx) for idx in range(self.num_stations)]
+        meta = []
+        for area_id in ids:
+            west = round(rng.uniform(-124.0, -105.0), 2)
+            south = round(rng.uniform(31.0, 47.0), 2)
+            east = west + 2.0;north = south + 2.0
+            area = {
+                'id':area_id,
+                'name':'Stand-in %s %s' % (request_type, area_id),
+                'state':'NV',
+                'bbox':[west, south, east, north],
+                'geojson':{'type':'MultiPolygon', 'coordinates':[[[
+                    [west, south], [east, south], [east, north], [west, north], [west, south]
+                ]]]}
+            }
+            meta.append(dict([(k, area[k]) for k in keys if k in area.keys()]))
+        return {'meta':meta}
+
+    def response(self, call_name, params):
+        '''
+        Returns synthesized response for call_name or None
+        if the call is not supported
+        '''
+        call_type = call_name.split('/')[0]
+        if call_type == 'General':
+            return self.General(call_name.split('/')[-1], params)
+        if call_type in ['StnMeta', 'StnData', 'MultiStnData', 'GridData']:
+            return getattr(self, call_type)(params)
+        return None
+
+###########
+#SERVER
+###########
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''
+    Answers ACIS POST requests from the server's fixtures,
+    falling back to the server's generator.
+    Requests without fixture or generator response get a 404
+    '''
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def read_params(self):
+        length = int(self.headers.getheader('content-length', 0))
+        body = self.rfile.read(length)
+        if self.headers.getheader('content-type', '').startswith('application/x-www-form-urlencoded'):
+            body = urlparse.parse_qs(body).get('params', ['{}'])[0]
+        return json.loads(body) if body else {}
+
+    def send_body(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        call_name = urlparse.urlparse(self.path).path.strip('/')
+        try:
+            params = self.read_params()
+        except ValueError:
+            self.send_body(400, json.dumps({'error':'Invalid params.'}))
+            return
+        body = self.server.response_body(call_name, params)
+        self.server.wait()
+        if body is None:
+            self.send_body(404, json.dumps({'error':'No stand-in response for %s.' % call_name}))
+        else:
+            self.send_body(200, body)
+
+    def log_message(self, format, *args):
+        pass
+
+class StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    '''
+    Threaded stand-in ACIS server
+
+    Keyword arguments:
+    fixtures  -- dictionary of serialized responses, see load_fixtures
+    generator -- ACISResponseGenerator used for requests without fixture
+                 (None: fixtures only)
+    latency   -- seconds each response is delayed by
+    jitter    -- max random extra delay (seconds)
+    '''
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, fixtures=None, generator=None, latency=0, jitter=0):
+        BaseHTTPServer.HTTPServer.__init__(self, address, StandInHandler)
+        self.fixtures = fixtures if fixtures is not None else {}
+        self.generator = generator
+        self.latency = latency
+        self.jitter = jitter
+        self.generated = {}
+        self.lock = threading.Lock()
+        self.num_requests = 0
+
+    def response_body(self, call_name, params):
+        with self.lock:
+            self.num_requests+=1
+        key = AcisWS.request_key(call_name, params)
+        if key in self.fixtures.keys():
+            return self.fixtures[key]
+        if self.generator is None:
+            return None
+        #Generated responses are serialized once
+        with self.lock:
+            if key in self.generated.keys():
+                return self.generated[key]
+        response = self.generator.response(call_name, params)
+        if response is None:
+            return None
+        body = json.dumps(response)
+        with self.lock:
+            self.generated[key] = body
+        return body
+
+    def wait(self):
+        delay = self.latency
+        if self.jitter:
+            delay+= random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    @property
+    def base_url(self):
+        return 'http://%s:%s/' % (self.server_address[0], str(self.server_address[1]))
+
+###########
+#UTILITIES
+###########
+def start_stand_in_server(fixture_dir=None, generator=None, latency=0, jitter=0, port=0):
+    '''
+    Starts stand-in server in a daemon thread
+    (port 0: any free port).
+    Returns server and its base url
+    '''
+    server = StandInServer(('127.0.0.1', port), fixtures=load_fixtures(fixture_dir),
+        generator=generator, latency=latency, jitter=jitter)
+    t = threading.Thread(target=server.serve_forever)
+    t.daemon = True
+    t.start()
+    return server, server.base_url
+
+def use_stand_in(base_url):
+    '''
+    Points AcisWS at the stand-in server at base_url
+    (None: back to the live ACIS servers)
+    '''
+    settings.ACIS_STAND_IN_URL = base_url
+
+#########
+# M A I N
+#########
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in ['serve', 'record']:
+        print __doc__
+        sys.exit(1)
+    if sys.argv[1] == 'record':
+        if len(sys.argv) < 3:
+            print __doc__
+            sys.exit(1)
+        fixture_dir = sys.argv[3] if len(sys.argv) > 3 else FIXTURE_DIR
+        with open(sys.argv[2], 'r') as f:
+            requests_list = json.load(f)
+        paths = record_fixtures(requests_list, fixture_dir=fixture_dir)
+        for (call_name, params), path in zip(requests_list, paths):
+            print '%s: %s' % (call_name, path if path else 'FAILED')
+    else:
+        port = int(sys.argv[2]) if len(sys.argv) > 2 else 8080
+        fixture_dir = sys.argv[3] if len(sys.argv) > 3 else FIXTURE_DIR
+        server = StandInServer(('127.0.0.1', port), fixtures=load_fixtures(fixture_dir),
+            generator=ACISResponseGenerator())
+        print 'Serving %d fixtures from %s at %s' % (len(server.fixtures), fixture_dir, server.base_url)
+        print 'Point AcisWS at it with settings.ACIS_STAND_IN_URL = \'%s\'' % server.base_url
+        server.serve_forever()
@@ -10,8 +10,11 @@ sodlist, sodsum
 #############################################################################
 #python modules
 import numpy, bisect
-import datetime, re
-import sys
+import datetime, re, math
+import sys, os
+import hashlib, tempfile, fcntl, copy
+import logging
+import sqlite3
 from collections import defaultdict
 #############################################################################
 #WRCC specific modules
@@ -20,6 +23,8 @@ import WRCCUtils, WRCCClasses, WRCCData
 # import modules required by Acis
 import urllib2
 import json
+import httplib, urlparse, socket
+import threading, time, Queue
 ##############################################################################
 #settings file
 #FIX ME:
@@ -29,9 +34,1022 @@ try:
 except ImportError:
     import my_acis_settings as settings
 
+#Acis deadlines
+################
+#Default socket timeout (seconds) of a single ACIS call
+ACIS_CALL_TIMEOUT = 300
+
+class ACISTimeoutError(Exception):
+    '''
+    Raised when an ACIS call or a job making ACIS calls
+    runs past its deadline
+    '''
+    pass
+
+class RetryBudget(object):
+    '''
+    Thread-safe number of retries (server fail overs, hedges,
+    split piece retries) a job may spend in total
+    '''
+    def __init__(self, retries):
+        self.retries = retries
+        self.lock = threading.Lock()
+
+    def use(self):
+        with self.lock:
+            if self.retries <= 0:
+                return False
+            self.retries-=1
+            return True
+
+_deadline_local = threading.local()
+
+def _deadline_stack():
+    if not hasattr(_deadline_local, 'stack'):
+        _deadline_local.stack = []
+    return _deadline_local.stack
+
+class ACISDeadline(object):
+    '''
+    Context manager that bounds the time (and optionally the number
+    of retries) of all ACIS calls made by the current thread,
+    down to the socket timeouts.
+    Nested deadlines can only shorten the outer deadline.
+    Worker threads started by AcisWS inherit the deadline.
+
+    Keyword arguments:
+    seconds -- seconds from now until the deadline (None: no deadline)
+    retries -- retry budget of the job (None: inherit or unlimited)
+    name    -- job name used in timeout error messages
+
+    Example:
+    with AcisWS.ACISDeadline(600, retries=10, name='Sodxtrmts'):
+        data = DJ.get_data_station()
+    '''
+    def __init__(self, seconds=None, retries=None, name=None, at=None, budget=None):
+        self.seconds = seconds
+        if at is None and seconds is not None:
+            at = time.time() + float(seconds)
+        self.at = at
+        if budget is None and retries is not None:
+            budget = RetryBudget(retries)
+        self.budget = budget
+        self.name = name
+
+    def __enter__(self):
+        stack = _deadline_stack()
+        if stack:
+            parent = stack[-1]
+            if parent.at is not None and (self.at is None or parent.at < self.at):
+                self.at = parent.at
+                self.seconds = parent.seconds
+                self.name = parent.name
+            if self.budget is None:
+                self.budget = parent.budget
+            if self.name is None:
+                self.name = parent.name
+        stack.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _deadline_stack().pop()
+        return False
+
+    def time_left(self):
+        if self.at is None:
+            return None
+        return self.at - time.time()
+
+    def expired(self):
+        return self.at is not None and time.time() >= self.at
+
+    def error(self):
+        name = self.name if self.name else 'ACIS job'
+        if self.seconds is not None:
+            return ACISTimeoutError('%s exceeded its deadline of %s seconds.' % (name, str(self.seconds)))
+        return ACISTimeoutError('%s exceeded its deadline.' % name)
+
+def current_deadline():
+    stack = _deadline_stack()
+    if stack:
+        return stack[-1]
+    return None
+
+def check_deadline():
+    '''
+    Raises ACISTimeoutError if the deadline of the current job has passed
+    '''
+    deadline = current_deadline()
+    if deadline is not None and deadline.expired():
+        raise deadline.error()
+
+def use_retry():
+    '''
+    Takes one retry from the budget of the current job.
+    Returns False if the budget is used up or the deadline has passed.
+    '''
+    deadline = current_deadline()
+    if deadline is None:
+        return True
+    if deadline.expired():
+        return False
+    if deadline.budget is None:
+        return True
+    return deadline.budget.use()
+
+def call_timeout():
+    '''
+    Returns the socket timeout of the next ACIS call:
+    settings.ACIS_CALL_TIMEOUT capped by the time left until the job deadline
+    '''
+    timeout = getattr(settings, 'ACIS_CALL_TIMEOUT', ACIS_CALL_TIMEOUT)
+    deadline = current_deadline()
+    if deadline is None or deadline.at is None:
+        return timeout
+    left = deadline.time_left()
+    if left <= 0:
+        raise deadline.error()
+    if timeout is None:
+        return left
+    return min(timeout, left)
+
+def run_with_deadline(deadline, function, *args):
+    '''
+    Runs function(*args) under deadline.
+    Used to hand the deadline of a job to worker threads.
+    '''
+    if deadline is None:
+        return function(*args)
+    with ACISDeadline(deadline.seconds, at=deadline.at, budget=deadline.budget, name=deadline.name):
+        return function(*args)
+
+#Acis WebServices transport
+###########################
+class ACISConnectionPool(object):
+    '''
+    Thread-safe pool of persistent (keep-alive) HTTP connections,
+    one set of idle connections per ACIS server.
+
+    Keyword arguments:
+    max_size     -- max number of idle connections kept per server
+    idle_timeout -- seconds after which an idle connection is evicted
+    timeout      -- socket timeout for new connections (default: None)
+    '''
+    def __init__(self, max_size=4, idle_timeout=60, timeout=None):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        #server key --> list of [connection, time_last_used]
+        self.idle = {}
+        self.stats = {'created':0, 'reused':0, 'evicted':0}
+
+    def server_key(self, url):
+        u = urlparse.urlparse(url)
+        port = u.port
+        if port is None:
+            port = 443 if u.scheme == 'https' else 80
+        return (u.scheme, u.hostname, port)
+
+    def evict_idle(self, now=None):
+        '''
+        Closes all idle connections that have not been used
+        for more than self.idle_timeout seconds
+        '''
+        if now is None:now = time.time()
+        with self.lock:
+            for key, conns in self.idle.items():
+                keep = []
+                for conn, last_used in conns:
+                    if now - last_used > self.idle_timeout:
+                        conn.close()
+                        self.stats['evicted']+=1
+                    else:
+                        keep.append([conn, last_used])
+                self.idle[key] = keep
+
+    def get_connection(self, key):
+        '''
+        Returns (connection, reused) for server key
+        '''
+        now = time.time()
+        with self.lock:
+            conns = self.idle.get(key, [])
+            while conns:
+                conn, last_used = conns.pop()
+                if now - last_used > self.idle_timeout:
+                    conn.close()
+                    self.stats['evicted']+=1
+                    continue
+                self.stats['reused']+=1
+                return conn, True
+            self.stats['created']+=1
+        scheme, host, port = key
+        if scheme == 'https':
+            conn = httplib.HTTPSConnection(host, port, timeout=self.timeout)
+        else:
+            conn = httplib.HTTPConnection(host, port, timeout=self.timeout)
+        return conn, False
+
+    def release_connection(self, key, conn):
+        with self.lock:
+            conns = self.idle.setdefault(key, [])
+            if len(conns) < self.max_size:
+                conns.append([conn, time.time()])
+                return
+        conn.close()
+
+    def close(self):
+        with self.lock:
+            for key, conns in self.idle.items():
+                for conn, last_used in conns:
+                    conn.close()
+            self.idle = {}
+
+    def send(self, url, body, headers, timeout=None):
+        '''
+        POSTs body to url over a pooled connection.
+        Returns (server key, connection, response).
+        A connection that was closed by the server while idle
+        is replaced and the request is sent once more.
+        timeout is the socket timeout of this request
+        (default: self.timeout)
+        '''
+        if timeout is None:timeout = self.timeout
+        key = self.server_key(url)
+        u = urlparse.urlparse(url)
+        path = u.path or '/'
+        if u.query:path+='?' + u.query
+        hdrs = dict(headers)
+        hdrs['Connection'] = 'keep-alive'
+        while True:
+            conn, reused = self.get_connection(key)
+            conn.timeout = timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout)
+            try:
+                conn.request('POST', path, body, hdrs)
+                response = conn.getresponse()
+            except socket.timeout:
+                conn.close()
+                raise
+            except (httplib.HTTPException, socket.error):
+                conn.close()
+                if reused:
+                    #Stale keep-alive connection, try with a fresh one
+                    continue
+                raise
+            return key, conn, response
+
+    def finish(self, key, conn, response):
+        '''
+        Returns connection to the pool if the response
+        has been read completely and the server keeps the connection alive
+        '''
+        if response.will_close or not response.isclosed():
+            conn.close()
+        else:
+            self.release_connection(key, conn)
+
+    def urlopen(self, url, body, headers, timeout=None):
+        '''
+        Returns (status, response body)
+        '''
+        key, conn, response = self.send(url, body, headers, timeout=timeout)
+        try:
+            data = response.read()
+        except:
+            conn.close()
+            raise
+        self.finish(key, conn, response)
+        return response.status, data
+
+    def urlopen_stream(self, url, body, headers, timeout=None):
+        '''
+        Returns (status, file like response object).
+        The body is read off the socket on demand.
+        '''
+        key, conn, response = self.send(url, body, headers, timeout=timeout)
+        return response.status, PooledResponse(self, key, conn, response)
+
+class PooledResponse(object):
+    '''
+    File like wrapper around a streamed response of ACISConnectionPool.
+    The connection goes back to the pool once the body has been read
+    completely and close() is called.
+    '''
+    def __init__(self, pool, key, conn, response):
+        self.pool = pool
+        self.key = key
+        self.conn = conn
+        self.response = response
+
+    def read(self, amt=None):
+        try:
+            return self.response.read(amt)
+        except:
+            self.conn.close()
+            raise
+
+    def close(self):
+        if self.conn is None:
+            return
+        self.pool.finish(self.key, self.conn, self.response)
+        self.conn = None
+
+_http_pool = None
+_http_pool_lock = threading.Lock()
+
+def get_http_pool():
+    '''
+    Returns the process wide connection pool used by make_request.
+    Pool size and idle eviction time are set via
+    settings.ACIS_POOL_SIZE and settings.ACIS_POOL_IDLE_TIMEOUT
+    '''
+    global _http_pool
+    with _http_pool_lock:
+        if _http_pool is None:
+            _http_pool = ACISConnectionPool(
+                max_size=getattr(settings, 'ACIS_POOL_SIZE', 4),
+                idle_timeout=getattr(settings, 'ACIS_POOL_IDLE_TIMEOUT', 60)
+            )
+    return _http_pool
+
+#Acis WebServices response cache
+#################################
+#Time to live (seconds) of cached responses by call type
+ACIS_CACHE_TTLS = {
+    'StnMeta':86400,
+    'General':604800,
+    'GridData':604800
+}
+
+def request_key(call_name, params):
+    '''
+    sha1 of call name and canonical (key sorted) JSON of the params,
+    identical requests map to identical keys
+    '''
+    canonical = call_name + ':' + json.dumps(params, sort_keys=True, separators=(',',':'))
+    return hashlib.sha1(canonical).hexdigest()
+
+##############
+#File helpers
+##############
+def atomic_write(path, write, mode='w'):
+    '''
+    Atomically writes the file at path: write(f) writes a temp file
+    in the same directory that then replaces path by rename, so that
+    concurrent readers (other Django/cron processes) never see a partial file.
+    With mode None, write is called with the path of the temp file instead
+    (e.g. for sqlite databases).
+    The directory is created if needed, the temp file removed on errors.
+    '''
+    f_dir = os.path.dirname(path)
+    if f_dir and not os.path.isdir(f_dir):
+        os.makedirs(f_dir)
+    fd, tmp_path = tempfile.mkstemp(dir=f_dir or None, suffix='.tmp')
+    try:
+        os.chmod(tmp_path, 0644)
+        if mode is None:
+            os.close(fd)
+            write(tmp_path)
+        else:
+            with os.fdopen(fd, mode) as f:
+                write(f)
+        os.rename(tmp_path, path)
+    except:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+class WriteCounter(object):
+    '''
+    Thread-safe count of the writes to a file store.
+    due() counts a write and tells on every nth write
+    (starting with the first) that old files should be evicted
+    '''
+    def __init__(self, every=20):
+        self.every = every
+        self.lock = threading.Lock()
+        self.num_writes = 0
+
+    def due(self):
+        with self.lock:
+            self.num_writes+=1
+            return self.num_writes % self.every == 1
+
+def evict_files(paths, ttl=None, max_bytes=None, target_bytes=None):
+    '''
+    Removes the files of paths older than ttl seconds (mtime) and,
+    if the remaining files take up more than max_bytes, the least
+    recently used ones (atime) until they take up at most target_bytes
+    (default max_bytes).
+    Returns number of files removed
+    '''
+    if target_bytes is None:
+        target_bytes = max_bytes
+    now = time.time()
+    entries = []
+    total = 0
+    num_removed = 0
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        if ttl is not None and now - st.st_mtime > ttl:
+            try:
+                os.remove(path)
+                num_removed+=1
+            except OSError:
+                pass
+            continue
+        entries.append((st.st_atime, st.st_size, path))
+        total+=st.st_size
+    if max_bytes is None or total <= max_bytes:
+        return num_removed
+    entries.sort()
+    for atime, size, path in entries:
+        if total <= target_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total-=size
+        num_removed+=1
+    return num_removed
+
+def list_files(f_dir, match):
+    '''
+    Returns paths of the files in f_dir whose names match(file_name)
+    '''
+    try:
+        file_names = os.listdir(f_dir)
+    except OSError:
+        return []
+    return [os.path.join(f_dir, file_name) for file_name in file_names if match(file_name)]
+
+def run_cron_job(name, job):
+    '''
+    Runs job(logger) as cron job logging to stderr under name.
+    job returns the message logged on success or None if the job
+    is switched off in settings, a failed job raises an exception.
+    Exits with status 1 on failure, else 0
+    '''
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.DEBUG)
+    sh = logging.StreamHandler()
+    sh.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    logger.addHandler(sh)
+    start = time.time()
+    try:
+        message = job(logger)
+    except Exception, e:
+        logger.error('%s failed: %s' % (name, str(e)))
+        sys.exit(1)
+    if message is None:
+        logger.info('%s is switched off. Exiting program.' % name)
+    else:
+        logger.info('%s in %.1f seconds.' % (message, time.time() - start))
+    sys.exit(0)
+
+class ACISResponseCache(object):
+    '''
+    On-disk, content-addressed cache of ACIS responses.
+    Entries are keyed on the sha1 of the call name and the
+    canonical (key sorted) JSON of the call parameters.
+    Files are written atomically (write to temp file + rename)
+    so that several Django/cron processes can share the cache directory.
+    Least recently used entries are evicted when the total
+    size of the cache exceeds max_bytes.
+
+    Keyword arguments:
+    cache_dir -- directory holding the cache files
+    ttls      -- dictionary of time to live (seconds) by call type
+    max_bytes -- size bound of the cache directory
+    '''
+    def __init__(self, cache_dir, ttls=None, max_bytes=500*1024*1024):
+        self.cache_dir = cache_dir
+        self.ttls = ttls if ttls is not None else ACIS_CACHE_TTLS
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.writes = WriteCounter()
+        self.stats = defaultdict(lambda: {'hits':0, 'misses':0, 'writes':0})
+        self.stats_evicted = 0
+
+    def call_type(self, call_name):
+        #General/county --> General
+        return call_name.split('/')[0]
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key + '.json')
+
+    def count(self, call_name, counter):
+        with self.lock:
+            self.stats[self.call_type(call_name)][counter]+=1
+
+    def get(self, call_name, params):
+        '''
+        Returns cached response or None if there is no valid entry
+        '''
+        path = self.path(request_key(call_name, params))
+        ttl = self.ttls.get(self.call_type(call_name), 0)
+        try:
+            mtime = os.path.getmtime(path)
+            if time.time() - mtime > ttl:
+                self.count(call_name, 'misses')
+                return None
+            with open(path, 'r') as f:
+                response = json.load(f)
+            #Record access time for LRU eviction, keep mtime for TTL
+            os.utime(path, (time.time(), mtime))
+        except (IOError, OSError, ValueError):
+            self.count(call_name, 'misses')
+            return None
+        self.count(call_name, 'hits')
+        return response
+
+    def set(self, call_name, params, response):
+        path = self.path(request_key(call_name, params))
+        try:
+            atomic_write(path, lambda f: json.dump(response, f))
+        except (IOError, OSError):
+            #Caching is best effort, never fail the ACIS call
+            return
+        self.count(call_name, 'writes')
+        if self.writes.due():
+            self.evict()
+
+    def evict(self):
+        '''
+        Removes least recently used entries until the cache
+        is below 90 percent of self.max_bytes
+        '''
+        paths = list_files(self.cache_dir, lambda f_name: f_name.endswith('.json'))
+        num_evicted = evict_files(paths, max_bytes=self.max_bytes, target_bytes=0.9 * self.max_bytes)
+        with self.lock:
+            self.stats_evicted+=num_evicted
+
+    def get_stats(self):
+        '''
+        Returns hit/miss/write counters by call type.
+        Hits are ACIS round trips saved by this process.
+        '''
+        with self.lock:
+            stats = dict((k, dict(v)) for k, v in self.stats.items())
+            stats['evicted'] = self.stats_evicted
+        return stats
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+def get_response_cache():
+    '''
+    Returns the process wide response cache or None
+    if caching is switched off via settings.ACIS_CACHE_DIR = None
+    Cache location, TTLs and size bound are set via
+    settings.ACIS_CACHE_DIR, settings.ACIS_CACHE_TTLS and
+    settings.ACIS_CACHE_MAX_BYTES
+    '''
+    global _response_cache
+    with _response_cache_lock:
+        if _response_cache is None:
+            cache_dir = getattr(settings, 'ACIS_CACHE_DIR', settings.TEMP_DIR + 'acis_cache/')
+            if cache_dir is None:
+                return None
+            _response_cache = ACISResponseCache(
+                cache_dir,
+                ttls=getattr(settings, 'ACIS_CACHE_TTLS', ACIS_CACHE_TTLS),
+                max_bytes=getattr(settings, 'ACIS_CACHE_MAX_BYTES', 500*1024*1024)
+            )
+    return _response_cache
+
+def get_cache_stats():
+    cache = get_response_cache()
+    if cache is None:
+        return {}
+    return cache.get_stats()
+
+def is_cacheable(acis_call, params):
+    '''
+    Metadata calls are cacheable:
+    StnMeta, General and GridData calls that only ask for
+    the grid meta data (ll, elev) of a single day.
+    GridData calls asking for elems are never cached, the data values
+    may still be provisional
+    '''
+    if acis_call in ['StnMeta', 'General']:
+        return True
+    if acis_call == 'GridData':
+        if 'meta' not in params.keys() or 'elems' in params.keys():
+            return False
+        if 'date' in params.keys():
+            return True
+        if 'sdate' in params.keys() and 'edate' in params.keys():
+            return params['sdate'] == params['edate']
+    return False
+
+def cached_call(call_name, params, request_function):
+    '''
+    Returns cached response for call_name, params if present,
+    else calls request_function() and caches successful responses.
+    Responses of a stand-in server are never cached
+    '''
+    cache = None
+    if is_cacheable(call_name.split('/')[0], params) and not getattr(settings, 'ACIS_STAND_IN_URL', None):
+        cache = get_response_cache()
+    if cache is None:
+        return request_function()
+    req = cache.get(call_name, params)
+    if req is not None:
+        return req
+    req = request_function()
+    if req and not 'error' in req.keys():
+        cache.set(call_name, params, req)
+    return req
+
+#Acis single flight
+####################
+class _Flight(object):
+    '''
+    One in-flight ACIS call shared by all threads asking for it
+    '''
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+        self.num_waiting = 0
+
+class ACISSingleFlight(object):
+    '''
+    Coalesces concurrent identical ACIS calls.
+    Calls are keyed on the call name and the canonical (key sorted)
+    JSON of the call parameters. The first thread asking for a key
+    makes the ACIS call, all threads asking for the same key while the
+    call is in flight wait for it and get (a copy of) its response.
+    If lock_dir is set, identical calls of other processes
+    (Django workers, cron jobs) are coalesced via lock files as well.
+
+    Keyword arguments:
+    lock_dir   -- directory for lock and result files (None: in-process only)
+    result_ttl -- seconds result files are kept for waiting processes
+    '''
+    def __init__(self, lock_dir=None, result_ttl=60):
+        self.lock_dir = lock_dir
+        self.result_ttl = result_ttl
+        self.lock = threading.Lock()
+        self.flights = {}
+        self.writes = WriteCounter()
+        self.stats = {'calls':0, 'shared':0, 'shared_across_processes':0}
+
+    def count(self, counter):
+        with self.lock:
+            self.stats[counter]+=1
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats)
+
+    def wait(self, flight):
+        '''
+        Waits for flight to land, honoring the deadline of the current job
+        '''
+        while not flight.done.is_set():
+            deadline = current_deadline()
+            if deadline is None or deadline.at is None:
+                flight.done.wait(1.0)
+                continue
+            left = deadline.time_left()
+            if left <= 0:
+                raise deadline.error()
+            flight.done.wait(min(left, 1.0))
+
+    def do(self, call_name, params, request_function):
+        '''
+        Returns response of request_function(), shared with all
+        concurrent callers asking for the same call_name, params
+        '''
+        key = request_key(call_name, params)
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self.flights[key] = flight
+            else:
+                flight.num_waiting+=1
+        if not leader:
+            self.count('shared')
+            self.wait(flight)
+            if flight.error is not None:
+                raise flight.error
+            #Callers may modify their response
+            return copy.deepcopy(flight.response)
+        self.count('calls')
+        try:
+            if self.lock_dir:
+                flight.response = self.do_locked(key, request_function)
+            else:
+                flight.response = request_function()
+        except Exception, e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+        if flight.num_waiting:
+            return copy.deepcopy(flight.response)
+        return flight.response
+
+    def do_locked(self, key, request_function):
+        '''
+        Cross-process single flight:
+        the process holding the lock file of key makes the call and
+        leaves its response in a result file for the waiting processes
+        '''
+        lock_path = os.path.join(self.lock_dir, key + '.lock')
+        result_path = os.path.join(self.lock_dir, key + '.json')
+        try:
+            if not os.path.isdir(self.lock_dir):
+                os.makedirs(self.lock_dir)
+            lock_file = open(lock_path, 'a')
+        except (IOError, OSError):
+            return request_function()
+        try:
+            started = time.time()
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                waited = False
+            except IOError:
+                waited = True
+                while True:
+                    check_deadline()
+                    time.sleep(0.05)
+                    try:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        break
+                    except IOError:
+                        continue
+            if waited:
+                #Another process made the call while we were waiting
+                response = self.read_result(result_path, started)
+                if response is not None:
+                    self.count('shared_across_processes')
+                    return response
+            response = request_function()
+            if response and not 'error' in response.keys():
+                self.write_result(result_path, response)
+            return response
+        finally:
+            lock_file.close()
+
+    def read_result(self, result_path, not_before):
+        try:
+            if os.path.getmtime(result_path) < not_before - 1:
+                return None
+            with open(result_path, 'r') as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def write_result(self, result_path, response):
+        try:
+            atomic_write(result_path, lambda f: json.dump(response, f))
+        except (IOError, OSError):
+            return
+        if self.writes.due():
+            self.remove_old_results()
+
+    def remove_old_results(self):
+        paths = list_files(self.lock_dir, lambda file_name: file_name.endswith('.json'))
+        evict_files(paths, ttl=self.result_ttl)
+
+_single_flight = None
+_single_flight_lock = threading.Lock()
+
+def get_single_flight():
+    '''
+    Returns the process wide single flight group.
+    Cross-process coalescing is switched on by setting
+    settings.ACIS_SINGLE_FLIGHT_DIR to a directory shared by the processes
+    '''
+    global _single_flight
+    with _single_flight_lock:
+        if _single_flight is None:
+            _single_flight = ACISSingleFlight(
+                lock_dir=getattr(settings, 'ACIS_SINGLE_FLIGHT_DIR', None),
+                result_ttl=getattr(settings, 'ACIS_SINGLE_FLIGHT_RESULT_TTL', 60)
+            )
+    return _single_flight
+
+def single_flight_call(call_name, params, request_function):
+    return get_single_flight().do(call_name, params, request_function)
+
+#Acis server health
+####################
+class ACISServerHealth(object):
+    '''
+    Thread-safe latency and error tracking for ACIS servers
+    with a circuit breaker per server.
+    A server's circuit opens after failure_threshold consecutive
+    failures. While open, the server is only used as a last resort.
+    After open_seconds one trial request is let through (half open);
+    a success closes the circuit again.
+
+    Keyword arguments:
+    window            -- number of latencies kept per server and call
+    failure_threshold -- consecutive failures that open the circuit
+    open_seconds      -- time the circuit stays open
+    min_samples       -- latencies needed before a hedge delay is computed
+    '''
+    def __init__(self, window=50, failure_threshold=3, open_seconds=30, min_samples=10):
+        self.window = window
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.min_samples = min_samples
+        self.lock = threading.Lock()
+        #(server, acis_call) --> list of latest latencies
+        self.latencies = defaultdict(list)
+        self.failures = defaultdict(int)
+        self.open_until = {}
+        self.stats = defaultdict(lambda: {'successes':0, 'failures':0, 'hedges':0})
+
+    def record_success(self, server, acis_call, latency):
+        with self.lock:
+            lats = self.latencies[(server, acis_call)]
+            lats.append(latency)
+            if len(lats) > self.window:
+                del lats[0]
+            self.failures[server] = 0
+            if server in self.open_until.keys():
+                del self.open_until[server]
+            self.stats[server]['successes']+=1
+
+    def record_failure(self, server):
+        with self.lock:
+            self.failures[server]+=1
+            self.stats[server]['failures']+=1
+            if self.failures[server] >= self.failure_threshold:
+                self.open_until[server] = time.time() + self.open_seconds
+
+    def record_hedge(self, server):
+        with self.lock:
+            self.stats[server]['hedges']+=1
+
+    def is_available(self, server, now=None):
+        if now is None:now = time.time()
+        with self.lock:
+            return self.open_until.get(server, 0) <= now
+
+    def median_latency(self, server, acis_call):
+        with self.lock:
+            lats = sorted(self.latencies.get((server, acis_call), []))
+        if not lats:
+            #Unknown servers are tried first so that they get measured
+            return 0.0
+        return lats[len(lats) / 2]
+
+    def hedge_delay(self, server, acis_call, percentile):
+        '''
+        Returns the percentile latency of server for acis_call
+        or None if there are not enough measurements
+        '''
+        with self.lock:
+            lats = sorted(self.latencies.get((server, acis_call), []))
+        if len(lats) < self.min_samples:
+            return None
+        idx = int(math.ceil(percentile / 100.0 * len(lats))) - 1
+        return lats[max(0, min(idx, len(lats) - 1))]
+
+    def order_servers(self, servers, acis_call):
+        '''
+        Returns servers with closed circuit ordered by median latency,
+        followed by servers with open circuit
+        '''
+        now = time.time()
+        healthy = [s for s in servers if self.is_available(s, now=now)]
+        broken = [s for s in servers if s not in healthy]
+        healthy.sort(key=lambda s: self.median_latency(s, acis_call))
+        return healthy + broken
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict((s, dict(v)) for s, v in self.stats.items())
+            for s in stats.keys():
+                stats[s]['circuit_open'] = self.open_until.get(s, 0) > time.time()
+        return stats
+
+_server_health = ACISServerHealth(
+    failure_threshold=getattr(settings, 'ACIS_CIRCUIT_FAILURES', 3),
+    open_seconds=getattr(settings, 'ACIS_CIRCUIT_OPEN_SECONDS', 30)
+)
+
+def get_server_health():
+    return _server_health
+
+def get_acis_servers(params):
+    '''
+    Returns the ACIS servers that can answer a request.
+    Grids 22 - 41 are only served by settings.ACIS_GRID_SERVERS.
+    If settings.ACIS_STAND_IN_URL is set, all requests go to
+    that local stand-in server (see AcisStandIn.py)
+    '''
+    stand_in = getattr(settings, 'ACIS_STAND_IN_URL', None)
+    if stand_in:
+        return [stand_in]
+    #need special call for grids 22 - 41
+    if 'grid' in params.keys() and int(params['grid']) in range(22,42):
+        return getattr(settings, 'ACIS_GRID_SERVERS', ['http://grid.rcc-acis.org/'])
+    return settings.ACIS_SERVERS
+
+def get_acis_base_url():
+    stand_in = getattr(settings, 'ACIS_STAND_IN_URL', None)
+    if stand_in:
+        return stand_in
+    return settings.ACIS_BASE_URL
+
+def timed_request(url, acis_call, params, request_function=None):
+    '''
+    Runs request_function (default make_request) against server url
+    and records latency or failure of the server
+    '''
+    if request_function is None:
+        request_function = make_request
+    start = time.time()
+    try:
+        req = request_function(url + acis_call, params)
+    except Exception:
+        _server_health.record_failure(url)
+        raise
+    _server_health.record_success(url, acis_call, time.time() - start)
+    return req
+
+def _hedged_call(acis_call, params, servers, hedge_after):
+    '''
+    Sends the request to servers[0]. If there is no answer after
+    hedge_after seconds, a duplicate request is sent to servers[1].
+    Failed requests fail over to the next server.
+    The first successful response wins.
+    '''
+    results = Queue.Queue()
+    deadline = current_deadline()
+
+    def run(url):
+        try:
+            results.put(run_with_deadline(deadline, timed_request, url, acis_call, params))
+        except Exception:
+            results.put(None)
+
+    req = {}
+    next_idx = 0;pending = 0;hedged = False
+    while True:
+        if pending == 0:
+            check_deadline()
+            if next_idx >= len(servers) or (next_idx > 0 and not use_retry()):
+                return req
+            t = threading.Thread(target=run, args=(servers[next_idx],))
+            t.daemon = True
+            t.start()
+            next_idx+=1;pending+=1
+        if not hedged and next_idx < len(servers):
+            timeout = hedge_after
+        else:
+            timeout = None
+        if deadline is not None and deadline.at is not None:
+            left = max(0, deadline.time_left())
+            if timeout is None or left < timeout:
+                timeout = left
+        try:
+            r = results.get(True, timeout)
+        except Queue.Empty:
+            check_deadline()
+            if not use_retry():
+                hedged = True
+                continue
+            #Primary is slow, send hedged duplicate
+            _server_health.record_hedge(servers[next_idx])
+            t = threading.Thread(target=run, args=(servers[next_idx],))
+            t.daemon = True
+            t.start()
+            next_idx+=1;pending+=1;hedged = True
+            continue
+        pending-=1
+        if r and not 'error' in r.keys():
+            return r
+        if r is not None:
+            req = r
+
 #Acis WebServices functions
 ###########################
-def make_request(url,params) :
+def make_request_no_pool(url,params) :
+    '''
+    Original urllib2 implementation, opens a new
+    connection for each request
+    '''
     req = urllib2.Request(url,
     json.dumps(params),
     {'Content-Type':'application/json'})
@@ -42,27 +1060,1032 @@ def make_request(url,params) :
         #if error.code == 400 : print error.msg
         return None
 
+def make_request(url,params) :
+    timeout = call_timeout()
+    try:
+        status, data = get_http_pool().urlopen(url, json.dumps(params),
+            {'Content-Type':'application/json'}, timeout=timeout)
+    except socket.timeout:
+        check_deadline()
+        raise ACISTimeoutError('ACIS request to %s timed out after %.0f seconds.' % (url, timeout))
+    if status >= 400:
+        #if status == 400 : print data
+        return None
+    return json.loads(data)
+
 def DataCall(acis_call, params):
+    return cached_call(acis_call, params,
+        lambda: single_flight_call(acis_call, params, lambda: _data_call(acis_call, params)))
+
+def _data_call(acis_call, params):
+    '''
+    Routes the request to the fastest healthy ACIS server.
+    If settings.ACIS_HEDGE_PERCENTILE is set, a hedged duplicate request
+    is sent to the next server when the first one has not answered
+    within that latency percentile.
+    '''
     req = {}
-    #need special call for grids 22 - 41
-    if 'grid' in params.keys() and int(params['grid']) in range(22,42):
-        servers =  ['http://grid.rcc-acis.org/']
-    else:
-        servers = settings.ACIS_SERVERS
-    for url in servers:
+    servers = _server_health.order_servers(get_acis_servers(params), acis_call)
+    percentile = getattr(settings, 'ACIS_HEDGE_PERCENTILE', None)
+    if percentile and len(servers) > 1:
+        hedge_after = _server_health.hedge_delay(servers[0], acis_call, percentile)
+        if hedge_after is not None:
+            return _hedged_call(acis_call, params, servers, hedge_after)
+    for s_idx, url in enumerate(servers):
+        if s_idx > 0 and not use_retry():
+            break
         try:
-            req = make_request(url + acis_call,params)
+            req = timed_request(url, acis_call, params)
             if req and not 'error' in req.keys():
                 return req
+            else:
+                continue
+        except Exception:
+            check_deadline()
+            continue
+    check_deadline()
+    return req
+
+
+#Start of a streamable ACIS response: {"data":[
+_STREAM_START_RE = re.compile(r'\s*\{\s*"data"\s*:\s*\[')
+_STREAM_SKIP_RE = re.compile(r'[\s,]*')
+
+def iter_stream_items(f, buf, pos, chunk_size=65536, deadline=None):
+    '''
+    Generator that incrementally parses the items of a JSON array
+    read from file like object f and yields one item at a time.
+    buf holds the data already read from f, pos is
+    the index in buf just after the opening bracket of the array.
+    Only the item currently being parsed is kept in memory.
+    If deadline (ACISDeadline) is given, parsing stops with
+    ACISTimeoutError once the deadline has passed.
+    '''
+    decoder = json.JSONDecoder()
+    eof = False
+    try:
+        while True:
+            if deadline is not None and deadline.expired():
+                raise deadline.error()
+            #Skip separators, read more if buffer is exhausted
+            pos = _STREAM_SKIP_RE.match(buf, pos).end()
+            while pos >= len(buf) and not eof:
+                chunk = f.read(chunk_size)
+                if chunk:
+                    buf = buf[pos:] + chunk;pos = 0
+                    pos = _STREAM_SKIP_RE.match(buf, pos).end()
+                else:
+                    eof = True
+            if pos >= len(buf):
+                raise ValueError('Incomplete ACIS response.')
+            if buf[pos] == ']':
                 break
+            while True:
+                try:
+                    item, end = decoder.raw_decode(buf, pos)
+                    break
+                except ValueError:
+                    if eof:
+                        raise
+                #Item is incomplete, at least double the
+                #buffered part of the item before trying again
+                chunks = [buf[pos:]]
+                need = 2 * len(chunks[0]);have = len(chunks[0])
+                while not eof and have < need:
+                    chunk = f.read(chunk_size)
+                    if chunk:
+                        chunks.append(chunk);have+=len(chunk)
+                    else:
+                        eof = True
+                buf = ''.join(chunks);pos = 0
+            buf = buf[end:];pos = 0
+            yield item
+        #Drain rest of response so that the connection can be reused
+        while not eof and f.read(chunk_size):
+            pass
+    finally:
+        f.close()
+
+def make_request_stream(url, params, chunk_size=65536):
+    '''
+    Streaming version of make_request.
+    If ACIS returns a data array, the response dictionary's
+    'data' entry is a generator yielding one record (e.g. one station
+    with meta and data) at a time as it is parsed off the socket.
+    All other responses (e.g. errors) are parsed as a whole.
+    '''
+    timeout = call_timeout()
+    try:
+        status, f = get_http_pool().urlopen_stream(url, json.dumps(params),
+            {'Content-Type':'application/json'}, timeout=timeout)
+    except socket.timeout:
+        check_deadline()
+        raise ACISTimeoutError('ACIS request to %s timed out after %.0f seconds.' % (url, timeout))
+    if status >= 400:
+        f.close()
+        return None
+    buf = ''
+    while len(buf) < 64:
+        chunk = f.read(chunk_size)
+        if not chunk:break
+        buf+=chunk
+    m = _STREAM_START_RE.match(buf)
+    if m is None:
+        try:
+            buf+= f.read()
+        finally:
+            f.close()
+        return json.loads(buf)
+    return {'data':iter_stream_items(f, buf, m.end(), chunk_size=chunk_size,
+        deadline=current_deadline())}
+
+def DataCallStream(acis_call, params):
+    '''
+    Like DataCall but the 'data' entry of the response
+    is a generator, see make_request_stream.
+    Note: the data generator can only be iterated over once
+    '''
+    req = {}
+    servers = _server_health.order_servers(get_acis_servers(params), acis_call)
+    for s_idx, url in enumerate(servers):
+        if s_idx > 0 and not use_retry():
+            break
+        try:
+            req = timed_request(url, acis_call, params, request_function=make_request_stream)
+            if req and not 'error' in req.keys():
+                return req
             else:
                 continue
-        except:
+        except Exception:
+            check_deadline()
             continue
+    check_deadline()
     return req
 
+def DataCallMulti(acis_call, params_list, max_workers=None):
+    '''
+    Runs one DataCall per parameter dictionary in params_list
+    on a bounded pool of worker threads.
+    Results are returned in input order. Items that fail
+    are returned as {'error':<error message>} so that one failed
+    call does not affect the others.
+
+    Keyword arguments:
+    acis_call   -- ACIS call name, e.g. GridData
+    params_list -- list of ACIS parameter dictionaries
+    max_workers -- max number of concurrent ACIS calls
+                   (default settings.ACIS_MAX_WORKERS or 8)
+    '''
+    results = [None for params in params_list]
+    if not params_list:
+        return results
+    if max_workers is None:
+        max_workers = getattr(settings, 'ACIS_MAX_WORKERS', 8)
+    num_workers = max(1, min(int(max_workers), len(params_list)))
+    idx_queue = Queue.Queue()
+    for idx in range(len(params_list)):
+        idx_queue.put(idx)
+    deadline = current_deadline()
+
+    def worker():
+        while True:
+            try:
+                idx = idx_queue.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                req = DataCall(acis_call, params_list[idx])
+            except Exception, e:
+                req = {'error':str(e)}
+            if not req:
+                req = {'error':'No data found for these parameters.'}
+            results[idx] = req
+
+    if num_workers == 1:
+        worker()
+        return results
+    threads = [threading.Thread(target=run_with_deadline, args=(deadline, worker)) for w in range(num_workers)]
+    for t in threads:
+        t.daemon = True
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+#Acis request splitting
+########################
+#Max number of (point x day x variable) cells requested in a single call
+ACIS_MAX_CELLS_PER_REQUEST = 2000000
+#Rough number of stations/grid points of area requests
+#that can not be counted before the request is made
+ACIS_POINT_ESTIMATES = {
+    'state':2000,
+    'county':50,
+    'climdiv':150,
+    'cwa':200,
+    'basin':100,
+    'bbox':500,
+    'grid':50000
+}
+#Element options that do not change when the date range is split
+_DATE_SPLIT_ELEM_KEYS = ['vX', 'vN', 'name', 'add', 'base', 'prec', 'units', 'interval', 'duration']
+
+def _elems_list(params):
+    elems = params.get('elems', [])
+    if isinstance(elems, basestring):
+        return [el for el in elems.replace(' ','').split(',') if el]
+    return list(elems)
+
+def _sids_list(params):
+    sids = params.get('sids', [])
+    if isinstance(sids, basestring):
+        return [sid for sid in sids.replace(' ','').split(',') if sid]
+    return list(sids)
+
+def _date_range(params):
+    '''
+    Returns start, end datetime of request or None, None
+    '''
+    if 'sdate' not in params.keys() or 'edate' not in params.keys():
+        return None, None
+    try:
+        s = WRCCUtils.date_to_datetime(str(params['sdate']))
+        e = WRCCUtils.date_to_datetime(str(params['edate']))
+    except ValueError:
+        return None, None
+    if s is None or e is None or e < s:
+        return None, None
+    return s, e
+
+def date_splittable(params):
+    '''
+    Daily requests without summaries can be split into date ranges
+    '''
+    s, e = _date_range(params)
+    if s is None:
+        return False
+    if 'groupby' in params.keys() or 'area_reduce' in params.keys():
+        return False
+    for el in _elems_list(params):
+        if not isinstance(el, dict):
+            continue
+        for key, val in el.items():
+            if key not in _DATE_SPLIT_ELEM_KEYS:
+                return False
+            if key in ['interval', 'duration'] and val not in ['dly', 1, '1']:
+                return False
+    return True
+
+def estimate_request_size(acis_call, params):
+    '''
+    Returns estimated number of points, days, variables of request
+    '''
+    num_els = max(1, len(_elems_list(params)))
+    s, e = _date_range(params)
+    if s is not None:
+        num_days = (e - s).days + 1
+    else:
+        num_days = 1
+    estimates = getattr(settings, 'ACIS_POINT_ESTIMATES', ACIS_POINT_ESTIMATES)
+    if acis_call == 'GridData':
+        if 'loc' in params.keys():
+            num_points = 1
+        elif 'bbox' in params.keys():
+            num_lats, num_lons = WRCCUtils.find_num_lls(params['bbox'], str(params['grid']))
+            num_points = max(1, int(num_lats)) * max(1, int(num_lons))
+        else:
+            num_points = estimates['grid']
+    elif acis_call == 'MultiStnData':
+        if 'sids' in params.keys():
+            num_points = len(_sids_list(params))
+        else:
+            num_points = estimates['bbox']
+            for key in ['state', 'county', 'climdiv', 'cwa', 'basin']:
+                if key in params.keys():
+                    num_points = estimates[key]
+                    break
+    else:
+        num_points = 1
+    return num_points, num_days, num_els
+
+def _split_dates(params, num_pieces):
+    s, e = _date_range(params)
+    num_days = (e - s).days + 1
+    num_pieces = max(1, min(num_pieces, num_days))
+    days_per_piece = int(math.ceil(num_days / float(num_pieces)))
+    date_ranges = []
+    start = s
+    while start <= e:
+        end = min(e, start + datetime.timedelta(days=days_per_piece - 1))
+        date_ranges.append([start.strftime('%Y%m%d'), end.strftime('%Y%m%d')])
+        start = end + datetime.timedelta(days=1)
+    return date_ranges
+
+def split_request(acis_call, params, max_cells=None):
+    '''
+    Partitions a MultiStnData, StnData or GridData request
+    into smaller requests based on the estimated number of
+    (point x day x variable) cells.
+    MultiStnData requests are split into batches of sids,
+    GridData bbox requests into latitude bands (tiles),
+    daily requests without summaries into date ranges.
+    Returns list of lists of parameter dictionaries
+    pieces[space_idx][date_idx]
+    '''
+    if max_cells is None:
+        max_cells = getattr(settings, 'ACIS_MAX_CELLS_PER_REQUEST', ACIS_MAX_CELLS_PER_REQUEST)
+    num_points, num_days, num_els = estimate_request_size(acis_call, params)
+    num_pieces = int(math.ceil(num_points * num_days * num_els / float(max_cells)))
+    if num_pieces <= 1:
+        return [[params]]
+    #Split along space first
+    space_params = [params]
+    if acis_call == 'MultiStnData' and 'sids' in params.keys():
+        sids = _sids_list(params)
+        num_space = min(num_pieces, len(sids))
+        batch_size = int(math.ceil(len(sids) / float(num_space)))
+        space_params = []
+        for idx in range(0, len(sids), batch_size):
+            p = dict(params)
+            p['sids'] = ','.join(sids[idx:idx + batch_size])
+            space_params.append(p)
+    elif acis_call == 'GridData' and 'bbox' in params.keys() and not 'area_reduce' in params.keys():
+        bbox = params['bbox']
+        if isinstance(bbox, basestring):
+            bbox = bbox.replace(' ','').split(',')
+        W, S, E, N = [float(b) for b in bbox]
+        num_lats, num_lons = WRCCUtils.find_num_lls(params['bbox'], str(params['grid']))
+        num_space = max(1, min(num_pieces, int(num_lats) / 2))
+        space_params = []
+        for idx in range(num_space):
+            p = dict(params)
+            s_lat = S + idx * (N - S) / num_space
+            n_lat = S + (idx + 1) * (N - S) / num_space
+            p['bbox'] = '%s,%s,%s,%s' % (repr(W), repr(s_lat), repr(E), repr(n_lat))
+            space_params.append(p)
+    #Split along dates if pieces are still too large
+    num_dates = int(math.ceil(num_pieces / float(len(space_params))))
+    pieces = []
+    for p in space_params:
+        if num_dates <= 1 or not date_splittable(p):
+            pieces.append([p])
+            continue
+        date_pieces = []
+        for sdate, edate in _split_dates(p, num_dates):
+            dp = dict(p)
+            dp['sdate'] = sdate;dp['edate'] = edate
+            date_pieces.append(dp)
+        pieces.append(date_pieces)
+    return pieces
+
+def _station_key(stn_data):
+    meta = stn_data.get('meta', {})
+    if 'uid' in meta.keys():
+        return meta['uid']
+    return tuple(meta.get('sids', []))
+
+def _missing_like(row):
+    if isinstance(row, list):
+        return [_missing_like(v) for v in row]
+    return 'M'
+
+def _merge_station_dates(responses, date_pieces):
+    '''
+    Joins the date ranges of a MultiStnData request station by station.
+    Stations missing from a date range get missing values for that range.
+    '''
+    stations = []
+    data_by_key = {}
+    for d_idx, req in enumerate(responses):
+        for stn_data in req.get('data', []):
+            key = _station_key(stn_data)
+            if key not in data_by_key.keys():
+                data_by_key[key] = [None for r in responses]
+                stations.append([key, stn_data])
+            data_by_key[key][d_idx] = stn_data.get('data', [])
+    merged = []
+    for key, stn_data in stations:
+        stn = dict(stn_data)
+        stn['data'] = []
+        row_template = None
+        for rows in data_by_key[key]:
+            if rows:
+                row_template = rows[0]
+                break
+        for d_idx, rows in enumerate(data_by_key[key]):
+            if rows is None:
+                s, e = _date_range(date_pieces[d_idx])
+                num_days = (e - s).days + 1
+                rows = [_missing_like(row_template) for day in range(num_days)]
+            stn['data']+= rows
+        merged.append(stn)
+    return {'data':merged}
+
+def _merge_dates(responses):
+    '''
+    Joins the date ranges of a StnData or GridData request
+    '''
+    merged = dict(responses[0])
+    merged['data'] = []
+    for req in responses:
+        merged['data']+= req.get('data', [])
+    return merged
+
+def _stitch_rows(grids, keep_rows):
+    rows = []
+    for t_idx, grid in enumerate(grids):
+        rows+= [row for r_idx, row in enumerate(grid) if r_idx in keep_rows[t_idx]]
+    return rows
+
+def _merge_tiles(responses):
+    '''
+    Joins GridData latitude bands into one grid.
+    Grid rows on a shared band boundary are only kept once.
+    '''
+    tiles = [req for req in responses if req.get('meta', {}).get('lat')]
+    if not tiles:
+        return responses[0]
+    #Order bands the same way ACIS orders the rows within a band
+    ascending = True
+    for req in tiles:
+        lats = req['meta']['lat']
+        if len(lats) > 1:
+            ascending = lats[0][0] < lats[-1][0]
+            break
+    tiles.sort(key=lambda req: req['meta']['lat'][0][0], reverse=not ascending)
+    keep_rows = []
+    last_lat = None
+    for req in tiles:
+        keep = set()
+        for r_idx, row in enumerate(req['meta']['lat']):
+            if last_lat is not None and abs(row[0] - last_lat) < 1e-6:
+                continue
+            keep.add(r_idx)
+            last_lat = row[0]
+        keep_rows.append(keep)
+    merged = dict(tiles[0])
+    merged['meta'] = dict(tiles[0]['meta'])
+    for key in ['lat', 'lon', 'elev']:
+        if key in tiles[0]['meta'].keys():
+            merged['meta'][key] = _stitch_rows([req['meta'][key] for req in tiles], keep_rows)
+    if 'data' in tiles[0].keys():
+        merged['data'] = []
+        for d_idx, date_data in enumerate(tiles[0]['data']):
+            row = [date_data[0]]
+            for el_idx in range(1, len(date_data)):
+                row.append(_stitch_rows([req['data'][d_idx][el_idx] for req in tiles], keep_rows))
+            merged['data'].append(row)
+    if 'smry' in tiles[0].keys():
+        merged['smry'] = []
+        for el_idx in range(len(tiles[0]['smry'])):
+            merged['smry'].append(_stitch_rows([req['smry'][el_idx] for req in tiles], keep_rows))
+    return merged
+
+def merge_responses(acis_call, pieces, responses):
+    '''
+    Merges responses[space_idx][date_idx] of the pieces made by
+    split_request back into the response of the original request.
+    '''
+    space_merged = []
+    for s_idx, date_responses in enumerate(responses):
+        if len(date_responses) == 1:
+            space_merged.append(date_responses[0])
+        elif acis_call == 'MultiStnData':
+            space_merged.append(_merge_station_dates(date_responses, pieces[s_idx]))
+        else:
+            space_merged.append(_merge_dates(date_responses))
+    if len(space_merged) == 1:
+        return space_merged[0]
+    if acis_call == 'MultiStnData':
+        merged = {'data':[]}
+        for req in space_merged:
+            merged['data']+= req.get('data', [])
+        return merged
+    if acis_call == 'GridData':
+        return _merge_tiles(space_merged)
+    return space_merged[0]
+
+def _piece_failed(req):
+    if not req or 'error' in req.keys():
+        return True
+    return not 'data' in req.keys() and not 'smry' in req.keys()
+
+def request_needs_split(acis_call, params, max_cells=None):
+    return len([p for ps in split_request(acis_call, params, max_cells=max_cells) for p in ps]) > 1
+
+def DataCallSplit(acis_call, params, max_cells=None, max_retries=None):
+    '''
+    Splits an oversized ACIS request into pieces (see split_request),
+    runs the pieces concurrently and merges the results into
+    the response shape of the original request.
+    Failed pieces are retried individually up to max_retries
+    (default settings.ACIS_SPLIT_RETRIES or 2) times.
+    '''
+    pieces = split_request(acis_call, params, max_cells=max_cells)
+    flat = [(s_idx, d_idx) for s_idx, ps in enumerate(pieces) for d_idx in range(len(ps))]
+    if len(flat) == 1:
+        return DataCall(acis_call, params)
+    if max_retries is None:
+        max_retries = getattr(settings, 'ACIS_SPLIT_RETRIES', 2)
+    responses = [[None for p in ps] for ps in pieces]
+    todo = flat
+    for attempt in range(max_retries + 1):
+        reqs = DataCallMulti(acis_call, [pieces[s_idx][d_idx] for s_idx, d_idx in todo])
+        failed = []
+        for idx, req in enumerate(reqs):
+            s_idx, d_idx = todo[idx]
+            responses[s_idx][d_idx] = req
+            if _piece_failed(req):
+                failed.append(todo[idx])
+        todo = failed
+        if not todo:
+            break
+        #Retry failed pieces while the retry budget of the job lasts
+        if attempt == max_retries or len([piece for piece in todo if use_retry()]) < len(todo):
+            break
+    if todo:
+        s_idx, d_idx = todo[0]
+        req = responses[s_idx][d_idx]
+        error = req.get('error', 'No data found.') if req else 'No data found.'
+        return {'error':'%s of %s request pieces failed. Error: %s' % (len(todo), len(flat), str(error))}
+    return merge_responses(acis_call, pieces, responses)
+
+#Station metadata snapshot
+###########################
+#Variables (vX) whose valid_daterange is kept in the snapshot
+SNAPSHOT_VX = [1, 2, 43, 3, 4, 10, 11, 7, 45, 44, 12]
+SNAPSHOT_META = 'name,state,sids,ll,elev,uid,county,climdiv,cwa,basin,valid_daterange'
+#Meta keys ACIS returns if a StnMeta request does not list any
+SNAPSHOT_DEFAULT_META = ['name', 'state', 'sids', 'll', 'elev', 'uid']
+SNAPSHOT_AREAS = ['state', 'county', 'climdiv', 'cwa', 'basin']
+SNAPSHOT_SCHEMA = [
+    'CREATE TABLE info (key TEXT PRIMARY KEY, value TEXT)',
+    'CREATE TABLE stations (uid INTEGER PRIMARY KEY, name TEXT, state TEXT, sids TEXT, '\
+    'lon REAL, lat REAL, elev REAL, county TEXT, climdiv TEXT, cwa TEXT, basin TEXT)',
+    'CREATE TABLE sids (sid TEXT, network TEXT, uid INTEGER)',
+    'CREATE TABLE ranges (uid INTEGER, vX INTEGER, start TEXT, end TEXT)',
+    'CREATE VIRTUAL TABLE stn_rtree USING rtree(id, min_lon, max_lon, min_lat, max_lat)',
+    'CREATE INDEX stations_state ON stations (state)',
+    'CREATE INDEX stations_county ON stations (county)',
+    'CREATE INDEX stations_climdiv ON stations (climdiv)',
+    'CREATE INDEX stations_cwa ON stations (cwa)',
+    'CREATE INDEX stations_basin ON stations (basin)',
+    'CREATE INDEX sids_sid ON sids (sid)',
+    'CREATE INDEX ranges_uid ON ranges (uid, vX)'
+]
+
+def _param_list(val):
+    if isinstance(val, (list, tuple)):
+        return [str(v).strip() for v in val]
+    return [v.strip() for v in str(val).split(',') if v.strip()]
+
+class ACISStationSnapshot(object):
+    '''
+    Local SQLite snapshot of the ACIS station metadata of all US stations:
+    sids, ll, elev, state, county/climdiv/cwa/basin membership and
+    valid_daterange of the SNAPSHOT_VX variables.
+    Stations are indexed by area and by location (R-tree) so that
+    StnMeta questions are answered locally in milliseconds.
+    The snapshot is rebuilt nightly by station_meta_snapshot.py.
+
+    Keyword arguments:
+    path -- path of the SQLite snapshot file
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.mtime = os.path.getmtime(path)
+        self.vX_list = [int(v) for v in self.info('vX').split(',')]
+
+    def info(self, key):
+        with self.lock:
+            row = self.conn.execute('SELECT value FROM info WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def age(self):
+        return time.time() - float(self.info('created'))
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    @staticmethod
+    def build(path, states=None, logger=None):
+        '''
+        Requests the metadata of all stations, state by state,
+        from ACIS and atomically replaces the snapshot at path.
+        Returns number of stations in the snapshot
+        '''
+        if states is None:
+            states = sorted(set(WRCCData.STATE_CHOICES))
+        uids = set()
+        atomic_write(path, lambda tmp_path: ACISStationSnapshot.fill(tmp_path, states, uids, logger), mode=None)
+        return len(uids)
+
+    @staticmethod
+    def fill(db_path, states, uids, logger=None):
+        '''
+        Writes the snapshot database at db_path,
+        adds the uids of the stations to uids
+        '''
+        conn = sqlite3.connect(db_path)
+        try:
+            for statement in SNAPSHOT_SCHEMA:
+                conn.execute(statement)
+            params = {'meta':SNAPSHOT_META, 'elems':','.join([str(v) for v in SNAPSHOT_VX])}
+            for state in states:
+                params['state'] = state
+                req = DataCall('StnMeta', params)
+                if not req or 'error' in req.keys() or not 'meta' in req.keys():
+                    raise ValueError('StnMeta request for %s failed: %s' % (state, str(req)))
+                for stn in req['meta']:
+                    #Stations near state borders may be listed twice
+                    if not 'uid' in stn.keys() or stn['uid'] in uids:
+                        continue
+                    uids.add(stn['uid'])
+                    ACISStationSnapshot.insert_station(conn, stn)
+                if logger:
+                    logger.info('%s: %s stations' % (state, str(len(req['meta']))))
+            conn.executemany('INSERT INTO info VALUES (?, ?)', [
+                ('created', repr(time.time())),
+                ('vX', ','.join([str(v) for v in SNAPSHOT_VX])),
+                ('num_stations', str(len(uids)))
+            ])
+            conn.commit()
+        finally:
+            conn.close()
+
+    @staticmethod
+    def insert_station(conn, stn):
+        uid = int(stn['uid'])
+        lon, lat = stn['ll'] if stn.get('ll') else (None, None)
+        conn.execute('INSERT INTO stations VALUES (?,?,?,?,?,?,?,?,?,?,?)', (
+            uid, stn.get('name'), str(stn.get('state', '')).upper(), json.dumps(stn.get('sids', [])),
+            lon, lat, stn.get('elev'), stn.get('county'), stn.get('climdiv'),
+            stn.get('cwa'), stn.get('basin')
+        ))
+        for sid in stn.get('sids', []):
+            sid_split = sid.split(' ')
+            conn.execute('INSERT INTO sids VALUES (?,?,?)',
+                (sid_split[0], sid_split[1] if len(sid_split) > 1 else '', uid))
+        for vX, rnge in zip(SNAPSHOT_VX, stn.get('valid_daterange', [])):
+            if rnge and len(rnge) >= 2:
+                conn.execute('INSERT INTO ranges VALUES (?,?,?,?)', (uid, vX, rnge[0], rnge[1]))
+        if lon is not None and lat is not None:
+            conn.execute('INSERT INTO stn_rtree VALUES (?,?,?,?,?)', (uid, lon, lon, lat, lat))
+
+    def request_vX(self, params):
+        '''
+        Returns list of vX of the elems of a StnMeta request,
+        None if the snapshot does not hold all of them
+        '''
+        if not 'elems' in params.keys():
+            return []
+        elems = params['elems']
+        if isinstance(elems, basestring):
+            elems = [el.strip() for el in elems.split(',') if el.strip()]
+        vX_list = []
+        for el in elems:
+            if isinstance(el, dict):
+                #interval, duration, reduce etc. change the valid_daterange
+                if set(el.keys()) - set(['vX', 'name']):
+                    return None
+                el = el['vX'] if 'vX' in el.keys() else el['name']
+            el = str(el)
+            if el.isdigit():
+                vX = int(el)
+            elif el in WRCCData.ACIS_ELEMENTS_DICT.keys():
+                vX = WRCCData.ACIS_ELEMENTS_DICT[el]['vX']
+            else:
+                return None
+            if vX not in self.vX_list:
+                return None
+            vX_list.append(vX)
+        return vX_list
+
+    def where_clause(self, params):
+        '''
+        Returns SQL condition and arguments selecting the stations
+        of the search area of a StnMeta request
+        '''
+        conditions = [];args = []
+        for area in SNAPSHOT_AREAS:
+            if area in params.keys():
+                vals = [v.upper() for v in _param_list(params[area])]
+                conditions.append('UPPER(s.%s) IN (%s)' % (area, ','.join(['?' for v in vals])))
+                args+=vals
+        if 'bbox' in params.keys():
+            west, south, east, north = [float(b) for b in _param_list(params['bbox'])]
+            conditions.append('s.uid IN (SELECT id FROM stn_rtree WHERE '\
+                'min_lon >= ? AND max_lon <= ? AND min_lat >= ? AND max_lat <= ?)')
+            args+=[west, east, south, north]
+        for key in ['sids', 'sid']:
+            if key in params.keys():
+                sid_conditions = []
+                for sid in _param_list(params[key]):
+                    sid_split = sid.split(' ')
+                    if len(sid_split) > 1:
+                        sid_conditions.append('(sid = ? AND network = ?)')
+                        args+=sid_split[0:2]
+                    else:
+                        sid_conditions.append('sid = ?')
+                        args.append(sid)
+                conditions.append('s.uid IN (SELECT uid FROM sids WHERE %s)' % ' OR '.join(sid_conditions))
+        if not conditions:
+            return None, []
+        return ' AND '.join(conditions), args
+
+    def query(self, params, poly=None):
+        '''
+        Answers a StnMeta request from the snapshot.
+        poly -- optional polygon [(lon, lat), ...] the stations must lie in
+        Returns StnMeta response or None if the snapshot
+        can not answer the request
+        '''
+        supported = set(SNAPSHOT_AREAS + ['bbox', 'sids', 'sid', 'meta', 'elems', 'sdate', 'edate'])
+        if set(params.keys()) - supported:
+            return None
+        vX_list = self.request_vX(params)
+        if vX_list is None:
+            return None
+        meta_keys = _param_list(params['meta']) if 'meta' in params.keys() else SNAPSHOT_DEFAULT_META
+        if set(meta_keys) - set(SNAPSHOT_META.split(',')):
+            return None
+        if 'valid_daterange' in meta_keys and not vX_list:
+            return None
+        where, args = self.where_clause(params)
+        if where is None:
+            return None
+        sdate = str(params.get('sdate', 'por')).lower()
+        edate = str(params.get('edate', 'por')).lower()
+        if sdate != 'por':sdate = WRCCUtils.format_date_string(sdate, '-')
+        if edate != 'por':edate = WRCCUtils.format_date_string(edate, '-')
+        with self.lock:
+            rows = self.conn.execute('SELECT s.uid, s.name, s.state, s.sids, s.lon, s.lat, s.elev, '\
+                's.county, s.climdiv, s.cwa, s.basin FROM stations s WHERE ' + where + ' ORDER BY s.uid', args).fetchall()
+            ranges = defaultdict(dict)
+            if vX_list:
+                for uid, vX, start, end in self.conn.execute('SELECT r.uid, r.vX, r.start, r.end FROM ranges r '\
+                    'JOIN stations s ON r.uid = s.uid WHERE ' + where + ' AND r.vX IN (%s)' %
+                    ','.join([str(v) for v in set(vX_list)]), args):
+                    ranges[uid][vX] = [start, end]
+        meta = []
+        for uid, name, state, sids, lon, lat, elev, county, climdiv, cwa, basin in rows:
+            if poly is not None and (lon is None or not WRCCUtils.point_in_poly(lon, lat, poly)):
+                continue
+            stn_ranges = [ranges[uid].get(vX, []) for vX in vX_list]
+            if vX_list:
+                #ACIS only lists stations with data for one of the elems within sdate, edate
+                if not [r for r in stn_ranges if r and (sdate == 'por' or r[1] >= sdate) and (edate == 'por' or r[0] <= edate)]:
+                    continue
+            stn = {
+                'uid':uid, 'name':name, 'state':state, 'sids':json.loads(sids),
+                'elev':elev, 'county':county, 'climdiv':climdiv, 'cwa':cwa, 'basin':basin,
+                'valid_daterange':stn_ranges
+            }
+            if lon is not None:
+                stn['ll'] = [lon, lat]
+            meta.append(dict([(k, stn[k]) for k in meta_keys if k in stn.keys() and stn[k] is not None]))
+        return {'meta':meta}
+
+_station_snapshot = None
+_station_snapshot_lock = threading.Lock()
+
+def get_station_snapshot():
+    '''
+    Returns the station metadata snapshot or None if there is no
+    snapshot at settings.ACIS_STATION_SNAPSHOT or it is older than
+    settings.ACIS_STATION_SNAPSHOT_MAX_AGE seconds.
+    A snapshot rebuilt by another process is picked up automatically.
+    '''
+    global _station_snapshot
+    path = getattr(settings, 'ACIS_STATION_SNAPSHOT', settings.TEMP_DIR + 'station_meta.sqlite')
+    if not path or getattr(settings, 'ACIS_STAND_IN_URL', None):
+        return None
+    with _station_snapshot_lock:
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return None
+        if _station_snapshot is None or _station_snapshot.path != path or _station_snapshot.mtime != mtime:
+            if _station_snapshot is not None:
+                _station_snapshot.close()
+                _station_snapshot = None
+            try:
+                _station_snapshot = ACISStationSnapshot(path)
+            except (sqlite3.Error, TypeError, ValueError):
+                return None
+        snapshot = _station_snapshot
+    if snapshot.age() > getattr(settings, 'ACIS_STATION_SNAPSHOT_MAX_AGE', 2*86400):
+        return None
+    return snapshot
+
+def local_station_meta(params, poly=None):
+    '''
+    Answers StnMeta request from the local snapshot.
+    Returns None if there is no snapshot or it can not answer the request.
+    poly -- optional polygon [(lon, lat), ...] the stations must lie in
+    '''
+    snapshot = get_station_snapshot()
+    if snapshot is None:
+        return None
+    try:
+        return snapshot.query(params, poly=poly)
+    except (sqlite3.Error, ValueError):
+        return None
+
+#Area boundary store
+####################
+#Area types whose boundaries are kept in the store, state only holds bboxes
+BOUNDARY_AREAS = ['county', 'climdiv', 'cwa', 'basin', 'state']
+BOUNDARY_META = 'geojson,bbox,name,id'
+BOUNDARY_SCHEMA = [
+    'CREATE TABLE info (key TEXT PRIMARY KEY, value TEXT)',
+    'CREATE TABLE areas (area_type TEXT, id_key TEXT, meta TEXT, PRIMARY KEY (area_type, id_key))',
+    'CREATE TABLE area_states (area_type TEXT, state TEXT, pos INTEGER, id_key TEXT, PRIMARY KEY (area_type, state, pos))'
+]
+
+class ACISBoundaryStore(object):
+    '''
+    Local SQLite store of the General metadata (id, name, bbox, geojson)
+    of all US counties, climdivs, cwas and basins and of the state bboxes.
+    Areas are looked up by id and by state, so that the boundaries
+    of special areas do not have to be requested from ACIS on
+    every request. The store is rebuilt by area_boundary_store.py.
+
+    Keyword arguments:
+    path -- path of the SQLite store file
+    '''
+    #Number of decoded areas kept in memory
+    max_cached = 256
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.mtime = os.path.getmtime(path)
+        self.cached = {}
+        if self.conn.execute('SELECT value FROM info WHERE key = ?', ('created',)).fetchone() is None:
+            raise ValueError('Incomplete boundary store %s' % path)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    @staticmethod
+    def build(path, states=None, logger=None):
+        '''
+        Requests the boundaries of all areas, state by state,
+        from ACIS and atomically replaces the store at path.
+        Returns number of areas in the store
+        '''
+        if states is None:
+            states = sorted(set(WRCCData.STATE_CHOICES))
+        num_areas = []
+        atomic_write(path, lambda tmp_path: num_areas.append(ACISBoundaryStore.fill(tmp_path, states, logger)), mode=None)
+        return num_areas[0]
+
+    @staticmethod
+    def fill(db_path, states, logger=None):
+        '''
+        Writes the boundary database at db_path.
+        Returns number of areas written
+        '''
+        conn = sqlite3.connect(db_path)
+        num_areas = 0
+        try:
+            for statement in BOUNDARY_SCHEMA:
+                conn.execute(statement)
+            for area_type in BOUNDARY_AREAS:
+                id_keys = set()
+                for state in states:
+                    if area_type == 'state':
+                        req = General('state', {'id':state.lower(), 'meta':'bbox,name,id'})
+                    else:
+                        req = General(area_type, {'state':state.lower(), 'meta':BOUNDARY_META})
+                    if not req or 'error' in req.keys() or not 'meta' in req.keys():
+                        raise ValueError('General/%s request for %s failed: %s' % (area_type, state, str(req)))
+                    for pos, area in enumerate(req['meta']):
+                        id_key = str(area['id']).upper()
+                        #Areas crossing state borders are listed for each state
+                        if id_key not in id_keys:
+                            id_keys.add(id_key)
+                            conn.execute('INSERT INTO areas VALUES (?,?,?)', (area_type, id_key, json.dumps(area)))
+                        conn.execute('INSERT INTO area_states VALUES (?,?,?,?)', (area_type, state.upper(), pos, id_key))
+                if logger:
+                    logger.info('%s: %s areas' % (area_type, str(len(id_keys))))
+                num_areas+=len(id_keys)
+            conn.executemany('INSERT INTO info VALUES (?, ?)', [
+                ('created', repr(time.time())),
+                ('num_areas', str(num_areas))
+            ])
+            conn.commit()
+        finally:
+            conn.close()
+        return num_areas
+
+    def decode(self, area_type, id_key, meta):
+        area = json.loads(meta)
+        with self.lock:
+            if len(self.cached) >= self.max_cached:
+                self.cached.clear()
+            self.cached[(area_type, id_key)] = area
+        return area
+
+    def area(self, area_type, area_id):
+        '''
+        Returns General metadata of the area or None if the store
+        does not know it
+        '''
+        id_key = str(area_id).upper()
+        area = self.cached.get((area_type, id_key))
+        if area is not None:
+            return area
+        with self.lock:
+            row = self.conn.execute('SELECT meta FROM areas WHERE area_type = ? AND id_key = ?',
+                (area_type, id_key)).fetchone()
+        if row is None:
+            return None
+        return self.decode(area_type, id_key, row[0])
+
+    def areas_of_state(self, area_type, state):
+        '''
+        Returns General metadata of all areas of area_type in state,
+        in the order ACIS lists them, None if the store
+        does not know the state
+        '''
+        with self.lock:
+            rows = self.conn.execute('SELECT a.id_key, a.meta FROM area_states s JOIN areas a '\
+                'ON s.area_type = a.area_type AND s.id_key = a.id_key '\
+                'WHERE s.area_type = ? AND s.state = ? ORDER BY s.pos',
+                (area_type, str(state).upper())).fetchall()
+        if not rows:
+            return None
+        return [self.cached.get((area_type, id_key)) or self.decode(area_type, id_key, meta) for id_key, meta in rows]
+
+_boundary_store = None
+_boundary_store_lock = threading.Lock()
+
+def get_boundary_store():
+    '''
+    Returns the area boundary store or None if there is
+    no store at settings.ACIS_BOUNDARY_STORE.
+    A store rebuilt by another process is picked up automatically.
+    '''
+    global _boundary_store
+    path = getattr(settings, 'ACIS_BOUNDARY_STORE', settings.TEMP_DIR + 'area_boundaries.sqlite')
+    if not path or getattr(settings, 'ACIS_STAND_IN_URL', None):
+        return None
+    with _boundary_store_lock:
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return None
+        if _boundary_store is None or _boundary_store.path != path or _boundary_store.mtime != mtime:
+            if _boundary_store is not None:
+                _boundary_store.close()
+                _boundary_store = None
+            try:
+                _boundary_store = ACISBoundaryStore(path)
+            except (sqlite3.Error, ValueError):
+                return None
+        return _boundary_store
+
+def local_area_meta(search_area, val):
+    '''
+    Returns General metadata of area val of type search_area
+    from the local boundary store, None if it is not in the store
+    '''
+    store = get_boundary_store()
+    if store is None:
+        return None
+    try:
+        return store.area(search_area, val)
+    except (sqlite3.Error, ValueError):
+        return None
+
+def local_areas_of_state(search_area, state):
+    '''
+    Returns General metadata of all areas of type search_area in state
+    from the local boundary store, None if it is not in the store
+    '''
+    store = get_boundary_store()
+    if store is None:
+        return None
+    try:
+        return store.areas_of_state(search_area, state)
+    except (sqlite3.Error, ValueError):
+        return None
 
 def StnMeta(params):
+    '''
+    Station metadata is served from the local snapshot
+    if possible, else requested from ACIS
+    '''
+    req = local_station_meta(params)
+    if req is not None:
+        return req
     return DataCall('StnMeta', params)
 
 def StnData(params):
@@ -71,9 +2094,21 @@ def StnData(params):
 def MultiStnData(params):
     return DataCall('MultiStnData', params)
 
+def MultiStnDataSplit(params):
+    return DataCallSplit('MultiStnData', params)
+
+def MultiStnDataStream(params):
+    return DataCallStream('MultiStnData', params)
+
 def GridData(params):
     return DataCall('GridData', params)
 
+def GridDataSplit(params):
+    return DataCallSplit('GridData', params)
+
+def GridDataMulti(params_list, max_workers=None):
+    return DataCallMulti('GridData', params_list, max_workers=max_workers)
+
 def GridCalc(params):
     return DataCall('GridCalc', params)
 
@@ -81,7 +2116,10 @@ def General(request_type, params):
     '''
     request_type in [basin, climdiv,cwa,state, county]
     '''
-    return make_request(settings.ACIS_BASE_URL+'General' + '/' + request_type, params)
+    call_name = 'General' + '/' + request_type
+    return cached_call(call_name, params,
+        lambda: single_flight_call(call_name, params,
+            lambda: make_request(get_acis_base_url() + call_name, params)))
     '''
     req ={}
     for url in settings.ACIS_SERVERS:
@@ -110,6 +2148,10 @@ def make_gen_call_by_state(search_area, state):
         return {'error': 'Search area must be one of: cwa, basin, county, climdiv. You entered: %s' %str(search_area)}
     if st.upper() not in WRCCData.STATE_CHOICES:
         return {'error': 'Not avalid US state: %s' %str(state)}
+    #Boundaries of all areas are kept locally
+    meta = local_areas_of_state(sa, st)
+    if meta is not None:
+        return {'meta':meta}
     #Make general request
     params={"state":st,"meta":"geojson,bbox,name,id"}
     try:
@@ -129,12 +2171,16 @@ def find_geojson_of_area(search_area, val):
     #Sanity check
     if sa not in ['cwa', 'basin', 'county', 'climdiv']:
         return ''
-    #Make general request
-    params={'id':v,"meta":"geojson,bbox,name,id"}
-    try:
-        req = General(sa,params)
-    except:
-        return ''
+    area = local_area_meta(sa, v)
+    if area is not None:
+        req = {'meta':[area]}
+    else:
+        #Make general request
+        params={'id':v,"meta":"geojson,bbox,name,id"}
+        try:
+            req = General(sa,params)
+        except:
+            return ''
     if 'meta' not in req.keys() or not req['meta']:
         return ''
     if 'geojson' not in  req['meta'][0].keys() or not req['meta'][0]['geojson']:
@@ -142,6 +2188,37 @@ def find_geojson_of_area(search_area, val):
     else:
         return req['meta'][0]['geojson']['coordinates'][0][0]
 
+def find_geojson_polygons_of_area(search_area, val):
+    '''
+    Makes an ACIS general call
+    Returns the geojson coordinates of all polygons of the area
+    as list of polygons, each a list of rings (outer ring, then holes)
+    area_type is one of basin, cwa, climdiv, county
+    '''
+    sa = str(search_area)
+    v = str(val)
+    #Sanity check
+    if sa not in ['cwa', 'basin', 'county', 'climdiv']:
+        return []
+    area = local_area_meta(sa, v)
+    if area is not None:
+        req = {'meta':[area]}
+    else:
+        #Make general request
+        params={'id':v,"meta":"geojson,bbox,name,id"}
+        try:
+            req = General(sa,params)
+        except:
+            return []
+    if 'meta' not in req.keys() or not req['meta']:
+        return []
+    if 'geojson' not in  req['meta'][0].keys() or not req['meta'][0]['geojson']:
+        return []
+    geojson = req['meta'][0]['geojson']
+    if geojson.get('type') == 'Polygon':
+        return [geojson['coordinates']]
+    return geojson['coordinates']
+
 def get_acis_bbox_of_area(search_area, val):
     '''
     Makes an ACIS general call
@@ -153,12 +2230,16 @@ def get_acis_bbox_of_area(search_area, val):
     #Sanity check
     if sa not in ['cwa', 'basin', 'county', 'climdiv','state']:
         return ''
-    #Make general request
-    params={'id':v,"meta":"geojson,bbox,name,id"}
-    try:
-        req = General(sa,params)
-    except:
-        return ''
+    area = local_area_meta(sa, v)
+    if area is not None:
+        req = {'meta':[area]}
+    else:
+        #Make general request
+        params={'id':v,"meta":"geojson,bbox,name,id"}
+        try:
+            req = General(sa,params)
+        except:
+            return ''
     if 'meta' not in req.keys() or not req['meta']:
         return ''
     if 'bbox' not in  req['meta'][0].keys() or not req['meta'][0]['bbox']:
@@ -187,7 +2268,7 @@ def get_meta_data(search_area, val,vX_list=None):
             return {}
         return request
 
-def station_meta_to_json(by_type, val, el_list=None, time_range=None, constraints=None):
+def station_meta_to_json(by_type, val, el_list=None, time_range=None, constraints=None, compact=False):
     '''
     Requests station meta data from ACIS and writes results to a json file
     This json file is read by the javascript function initialize_station_map
@@ -203,83 +2284,96 @@ def station_meta_to_json(by_type, val, el_list=None, time_range=None, constraint
                   (default None --> we take valid_daterange of el_list)
     contraints -- specifies variable contsraints and date contsraints:
                   any_any, all_all, any_all, all_any
+    compact    -- if True, stations are written once in column arrays
+                  (see _compact_station_json) to a gzipped json file
+                  (default False --> one entry per station network)
 
     If el_list and time_range are given, only stations that have variables
     for the given time range are listed.
+    Stations are filtered on column arrays (lon, lat, per variable
+    start/end dates) and sorted by name once at the end.
     '''
-    def stn_in_poly(by_type, shape_type, shape,stn_meta):
+    def stations_in_shape(shape_type, shape, lons, lats):
         #convert to floats
         s = [float(s) for s in shape]
         if shape_type == 'circle':
-            poly = s
-            stn_in = WRCCUtils.point_in_circle(stn_meta['ll'][0], stn_meta['ll'][1], poly)
+            return WRCCUtils.points_in_circle(lons, lats, s)
+        if shape_type in ['bbox','location']:
+            poly = [(s[0],s[1]), (s[0],s[3]),(s[2],s[3]),(s[2],s[1])]
         else:
-            if shape_type in ['bbox','location']:
-                poly = [(s[0],s[1]), (s[0],s[3]),(s[2],s[3]),(s[2],s[1])]
-            else:
-                poly = [(s[2*idx],s[2*idx+1]) for idx in range(len(s)/2)]
-            stn_in = WRCCUtils.point_in_poly(stn_meta['ll'][0], stn_meta['ll'][1], poly)
-        if not stn_in:return False
-        else:return True
+            poly = [(s[2*idx],s[2*idx+1]) for idx in range(len(s)/2)]
+        return WRCCUtils.points_in_poly(lons, lats, poly)
 
-    def station_invalid(el_list, vX_list, time_range, stn, contraints):
-        #Check if constraints are met for variable list and date range
+    def to_datetime64(date_str):
+        return numpy.datetime64(WRCCUtils.format_date_string(date_str, '-'), 'D')
+
+    def stations_valid(el_list, vX_list, time_range, starts, ends, constraints):
+        '''
+        Checks if constraints are met for variable list and date range.
+        starts, ends -- (stations x variables) arrays of valid_daterange
+                        start/end dates, NaT if there is no data
+        Returns boolean array of valid stations
+        '''
+        num_stns = starts.shape[0]
         if constraints in ['any_any', 'any_all']:
-            flag_invalid_station = True
-        elif constraints in ['all_all', 'all_any']:
-            flag_invalid_station = False
-        for el_idx, el_vX in enumerate(el_list):
+            invalid = numpy.ones(num_stns, dtype=bool)
+        else:
+            invalid = numpy.zeros(num_stns, dtype=bool)
+        #Stations whose check is completed
+        decided = numpy.zeros(num_stns, dtype=bool)
+        for el_vX in el_list:
             #Find correct index in vX_list
             try:
                 idx = vX_list.index(el_vX)
-            except:
-                if constraints in ['all_all', 'all_any']:
-                    flag_invalid_station = True
-                    break
-                elif constraints in ['any_any', 'any_all']:
+            except ValueError:
+                if constraints in ['any_any', 'any_all']:
                     continue
-            #Sanity Check
-            if not stn['valid_daterange'][idx] and (constraints == 'all_all'  or constraints == 'all_any' or constraints is None):
-                #data for this variable does not exist at station
-                flag_invalid_station = True
+                invalid[~decided] = True
                 break
-            elif not stn['valid_daterange'][idx] and (constraints == 'any_any' or constraints == 'any_all'):
-                continue
+            has_data = ~numpy.isnat(starts[:,idx])
             #Find period of record for this variable and station
-            por_start = WRCCUtils.date_to_datetime(stn['valid_daterange'][idx][0])
-            por_end = WRCCUtils.date_to_datetime(stn['valid_daterange'][idx][1])
+            por_start = starts[:,idx];por_end = ends[:,idx]
             if time_range[0].lower() != 'por':
-                user_start = WRCCUtils.date_to_datetime(time_range[0])
+                user_start = numpy.empty(num_stns, dtype='datetime64[D]')
+                user_start.fill(to_datetime64(time_range[0]))
             else:
                 user_start = por_start
             if time_range[1].lower() != 'por':
-                user_end = WRCCUtils.date_to_datetime(time_range[1])
+                user_end = numpy.empty(num_stns, dtype='datetime64[D]')
+                user_end.fill(to_datetime64(time_range[1]))
             else:
                 user_end = por_end
+            open_stns = ~decided
+            if constraints in ['any_any', 'any_all']:
+                #Stations without data for this variable are not decided yet
+                open_stns&= has_data
+            else:
+                #data for this variable does not exist at station
+                no_data = open_stns & ~has_data
+                invalid[no_data] = True
+                decided|= no_data
+                open_stns&= has_data
             #Check constraints logic for this variable and station
-            if constraints == 'all_all' or constraints is None:
-                #all  variables have data records for all dates within start and end date given by user
-                if user_start < por_start or user_end > por_end:
-                    flag_invalid_station =  True
-                    break
-            elif constraints == 'any_any':
+            overlap = (user_end >= por_start) & (user_start <= por_end)
+            within = (user_start >= por_start) & (user_end <= por_end)
+            if constraints == 'any_any':
                 #At least one variable has one data record within user given time_range
-                if (user_end >= por_start and user_start <= por_end) or (user_start <= por_end and user_end >=por_start):
-                    flag_invalid_station = False
-                    break
+                hit = open_stns & overlap
+                invalid[hit] = False
             elif constraints == 'all_any':
                 #All variables have at least one data record within user given time_range
-                if (user_end >= por_start and user_start <= por_end) or (user_start <= por_end and user_end >=por_start):
-                    continue
-                else:
-                    flag_invalid_station =  True
-                    break
+                hit = open_stns & ~overlap
+                invalid[hit] = True
             elif constraints == 'any_all':
                 #At least one variables has data records for all dates within given date_range
-                if user_start >= por_start and user_end <= por_end:
-                    flag_invalid_station = False
-                    break
-        return flag_invalid_station
+                hit = open_stns & within
+                invalid[hit] = False
+            else:
+                #all_all: all variables have data records for all dates within start and end date given by user
+                hit = open_stns & ~within
+                invalid[hit] = True
+            decided|= hit
+        return ~invalid
 
     #Settings
     stn_list = []
@@ -299,7 +2393,17 @@ def station_meta_to_json(by_type, val, el_list=None, time_range=None, constraint
     shape_type = None
     time_stamp = datetime.datetime.now().strftime('%Y_%m_%d_%H_%M_%S_')
     f_name = time_stamp + 'stn.json'
+    write_json = WRCCUtils.load_data_to_json_file
+    if compact:
+        f_name+='.gz'
+        write_json = WRCCUtils.load_data_to_gzip_json_file
     f_dir = settings.TEMP_DIR
+    #Identical finder requests reuse the json file of the first one
+    cache_name = station_finder_file_name(by_type, val, el_list, time_range, constraints, compact)
+    if cache_name is not None:
+        cached_json = load_station_finder_json(f_dir, cache_name, compact)
+        if cached_json is not None:
+            return cached_json, cache_name
     #Set up metedata request
     params = {'meta':'name,state,sids,ll,elev,uid,valid_daterange','elems':vX_tuple}
     params[WRCCData.STN_AREA_FORM_TO_PARAM[by_type]] = val
@@ -314,142 +2418,285 @@ def station_meta_to_json(by_type, val, el_list=None, time_range=None, constraint
         request = StnMeta(params)
     except:
         stn_json['error'] = 'Metadata request failed. Please check your parameters!'
-        WRCCUtils.load_data_to_json_file(f_dir + f_name, stn_json)
+        write_json(f_dir + f_name, stn_json)
         return stn_json, f_name
 
     if request is None:
         stn_json['error'] = 'No metadata found.'
-        WRCCUtils.load_data_to_json_file(f_dir + f_name, stn_json)
+        write_json(f_dir + f_name, stn_json)
         return stn_json, f_name
     if not 'meta' in request.keys() or not request['meta'] or 'error' in request.keys():
         stn_json['error'] = 'No metadata found.'
-        WRCCUtils.load_data_to_json_file(f_dir + f_name, stn_json)
+        write_json(f_dir + f_name, stn_json)
         return stn_json, f_name
-    stn_meta_list = []
+    #Sanity checks: Some Acis records are incomplete, leading to key error
+    #Stations need ll and a valid_daterange
+    stations = [stn for stn in request['meta'] if 'll' in stn.keys() and stn.get('valid_daterange')]
+    check_vars = el_list is not None and time_range is not None
+    if check_vars:
+        #Check if ACIS produced correct output, i.e. one valid_daterange per variable
+        stations = [stn for stn in stations if len(stn['valid_daterange']) >= len(el_list)]
+    #Column arrays
+    lons = numpy.array([float(stn['ll'][0]) for stn in stations])
+    lats = numpy.array([float(stn['ll'][1]) for stn in stations])
+    keep = numpy.ones(len(stations), dtype=bool)
+    #if custom shape, check which stns lie within shape
+    if by_type == 'shape':
+        if shape_type in ['bbox','location']:shape = bbox.split(',')
+        elif shape_type == 'polygon':shape = WRCCUtils.orient_shape_ccw(val).split(',')
+        else:shape = val.split(',')
+        keep&= stations_in_shape(shape_type, shape, lons, lats)
+    #check if we are looking for stations with particular variables
+    if check_vars and stations:
+        starts = numpy.empty((len(stations), len(vX_list)), dtype='datetime64[D]')
+        starts.fill(numpy.datetime64('NaT'))
+        ends = starts.copy()
+        for i, stn in enumerate(stations):
+            if not keep[i]:continue
+            for j, rnge in enumerate(stn['valid_daterange'][0:len(vX_list)]):
+                if rnge and len(rnge) >=2:
+                    starts[i,j] = to_datetime64(rnge[0])
+                    ends[i,j] = to_datetime64(rnge[1])
+        keep&= stations_valid(el_list, vX_list, time_range, starts, ends, constraints)
+    stations = [stn for i, stn in enumerate(stations) if keep[i]]
     #For alphabetic ordering of station names
-    sorted_list =[]
-    #Keep track of duplicates
-    unique_stations = []
-    for i, stn in enumerate(request['meta']):
-        #if custom shape, check if  stn lies within shape
-        if by_type == 'shape':
-            if shape_type in ['bbox','location']:shape = bbox.split(',')
-            elif shape_type == 'polygon':shape = WRCCUtils.orient_shape_ccw(val).split(',')
-            else:shape = val.split(',')
-            if not stn_in_poly(by_type, shape_type, shape, stn):
-                continue
-        #sanity check
-        if not stn['valid_daterange']:
-            continue
-        #check if we are looking for stations with particular variables
-        if el_list is not None and time_range is not None:
-            #Check if ACIS produced correct output, i.e. one valid_daterange per variable
-            if len(stn['valid_daterange']) < len(el_list):
-                continue
-            #Check if station is valid, if not, proceed to next station
-            flag_invalid_station = station_invalid(el_list, vX_list, time_range, stn, constraints)
-            if flag_invalid_station:
-                continue
-        stn_sids = []
-        stn_networks = []
-        stn_network_codes = []
-        sids = stn['sids'] if 'sids' in stn.keys() else []
-        marker_icons = []
-        for sid in sids:
-            sid_split = sid.split(' ')
-            '''
-            #put coop id up front (for csc application metagraph  and possibly others)
-            if str(sid_split[1]) == '2':
-                #stn_sids.append(re.sub('[^a-zA-Z0-9\n\.]', ' ', str(sid_split[1])))
-                stn_sids.insert(0,str(sid_split[0]).replace("\'"," "))
-                stn_network_codes.insert(0, str(sid_split[1]))
-                marker_icons.insert(0, WRCCData.NETWORK_ICONS[str(sid_split[1])])
-                stn_networks.insert(0,WRCCData.NETWORK_CODES[str(sid_split[1])])
-            else:
-            '''
-            #stn_sids.append(re.sub('[^a-zA-Z0-9\n\.]', ' ', str(sid_split[1])))
-            stn_sids.append(str(sid_split[0]).replace("\'"," "))
-            stn_network_codes.append(str(sid_split[1]))
-            if int(sid_split[1]) <= 10:
-                stn_networks.append(WRCCData.NETWORK_CODES[str(sid_split[1])])
-                marker_icons.append(WRCCData.NETWORK_ICONS[str(sid_split[1])])
-            else:
-                stn_networks.append('Misc')
-                marker_icons.append('red')
-        #Sanity check : Some Acis records are incomplete, leading to key error
-        if 'll' in stn.keys():
-            lat = str(stn['ll'][1])
-            lon = str(stn['ll'][0])
-        else:
-            continue
+    names = []
+    for stn in stations:
         try:
             #name = re.sub('[^a-zA-Z0-9\n\.]', ' ', str(stn['name'])) if 'name' in stn.keys() else 'Name not listed'
             name = str(stn['name']).replace("\'"," ").replace('#','') if 'name' in stn.keys() else 'Name not listed'
         except:
             name = 'Name not listed'
-
-        uid = str(stn['uid']) if 'uid' in stn.keys() else 'Uid not listed'
-        elev = str(stn['elev']) if 'elev' in stn.keys() else 'Elevation not listed'
-        state_key = str(stn['state']).lower() if 'state' in stn.keys() else 'state not listed'
-        #sort station networks so that coop is last
-        #so that coop markers show on map
-        stn_networks_sorted = []
-        for n in stn_networks:
-            if n !='COOP':
-                stn_networks_sorted.append(n)
-        if 'COOP' in stn_networks:
-            stn_networks_sorted.append('COOP')
+        names.append(name)
+    records = []
+    for s_idx in sorted(range(len(stations)), key=lambda i: names[i]):
+        records.append(_station_finder_record(stations[s_idx], names[s_idx], vX_list))
+    if compact:
+        stn_json.update(_compact_station_json(records))
+        return stn_json, write_station_finder_json(f_dir, cache_name, f_name, stn_json, write_json)
+    stn_meta_list = []
+    for record in records:
         #Generate one entry per network that the station belongs to
-        for j, sid in enumerate(stn_networks_sorted):
+        for j in range(_num_finder_entries(record['stn_networks'])):
             stn_dict = {
-                'name':name,
-                'uid':uid,
-                'sid':stn_sids[j],
-                'sids':stn_sids,
-                'sids_str':','.join(stn_sids),
-                'elevation':elev,
-                'lat':lat,
-                'lon':lon,
-                'll':str(lon) + ', ' + str(lat),
-                'state':state_key,
-                'marker_icon':marker_icons[j],
-                'marker_category':stn_networks[j],
-                'stn_networks':stn_networks,
-                'stn_network':','.join(stn_networks),
-                'stn_network_codes': stn_network_codes
+                'name':record['name'],
+                'uid':record['uid'],
+                'sid':record['stn_sids'][j],
+                'sids':record['stn_sids'],
+                'sids_str':','.join(record['stn_sids']),
+                'elevation':record['elev'],
+                'lat':record['lat'],
+                'lon':record['lon'],
+                'll':record['lon'] + ', ' + record['lat'],
+                'state':record['state'],
+                'marker_icon':record['marker_icons'][j],
+                'marker_category':record['stn_networks'][j],
+                'stn_networks':record['stn_networks'],
+                'stn_network':','.join(record['stn_networks']),
+                'stn_network_codes': record['stn_network_codes']
+            }
+            if record['available_variables']:
+                stn_dict['available_variables'] = record['available_variables']
+                stn_dict['available_variables_str'] = ', '.join(
+                    [el_name + ': ' + ' - '.join(vd) for el_name, vd in record['available_variables']])
+            stn_meta_list.append(stn_dict)
+    stn_json['stations'] = stn_meta_list
+    return stn_json, write_station_finder_json(f_dir, cache_name, f_name, stn_json, write_json)
+
+#Station finder result cache
+#############################
+_finder_writes = WriteCounter()
+
+def station_finder_file_name(by_type, val, el_list, time_range, constraints, compact):
+    '''
+    Returns name of the station finder json file of a finder query,
+    None if results are not cached (stand-in server)
+    '''
+    if getattr(settings, 'ACIS_STAND_IN_URL', None):
+        return None
+    f_name = 'stn_' + request_key('StationFinder', [by_type, val, el_list, time_range, constraints]) + '.json'
+    if compact:
+        f_name+='.gz'
+    return f_name
+
+def load_station_finder_json(f_dir, f_name, compact):
+    '''
+    Returns cached station finder results or None if there is no
+    valid file: files expire after settings.STATION_FINDER_CACHE_TTL
+    seconds or when a newer station metadata snapshot is available
+    '''
+    path = f_dir + f_name
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    ttl = getattr(settings, 'STATION_FINDER_CACHE_TTL', ACIS_CACHE_TTLS['StnMeta'])
+    if time.time() - mtime > ttl:
+        return None
+    snapshot = get_station_snapshot()
+    if snapshot is not None and snapshot.mtime > mtime:
+        return None
+    #Record access time for LRU eviction
+    try:
+        os.utime(path, (time.time(), mtime))
+    except OSError:
+        pass
+    if compact:
+        return WRCCUtils.load_json_data_from_gzip_file(path)
+    return WRCCUtils.load_json_data_from_file(path)
+
+def write_station_finder_json(f_dir, cache_name, f_name, stn_json, write_json):
+    '''
+    Writes station finder results to f_dir + cache_name
+    (f_name if results are not cached) and evicts old finder files.
+    Returns name of the file written
+    '''
+    if cache_name is None:
+        write_json(f_dir + f_name, stn_json)
+        return f_name
+    #Concurrent identical requests may write the same file
+    atomic_write(f_dir + cache_name, lambda tmp_path: write_json(tmp_path, stn_json), mode=None)
+    if _finder_writes.due():
+        evict_station_finder_files(f_dir)
+    return cache_name
+
+def evict_station_finder_files(f_dir):
+    '''
+    Removes station finder files older than settings.STATION_FINDER_CACHE_TTL
+    and the least recently used ones until the finder files take up
+    less than settings.STATION_FINDER_CACHE_MAX_BYTES
+    '''
+    ttl = getattr(settings, 'STATION_FINDER_CACHE_TTL', ACIS_CACHE_TTLS['StnMeta'])
+    max_bytes = getattr(settings, 'STATION_FINDER_CACHE_MAX_BYTES', 200*1024*1024)
+    #Includes time stamped files of uncached and failed requests
+    paths = list_files(f_dir, lambda file_name: file_name.endswith('stn.json') or \
+        file_name.endswith('stn.json.gz') or (file_name.startswith('stn_') and '.json' in file_name))
+    evict_files(paths, ttl=ttl, max_bytes=max_bytes)
+
+def _station_finder_record(stn, name, vX_list):
+    '''
+    Collects the station finder information of one ACIS station
+    '''
+    stn_sids = []
+    stn_networks = []
+    stn_network_codes = []
+    sids = stn['sids'] if 'sids' in stn.keys() else []
+    marker_icons = []
+    for sid in sids:
+        sid_split = sid.split(' ')
+        stn_sids.append(str(sid_split[0]).replace("\'"," "))
+        stn_network_codes.append(str(sid_split[1]))
+        if int(sid_split[1]) <= 10:
+            stn_networks.append(WRCCData.NETWORK_CODES[str(sid_split[1])])
+            marker_icons.append(WRCCData.NETWORK_ICONS[str(sid_split[1])])
+        else:
+            stn_networks.append('Misc')
+            marker_icons.append('red')
+    #check which variables are available at the stations[valid_daterange is not empty]
+    available_variables = []
+    for j,rnge in enumerate(stn['valid_daterange']):
+        if rnge and len(rnge) >=2:
+            vd = [str(rnge[0]), str(rnge[1])]
+            if WRCCData.ACIS_ELEMENTS[vX_list[j]]['name'] == 'cdd':
+                el_name = WRCCData.ACIS_ELEMENTS['-44']['name_long']
+            else:
+                el_name = WRCCData.ACIS_ELEMENTS[vX_list[j]]['name_long']
+            available_variables.append([el_name,vd])
+    return {
+        'name':name,
+        'uid':str(stn['uid']) if 'uid' in stn.keys() else 'Uid not listed',
+        'elev':str(stn['elev']) if 'elev' in stn.keys() else 'Elevation not listed',
+        'lat':str(stn['ll'][1]),
+        'lon':str(stn['ll'][0]),
+        'state':str(stn['state']).lower() if 'state' in stn.keys() else 'state not listed',
+        'stn_sids':stn_sids,
+        'stn_networks':stn_networks,
+        'stn_network_codes':stn_network_codes,
+        'marker_icons':marker_icons,
+        'available_variables':available_variables
+    }
+
+def _num_finder_entries(stn_networks):
+    '''
+    Number of station finder entries of a station:
+    one per network, COOP networks are listed once
+    so that coop markers show on map
+    '''
+    num = len([n for n in stn_networks if n != 'COOP'])
+    if 'COOP' in stn_networks:
+        num+=1
+    return num
+
+def _compact_station_json(records):
+    '''
+    Columnar station finder payload:
+    each station is stored once, networks, marker icons and
+    variable names are indices into shared lookup tables.
+    Expanded to the station entries of the full format
+    by expand_compact_station_json
+    '''
+    tables = {'networks':[], 'icons':[], 'variables':[]}
+    indices = dict([(t, {}) for t in tables.keys()])
+    def index(table, val):
+        if val not in indices[table]:
+            indices[table][val] = len(tables[table])
+            tables[table].append(val)
+        return indices[table][val]
+    columns = dict([(c, []) for c in ['name', 'uid', 'elevation', 'lat', 'lon', 'state',
+        'sids', 'network_codes', 'networks', 'icons', 'valid_daterange']])
+    for record in records:
+        columns['name'].append(record['name'])
+        columns['uid'].append(record['uid'])
+        columns['elevation'].append(record['elev'])
+        columns['lat'].append(record['lat'])
+        columns['lon'].append(record['lon'])
+        columns['state'].append(record['state'])
+        columns['sids'].append(record['stn_sids'])
+        columns['network_codes'].append(record['stn_network_codes'])
+        columns['networks'].append([index('networks', n) for n in record['stn_networks']])
+        columns['icons'].append([index('icons', i) for i in record['marker_icons']])
+        columns['valid_daterange'].append([[index('variables', el_name)] + vd \
+            for el_name, vd in record['available_variables']])
+    compact = {'format':'compact', 'columns':columns}
+    compact.update(tables)
+    return compact
+
+def expand_compact_station_json(stn_json):
+    '''
+    Returns list of station entries (one per station network)
+    of a compact station finder payload,
+    identical to the stations of the full format
+    '''
+    cols = stn_json['columns']
+    stations = []
+    for s_idx in range(len(cols['name'])):
+        sids = cols['sids'][s_idx]
+        networks = [stn_json['networks'][n] for n in cols['networks'][s_idx]]
+        available_variables = [[stn_json['variables'][v[0]], v[1:]] for v in cols['valid_daterange'][s_idx]]
+        for j in range(_num_finder_entries(networks)):
+            stn_dict = {
+                'name':cols['name'][s_idx],
+                'uid':cols['uid'][s_idx],
+                'sid':sids[j],
+                'sids':sids,
+                'sids_str':','.join(sids),
+                'elevation':cols['elevation'][s_idx],
+                'lat':cols['lat'][s_idx],
+                'lon':cols['lon'][s_idx],
+                'll':cols['lon'][s_idx] + ', ' + cols['lat'][s_idx],
+                'state':cols['state'][s_idx],
+                'marker_icon':stn_json['icons'][cols['icons'][s_idx][j]],
+                'marker_category':networks[j],
+                'stn_networks':networks,
+                'stn_network':','.join(networks),
+                'stn_network_codes':cols['network_codes'][s_idx]
             }
-            #check which variables are available at the stations[valid_daterange is not empty]
-            valid_date_range_list = stn['valid_daterange']
-            available_variables = []
-            available_variables_str = ''
-            for j,rnge in enumerate(valid_date_range_list):
-                if rnge and len(rnge) >=2:
-                    vd = [str(rnge[0]), str(rnge[1])]
-                    vd_str = ' - '.join(vd)
-                    if WRCCData.ACIS_ELEMENTS[vX_list[j]]['name'] == 'cdd':
-                        el_name = WRCCData.ACIS_ELEMENTS['-44']['name_long']
-                    else:
-                        el_name = WRCCData.ACIS_ELEMENTS[vX_list[j]]['name_long']
-                    available_variables.append([el_name,vd])
-                    available_variables_str+=el_name + ': ' + vd_str + ', '
             if available_variables:
                 stn_dict['available_variables'] = available_variables
-                stn_dict['available_variables_str'] = available_variables_str[0:-2]
-            #find index in alphabetically ordered list of station names
-            sorted_list.append(name.split(' ')[0])
-            try:
-                sorted_list.sort()
-                stn_idx = sorted_list.index(name.split(' ')[0])
-            except ValueError:
-                stn_idx = -1
-            #Insert stn into alphabeticlly ordered list
-            if stn_idx == -1:
-                stn_meta_list.append(stn_dict)
-            else:
-                stn_meta_list.insert(stn_idx, stn_dict)
-    stn_json['stations'] = stn_meta_list
-    WRCCUtils.load_data_to_json_file(f_dir + f_name, stn_json)
-    return stn_json, f_name
+                stn_dict['available_variables_str'] = ', '.join(
+                    [el_name + ': ' + ' - '.join(vd) for el_name, vd in available_variables])
+            stations.append(stn_dict)
+    return stations
 
 def get_station_data(form_input, program):
     '''
@@ -739,7 +2986,8 @@ def get_sod_data(form_input, program):
         params = dict(sids=station_ids, sdate=s_date, edate=e_date, \
         #elems=[dict(name=el)for el in variables])
         elems=[dict(vX=WRCCData.ACIS_ELEMENTS_DICT[el]['vX']) for el in variables])
-    request = MultiStnData(params)
+    #Stations are parsed one at a time as they come off the socket
+    request = MultiStnDataStream(params)
     if not request:
         request = {'error':'bad request, check params: %s'  % str(params)}
 
@@ -0,0 +1,312 @@
+#!/usr/bin/python
+'''
+module BenchmarkSCENIC.py
+
+Offline performance benchmarks for the my_acis python library.
+Network benchmarks run against a local stand-in ACIS server so that
+results do not depend on the load of the rcc-acis.org servers.
+
+Usage:
+python BenchmarkSCENIC.py [benchmark_name]
+'''
+import sys, os, time, json, gzip, math, random
+import StringIO
+import numpy
+
+import AcisWS, AcisStandIn, WRCCUtils, WRCCClasses
+
+try:
+    import my_acis.settings as settings
+except ImportError:
+    import my_acis_settings as settings
+
+###########
+#UTILITIES
+###########
+def start_stand_in_server(latency=0, **generator_kwargs):
+    '''
+    Starts a synthesizing stand-in ACIS server on a free local port.
+    Returns server and its base url
+    '''
+    generator = AcisStandIn.ACISResponseGenerator(**generator_kwargs)
+    return AcisStandIn.start_stand_in_server(generator=generator, latency=latency)
+
+def time_requests(request_function, url, params, num_requests):
+    '''
+    Returns requests per second for num_requests
+    consecutive calls of request_function
+    '''
+    start = time.time()
+    for i in range(num_requests):
+        request_function(url, params)
+    return num_requests / (time.time() - start)
+
+def gzip_string(data):
+    buf = StringIO.StringIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+        f.write(data)
+    return buf.getvalue()
+
+def boundary_polygon(lon, lat, radius, num_vertices, seed=0):
+    '''
+    Closed, ragged star shaped polygon around lon, lat
+    that looks like a county or basin boundary
+    '''
+    rng = random.Random(seed)
+    poly = []
+    r = radius
+    for i in range(num_vertices):
+        angle = 2 * math.pi * i / num_vertices
+        r = min(radius, max(0.3 * radius, r + rng.uniform(-0.05, 0.05) * radius))
+        poly.append((round(lon + r * math.cos(angle), 4), round(lat + r * math.sin(angle), 4)))
+    poly.append(poly[0])
+    return poly
+
+def prism_grid_meta(poly):
+    '''
+    ACIS style lat, lon meta of the 4km PRISM grid
+    covering the enclosing bbox of poly
+    '''
+    step = 1.0 / 24
+    lons = numpy.arange(min([p[0] for p in poly]), max([p[0] for p in poly]) + step, step)
+    lats = numpy.arange(min([p[1] for p in poly]), max([p[1] for p in poly]) + step, step)
+    grid_lons, grid_lats = numpy.meshgrid(lons, lats)
+    return {'lat':grid_lats.tolist(), 'lon':grid_lons.tolist()}
+
+def time_call(function, *args):
+    '''
+    Returns seconds function(*args) takes
+    '''
+    start = time.time()
+    function(*args)
+    return time.time() - start
+
+###########
+#BENCHMARKS
+###########
+def bench_make_request(num_requests=2000):
+    '''
+    make_request throughput without and with
+    the keep-alive connection pool
+    '''
+    server, base_url = start_stand_in_server()
+    url = base_url + 'StnData'
+    params = {'sid':'266779', 'sdate':'20150101', 'edate':'20150131', 'elems':'maxt,mint,pcpn'}
+    try:
+        rps_before = time_requests(AcisWS.make_request_no_pool, url, params, num_requests)
+        rps_after = time_requests(AcisWS.make_request, url, params, num_requests)
+    finally:
+        server.shutdown()
+        AcisWS.get_http_pool().close()
+    print 'make_request: %d requests' % num_requests
+    print '    new connection per request: %.1f requests/sec' % rps_before
+    print '    pooled keep-alive:          %.1f requests/sec' % rps_after
+    print '    speedup: %.2fx' % (rps_after / rps_before)
+
+def bench_stand_in_stack(latency=0.05):
+    '''
+    End to end AcisWS calls routed through settings.ACIS_STAND_IN_URL
+    to a stand-in server answering with latency seconds delay
+    '''
+    server, base_url = start_stand_in_server(latency=latency, num_stations=200)
+    AcisStandIn.use_stand_in(base_url)
+    calls = [
+        ('StnMeta', AcisWS.StnMeta, {'state':'NV', 'meta':'name,state,sids,ll,elev,uid'}),
+        ('StnData', AcisWS.StnData, {'sid':'266779', 'sdate':'19500101', 'edate':'20141231', 'elems':'maxt,mint,pcpn'}),
+        ('MultiStnData', AcisWS.MultiStnData, {'state':'NV', 'sdate':'20140101', 'edate':'20141231', 'elems':'maxt,mint,pcpn'}),
+        ('GridData', AcisWS.GridData, {'bbox':'-120,38,-118,40', 'sdate':'20140101', 'edate':'20140131', 'grid':'1', 'elems':'maxt'}),
+        ('General/county', lambda params: AcisWS.General('county', params), {'state':'NV', 'meta':'id,name,bbox'})
+    ]
+    try:
+        print 'stand-in stack: %.0f ms server latency' % (latency * 1000)
+        for name, function, params in calls:
+            print '    %-15s %.3f sec' % (name, time_call(function, params))
+    finally:
+        AcisStandIn.use_stand_in(None)
+        server.shutdown()
+        AcisWS.get_http_pool().close()
+
+def bench_station_finder_json(num_stations=15000):
+    '''
+    Size and serialize/parse time of the station finder json:
+    one entry per station network vs compact gzipped columns
+    '''
+    server, base_url = start_stand_in_server(num_stations=num_stations, max_networks=4)
+    AcisStandIn.use_stand_in(base_url)
+    try:
+        full, f_full = AcisWS.station_meta_to_json('state', 'nv')
+        compact, f_compact = AcisWS.station_meta_to_json('state', 'nv', compact=True)
+    finally:
+        AcisStandIn.use_stand_in(None)
+        server.shutdown()
+        AcisWS.get_http_pool().close()
+    sizes = [
+        os.path.getsize(settings.TEMP_DIR + f_full),
+        len(gzip_string(open(settings.TEMP_DIR + f_full).read())),
+        os.path.getsize(settings.TEMP_DIR + f_compact)
+    ]
+    start = time.time();json.dumps(full);dump_full = time.time() - start
+    start = time.time();gzip_string(json.dumps(compact, separators=(',',':')));dump_compact = time.time() - start
+    start = time.time();WRCCUtils.load_json_data_from_file(settings.TEMP_DIR + f_full);load_full = time.time() - start
+    start = time.time();WRCCUtils.load_json_data_from_gzip_file(settings.TEMP_DIR + f_compact);load_compact = time.time() - start
+    print 'station finder json: %d stations, %d entries' % (len(compact['columns']['name']), len(full['stations']))
+    print '    full:            %8.1f KB, serialize %.3f sec, parse %.3f sec' % (sizes[0] / 1024.0, dump_full, load_full)
+    print '    full, gzipped:   %8.1f KB' % (sizes[1] / 1024.0)
+    print '    compact gzipped: %8.1f KB, serialize %.3f sec, parse %.3f sec' % (sizes[2] / 1024.0, dump_compact, load_compact)
+    print '    size reduction: %.1fx' % (float(sizes[0]) / sizes[2])
+
+def bench_point_in_poly():
+    '''
+    Grid trimming mask of county and basin sized shapes:
+    point_in_or_on_poly per grid point vs vectorized points_in_or_on_poly
+    vs edge index of a prepared polygon
+    '''
+    shapes = [
+        ('county, 400 vertices', boundary_polygon(-119.5, 39.5, 0.6, 400, seed=1)),
+        ('basin, 4000 vertices', boundary_polygon(-117.0, 41.0, 1.5, 4000, seed=2))
+    ]
+    print 'point in polygon, 4km PRISM grid of the enclosing bbox'
+    for name, poly in shapes:
+        meta = prism_grid_meta(poly)
+        def per_point():
+            return [[WRCCUtils.point_in_or_on_poly(lon, lat, poly) for lon, lat in zip(lon_row, lat_row)] \
+                for lon_row, lat_row in zip(meta['lon'], meta['lat'])]
+        start = time.time();mask_before = per_point();t_before = time.time() - start
+        lons = numpy.array(meta['lon']);lats = numpy.array(meta['lat'])
+        start = time.time();mask_after = WRCCUtils.points_in_or_on_poly(lons, lats, poly);t_after = time.time() - start
+        start = time.time()
+        mask_prepared = WRCCClasses.PreparedPolygon(poly, include_boundary=True).contains_points(lons, lats)
+        t_prepared = time.time() - start
+        num_points = len(meta['lat']) * len(meta['lat'][0])
+        same = (numpy.array(mask_before) == mask_after).all() and (mask_after == mask_prepared).all()
+        print '    %s, %d grid points (same mask: %s)' % (name, num_points, str(same))
+        print '        per point:  %.3f sec' % t_before
+        print '        vectorized: %.3f sec' % t_after
+        print '        prepared:   %.3f sec' % t_prepared
+        print '        speedup: %.1fx, %.1fx' % (t_before / t_after, t_before / t_prepared)
+
+def bench_value_codec(num_values=500000):
+    '''
+    Decoding ACIS value strings: strip_data and float() per value
+    vs one decode_acis_values call
+    '''
+    rng = random.Random(0)
+    flagged = ['M', 'T', 'S', 'A', '', '0.00', '0.52A', '1.10', '0.00T', '0.01']
+    vals = [rng.choice(flagged) if rng.random() < 0.3 else str(rng.randint(-20, 110)) for i in range(num_values)]
+    def per_value():
+        values = []
+        for val in vals:
+            strp_val, flag = WRCCUtils.strip_data(val)
+            try:
+                values.append(float(strp_val))
+            except:
+                values.append(float('nan'))
+        return values
+    t_before = time_call(per_value)
+    t_after = time_call(WRCCUtils.decode_acis_values, vals)
+    values, flags = WRCCUtils.decode_acis_values(vals)
+    t_encode = time_call(WRCCUtils.encode_acis_values, values, flags)
+    print 'ACIS value codec: %d values' % num_values
+    print '    strip_data per value: %.3f sec, %.2f Mvalues/sec' % (t_before, num_values / t_before / 1e6)
+    print '    decode_acis_values:   %.3f sec, %.2f Mvalues/sec' % (t_after, num_values / t_after / 1e6)
+    print '    encode_acis_values:   %.3f sec, %.2f Mvalues/sec' % (t_encode, num_values / t_encode / 1e6)
+    print '    speedup: %.1fx' % (t_before / t_after)
+
+def sod_year_data(elements, years, seed=0):
+    '''
+    ACIS style SOD data [yr][el][doy] of a station,
+    with missing, trace and accumulated values
+    '''
+    rng = random.Random(seed)
+    def val(el, yr, doy):
+        if doy == 59 and not (yr % 4 == 0 and (yr % 100 != 0 or yr % 400 == 0)):
+            return 'M'
+        r = rng.random()
+        if r < 0.05:
+            return 'M'
+        if el == 'pcpn':
+            if r < 0.1:return 'T'
+            if r < 0.11:return '%.2fA' % rng.uniform(0, 3)
+            return '%.2f' % (rng.uniform(0, 1) if r < 0.4 else 0)
+        return str(rng.randint(-10, 105))
+    return [[[val(el, yr, doy) for doy in range(366)] for el in elements] for yr in years]
+
+def bench_sodxtrmts(num_years=120, num_stations=3):
+    '''
+    Sodxtrmts monthly tables of num_years long records:
+    day loop vs vectorized engine on lists vs on a SodCube
+    '''
+    import WRCCDataApps
+    years = range(2015 - num_years, 2015)
+    print 'Sodxtrmts: %d stations, %d years' % (num_stations, num_years)
+    for variable, elements, statistic in [('maxt', ['maxt'], 'mmax'), ('avgt', ['maxt', 'mint'], 'mave'), ('pcpn', ['pcpn'], 'msum')]:
+        data = [sod_year_data(elements, years, seed=stn) for stn in range(num_stations)]
+        cube = WRCCClasses.SodCube(elements, years, num_stations)
+        for stn in range(num_stations):
+            cube.set_station(stn, data[stn])
+        params = {'variables':[variable], 'dates':['%d-01-01' % years[0], '%d-12-31' % years[-1]],
+            'station_ids':range(num_stations), 'statistic':statistic, 'max_missing_days':'5', 'start_month':'07',
+            'departures_from_averages':'F', 'frequency_analysis':'F', 'units':'english'}
+        engine_statistics = WRCCDataApps.XTRMTS_ENGINE_STATISTICS
+        WRCCDataApps.XTRMTS_ENGINE_STATISTICS = []
+        try:
+            start = time.time();results_before = WRCCDataApps.Sodxtrmts(data=data, **params);t_before = time.time() - start
+        finally:
+            WRCCDataApps.XTRMTS_ENGINE_STATISTICS = engine_statistics
+        start = time.time();results_lists = WRCCDataApps.Sodxtrmts(data=data, **params);t_lists = time.time() - start
+        start = time.time();results_cube = WRCCDataApps.Sodxtrmts(data=cube, **params);t_cube = time.time() - start
+        same = results_before == results_lists == results_cube
+        print '    %s %s (same tables: %s)' % (variable, statistic, str(same))
+        print '        day loop:       %.3f sec' % t_before
+        print '        engine, lists:  %.3f sec' % t_lists
+        print '        engine, cube:   %.3f sec' % t_cube
+        print '        speedup: %.1fx, %.1fx' % (t_before / t_lists, t_before / t_cube)
+
+def bench_frequency_analysis(num_stations=50, num_years=60):
+    '''
+    Pearson III and GEV quantiles of the 13 monthly/annual series
+    of num_stations stations: scalar routines vs batched routines
+    '''
+    rand = random.Random(0)
+    piiili = [.0001, .0005, .0010, .0050, .0100, .0200, .0250, .0400, .0500, .1000, .2000, .3000, .4296, \
+        .5000, .5704, .6000, .7000, .8000, .9000, .9500, .9600, .9750, .9800, .9900, .9950, .9990, .9995]
+    piii = dict([(skew, sorted([rand.randint(-5000, 9000) for k in range(27)])) for skew in range(-90, 91)])
+    probs = [0.001, 0.002, 0.005, 0.01, 0.02, 0.04, 0.050, 0.1, 0.2, 0.3, 0.4, 0.5, \
+        0.6, 0.7, 0.8, 0.9, 0.95, 0.96, 0.98, 0.99, 0.995, 0.998, 0.999, 0.9999]
+    series = [[rand.gammavariate(2.0, 1.5) for yr in range(num_years)] for k in range(13 * num_stations)]
+    print 'Frequency analysis: %d series of %d years, %d probabilities' % (len(series), num_years, len(probs))
+    start = time.time()
+    piii_scalar = [WRCCUtils.Capiii(dict(enumerate(s)), len(s), piii, piiili, len(piiili), probs, len(probs))[0] for s in series]
+    gev_scalar = [WRCCUtils.Quantgev(WRCCUtils.Gev(dict(enumerate(s)), len(s)), probs, len(probs)) for s in series]
+    t_scalar = time.time() - start
+    start = time.time()
+    data, counts = WRCCUtils.fa_series_array(series)
+    piii_batched = WRCCUtils.capiii_array(data, counts, WRCCUtils.piii_table_array(piii), piiili, probs)[0]
+    gev_batched = WRCCUtils.gev_quantiles(series, probs)
+    t_batched = time.time() - start
+    print '    scalar routines:  %.3f sec' % t_scalar
+    print '    batched routines: %.3f sec' % t_batched
+    print '    speedup: %.1fx' % (t_scalar / t_batched)
+    print '    max difference: Pearson III %.2e, GEV %.2e' % \
+        (abs(numpy.array(piii_scalar) - piii_batched).max(), abs(numpy.array(gev_scalar) - gev_batched).max())
+
+BENCHMARKS = {
+    'make_request':bench_make_request,
+    'stand_in_stack':bench_stand_in_stack,
+    'station_finder_json':bench_station_finder_json,
+    'point_in_poly':bench_point_in_poly,
+    'value_codec':bench_value_codec,
+    'sodxtrmts':bench_sodxtrmts,
+    'frequency_analysis':bench_frequency_analysis
+}
+
+#########
+# M A I N
+#########
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        names = sys.argv[1:]
+    else:
+        names = sorted(BENCHMARKS.keys())
+    for name in names:
+        BENCHMARKS[name]()
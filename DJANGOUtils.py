@@ -13,6 +13,10 @@ fourtnight = WRCCUtils.set_back_date(14)
 
 
 def create_kml_file(area_type, overlay_state):
+    #Pre-generated overlay
+    kml_file_name = WRCCUtils.find_overlay_file(area_type, overlay_state, 'kml')
+    if kml_file_name is not None:
+        return getattr(settings, 'OVERLAY_URL', settings.TMP_URL + 'overlays/') + kml_file_name
     kml_file_name = overlay_state + '_' + area_type + '.kml'
     kml_file_path = settings.TMP_URL +  kml_file_name
     status = WRCCUtils.generate_kml_file(area_type, overlay_state, kml_file_name, settings.TEMP_DIR)
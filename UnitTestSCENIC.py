@@ -1,10 +1,14 @@
-import WRCCUtils, WRCCData, DJANGOUtils, AcisWS, WRCCClasses
+import WRCCUtils, WRCCData, DJANGOUtils, AcisWS, WRCCClasses, WRCCDataApps
 import my_acis_settings as settings
 
 import unittest
-import os, sys
+import os, sys, time, datetime
+import threading, sqlite3
 import copy
-import json
+import json, gzip
+import StringIO
+import numpy as np
+from scipy import stats
 #Testing feedback form
 from django.core.mail import send_mail
 
@@ -151,6 +155,836 @@ class TestFindArea(unittest.TestCase):
                 logger.error('AssertionError' + str(err))
 
 
+class TestIsCacheable(unittest.TestCase):
+    def test_grid_meta_only(self):
+        params = {'bbox':'-120,39,-119,40', 'date':'20150101', 'grid':'1', 'meta':'ll,elev'}
+        self.assertTrue(AcisWS.is_cacheable('GridData', params))
+        self.assertFalse(AcisWS.is_cacheable('GridData', dict(params, elems='maxt')))
+        params = {'bbox':'-120,39,-119,40', 'sdate':'20150101', 'edate':'20150131', 'grid':'1', 'meta':'ll'}
+        self.assertFalse(AcisWS.is_cacheable('GridData', params))
+
+class TestPointsInPoly(unittest.TestCase):
+    def setUp(self):
+        self.polys = [
+            [(0.,0.),(2.,0.),(2.,2.),(0.,2.),(0.,0.)],
+            [(0.,0.),(1.,2.),(2.,0.),(0.,0.)],
+            [(-119.5,38.2),(-118.1,38.9),(-118.6,39.8),(-119.9,39.5),(-119.5,38.2)]
+        ]
+        #grid with points on edges and vertices
+        self.lons = [-120. + 0.25*i for i in range(17)] + [-0.5 + 0.25*i for i in range(11)]
+        self.lats = [38. + 0.125*i for i in range(17)] + [-0.5 + 0.25*i for i in range(11)]
+
+    def test_points_in_or_on_poly(self):
+        for poly in self.polys:
+            for lat in self.lats:
+                mask = WRCCUtils.points_in_or_on_poly(self.lons, [lat for lon in self.lons], poly)
+                for lon_idx, lon in enumerate(self.lons):
+                    self.assertEqual(mask[lon_idx], WRCCUtils.point_in_or_on_poly(lon, lat, poly))
+
+    def test_points_in_poly(self):
+        for poly in self.polys:
+            for lat in self.lats:
+                mask = WRCCUtils.points_in_poly(self.lons, [lat for lon in self.lons], poly)
+                for lon_idx, lon in enumerate(self.lons):
+                    self.assertEqual(mask[lon_idx], WRCCUtils.point_in_poly(lon, lat, poly))
+
+    def test_prepared_polygon(self):
+        for poly in self.polys:
+            for PointIn, include_boundary in [(WRCCUtils.point_in_poly, False), (WRCCUtils.point_in_or_on_poly, True)]:
+                prepared_poly = WRCCClasses.PreparedPolygon(poly, include_boundary=include_boundary)
+                for lat in self.lats:
+                    mask = prepared_poly.contains_points(self.lons, [lat for lon in self.lons])
+                    for lon_idx, lon in enumerate(self.lons):
+                        self.assertEqual(mask[lon_idx], PointIn(lon, lat, poly))
+
+    def test_prepared_polygon_holes(self):
+        outer = [(0.,0.),(4.,0.),(4.,4.),(0.,4.),(0.,0.)]
+        hole = [(1.,1.),(3.,1.),(3.,3.),(1.,3.),(1.,1.)]
+        island = [(10.,10.),(11.,10.),(11.,11.),(10.,10.)]
+        prepared_poly = WRCCClasses.PreparedPolygon([[outer, hole], [island]])
+        self.assertTrue(prepared_poly.contains(0.5, 0.5))
+        self.assertFalse(prepared_poly.contains(2., 2.))
+        self.assertTrue(prepared_poly.contains(10.8, 10.2))
+        self.assertFalse(prepared_poly.contains(5., 5.))
+
+    def test_points_in_circle(self):
+        circle = [-119., 39., 50000.]
+        for lat in self.lats:
+            mask = WRCCUtils.points_in_circle(self.lons, [lat for lon in self.lons], circle)
+            for lon_idx, lon in enumerate(self.lons):
+                self.assertEqual(mask[lon_idx], WRCCUtils.point_in_circle(lon, lat, circle))
+
+
+class TestSimplifyRing(unittest.TestCase):
+    def setUp(self):
+        #Closed 40-gon, no three vertices on a line
+        angles = np.linspace(0, 2 * np.pi, 41)
+        self.ring = np.column_stack([np.cos(angles), np.sin(angles)])
+        self.ring[-1] = self.ring[0]
+
+    def test_weights(self):
+        points = np.array([[0., 0.], [1., 1.], [2., 0.], [3., 0.5], [4., 0.]])
+        weights = WRCCUtils.douglas_peucker_weights(points)
+        self.assertEqual(weights[0], np.inf)
+        self.assertEqual(weights[-1], np.inf)
+        #Distance to the segment of the split the vertex is chosen at
+        self.assertAlmostEqual(weights[1], 1.0)
+        self.assertAlmostEqual(weights[2], 2 / 10 ** 0.5)
+        self.assertAlmostEqual(weights[3], 0.5)
+
+    def test_tolerance_zero(self):
+        self.assertEqual(WRCCUtils.simplify_ring(self.ring, tolerance=0).tolist(), self.ring.tolist())
+        self.assertEqual(WRCCUtils.simplify_ring(self.ring).tolist(), self.ring.tolist())
+
+    def test_max_vertices(self):
+        for max_vertices in [40, 20, 10, 5]:
+            simplified = WRCCUtils.simplify_ring(self.ring, max_vertices=max_vertices)
+            self.assertEqual(simplified.shape[0], max_vertices)
+            #Still closed, vertices kept in order
+            self.assertEqual(simplified[0].tolist(), simplified[-1].tolist())
+            self.assertEqual([self.ring.tolist().index(v) for v in simplified[0:-1].tolist()],
+                sorted([self.ring.tolist().index(v) for v in simplified[0:-1].tolist()]))
+        #Never less than a triangle
+        self.assertEqual(WRCCUtils.simplify_ring(self.ring, max_vertices=2).shape[0], 4)
+        self.assertEqual(WRCCUtils.simplify_ring(self.ring, tolerance=10.0).shape[0], 4)
+
+class TestAcisValueCodec(unittest.TestCase):
+    def setUp(self):
+        self.vals = ['0.52', 'M', 'T', 'S', 'A', ' ', '', '75', '-5', '5', '-M', '1.10A',
+            '0.00T', '12S', '-9999', 'abc', '1e3', '100E', '-0.5', 3, 0.25, -9999.0]
+
+    def strip_data_float(self, val):
+        strp_val, flag = WRCCUtils.strip_data(val)
+        try:
+            return float(strp_val), ord(flag)
+        except:
+            return None, ord(flag)
+
+    def test_decode_acis_values(self):
+        values, flags = WRCCUtils.decode_acis_values(self.vals)
+        for idx, val in enumerate(self.vals):
+            value, flag = self.strip_data_float(val)
+            self.assertEqual(flags[idx], flag)
+            if value is None:
+                self.assertTrue(values[idx] != values[idx])
+            else:
+                self.assertEqual(values[idx], value)
+
+    def test_decode_add(self):
+        values, flags, obs_times = WRCCUtils.decode_acis_values([['0.5', 'A', 17], ['M', ' ', -1]], add='f,t')
+        self.assertEqual(values.tolist(), [0.5, -9999.0])
+        self.assertEqual(flags.tolist(), [WRCCUtils.FLAG_ACCUMULATED, WRCCUtils.FLAG_MISSING])
+        self.assertEqual(obs_times.tolist(), [17, -1])
+
+    def test_encode_acis_values(self):
+        #Flags of non-numeric strings can not be encoded
+        values, flags = WRCCUtils.decode_acis_values([v for v in self.vals if v != 'abc'])
+        encoded = WRCCUtils.encode_acis_values(values, flags)
+        values2, flags2 = WRCCUtils.decode_acis_values(encoded)
+        self.assertEqual(flags.tolist(), flags2.tolist())
+        for v1, v2 in zip(values.tolist(), values2.tolist()):
+            self.assertTrue(v1 == v2 or (v1 != v1 and v2 != v2))
+
+class TestSodCube(unittest.TestCase):
+    def setUp(self):
+        #data[yr][el][doy] of a station, 1999 has no Feb 29
+        self.yr_data = [
+            [['%d' % (doy % 90) for doy in range(366)], ['0.00', 'T', '1.25A', 'M'] + ['0.10' for doy in range(362)]],
+            [['M' if doy == 59 else '-%d' % (doy % 20) for doy in range(366)], ['S', '0.52'] + ['M' for doy in range(364)]]
+        ]
+        self.request = {'data':[{'meta':{'sids':['266779 2']}, 'data':self.yr_data}]}
+        self.params = {'sids':'266779', 'start_date':'19980101', 'end_date':'19991231'}
+
+    def test_station_lists(self):
+        job = WRCCClasses.SODDataJob('Sodxtrmts', self.params)
+        data, error = job.format_data_station(copy.deepcopy(self.request), ['266779', '999999'], ['maxt', 'pcpn'])
+        job.sod_cube = True
+        cube, error = job.format_data_station(copy.deepcopy(self.request), ['266779', '999999'], ['maxt', 'pcpn'])
+        self.assertTrue(isinstance(cube, WRCCClasses.SodCube))
+        self.assertEqual(cube.values.shape, (2, 2, 2, 366))
+        self.assertEqual(list(cube.lists()), data)
+        #Applications that read the nested lists get them with sod_cube as well
+        data, error = WRCCClasses.SODDataJob('Soddd', self.params).format_data_station(
+            copy.deepcopy(self.request), ['266779', '999999'], ['maxt', 'pcpn'])
+        job = WRCCClasses.SODDataJob('Soddd', self.params, sod_cube=True)
+        self.assertEqual(job.format_data_station(copy.deepcopy(self.request), ['266779', '999999'], ['maxt', 'pcpn'])[0], data)
+
+    def test_values(self):
+        cube = WRCCClasses.SodCube(['maxt', 'pcpn'], [1998, 1999], 1)
+        cube.set_station(0, self.yr_data)
+        self.assertEqual(cube.values[0, 1, 0, 0:4].tolist(), [0.0, 0.0, 1.25, -9999.0])
+        self.assertEqual(cube.flags[0, 1, 0, 2], WRCCUtils.FLAG_ACCUMULATED)
+        self.assertTrue(cube.missing[0, 0, 1, 59])
+        self.assertEqual(cube.missing[0, 1, 1].sum(), 364)
+
+class TestSodxtrmtsEngine(unittest.TestCase):
+    def setUp(self):
+        #data[yr][el][doy] of maxt, mint for 1999-2001
+        self.data = [[[[str((yr * 7 + doy * 3) % 60 + 20 * el) if (doy + yr) % 11 else 'M' for doy in range(366)] \
+            for el in [1, 0]] for yr in range(3)]]
+        self.params = {'dates':['1999-01-01', '2001-12-31'], 'station_ids':['266779'],
+            'max_missing_days':'5', 'departures_from_averages':'F', 'frequency_analysis':'F', 'base_temperature':65}
+
+    def sodxtrmts(self, engine_statistics, **params):
+        statistics = WRCCDataApps.XTRMTS_ENGINE_STATISTICS
+        WRCCDataApps.XTRMTS_ENGINE_STATISTICS = engine_statistics
+        try:
+            return WRCCDataApps.Sodxtrmts(data=copy.deepcopy(self.data), **dict(self.params, **params))
+        finally:
+            WRCCDataApps.XTRMTS_ENGINE_STATISTICS = statistics
+
+    def test_engine_tables(self):
+        for variable in ['maxt', 'avgt', 'dtr', 'hdd']:
+            for statistic in WRCCDataApps.XTRMTS_ENGINE_STATISTICS:
+                for start_month in ['01', '10']:
+                    params = {'variables':[variable], 'statistic':statistic, 'start_month':start_month}
+                    self.assertEqual(self.sodxtrmts([statistic], **params), self.sodxtrmts([], **params))
+
+class TestPctil(unittest.TestCase):
+    def test_sodpct(self):
+        self.assertEqual(WRCCUtils.pctil('Sodpct', {0:5, 1:1, 2:3, 3:2, 4:4}, 5, 4), ([1.75, 3.0, 4.25], [1, 2, 3, 4, 5]))
+
+    def test_sodthr_clamping(self):
+        pctile, sort, xmed = WRCCUtils.pctil('Sodthr', {0:-1, 1:10, 2:20, 3:400, 4:30}, 5, 5)
+        self.assertEqual(pctile, [-1, 15.0, 25.0, 367])
+        self.assertEqual(xmed, 20)
+
+    def test_sort_unselected(self):
+        #NaN and values above 100000000.0 were never selected by the selection sort
+        self.assertEqual(WRCCUtils.pctil_sort({0:2.0, 1:float('nan'), 2:1.0}, 3), [1.0, 2.0, 3.0])
+        self.assertEqual(WRCCUtils.pctil_sort({0:2e8, 1:1.0}, 2), [1.0, 100000000.0])
+
+class TestStatTables(unittest.TestCase):
+    def setUp(self):
+        self.compiled_path = settings.TEMP_DIR + 'test_stat_tables_%d.npy' % os.getpid()
+
+    def tearDown(self):
+        if os.path.isfile(self.compiled_path):
+            os.remove(self.compiled_path)
+
+    def test_compiled_file(self):
+        compiled = WRCCClasses.StatTables(settings.LIB_PREFIX, self.compiled_path)
+        self.assertEqual(compiled.piii.shape, (181, 27))
+        self.assertTrue(os.path.isfile(self.compiled_path))
+        mapped = WRCCClasses.StatTables(settings.LIB_PREFIX, self.compiled_path)
+        #Memory-mapped from the compiled file
+        self.assertEqual(os.path.realpath(mapped.record().filename), os.path.realpath(self.compiled_path))
+        self.assertEqual(mapped.piii_dict(), compiled.piii_dict())
+        self.assertEqual(len(mapped.areal('ask')), 16)
+        self.assertEqual(mapped.areal('r12to1'), compiled.areal('r12to1'))
+
+class TestGridMaskStore(unittest.TestCase):
+    def setUp(self):
+        self.mask_dir = settings.TEMP_DIR + 'test_grid_masks_%d/' % os.getpid()
+        self.grid_meta = {
+            'lat':[[39.0 + 0.5 * i] * 5 for i in range(3)],
+            'lon':[[-120.0 + 0.5 * j for j in range(5)] for i in range(3)]
+        }
+        self.mask = [[(i + j) % 3 == 0 for j in range(5)] for i in range(3)]
+
+    def tearDown(self):
+        for f_name in os.listdir(self.mask_dir) if os.path.isdir(self.mask_dir) else []:
+            os.remove(self.mask_dir + f_name)
+        if os.path.isdir(self.mask_dir):
+            os.rmdir(self.mask_dir)
+
+    def test_set_get(self):
+        store = WRCCClasses.GridMaskStore(self.mask_dir)
+        self.assertEqual(store.get('1', 'county', '06003', self.grid_meta), None)
+        store.set('1', 'county', '06003', self.grid_meta, self.mask)
+        path = store.base_path('1', 'county', '06003')
+        #15 cells packed into 2 bytes
+        self.assertEqual(np.load(path + '.npy', mmap_mode='r').shape, (2,))
+        with open(path + '.json', 'r') as f:
+            self.assertEqual(json.load(f), {'version':store.version, 'shape':[3, 5], 'corners':[39.0, -120.0, 40.0, -118.0]})
+        #Reload from disk
+        mask = WRCCClasses.GridMaskStore(self.mask_dir).get('1', 'county', '06003', self.grid_meta)
+        self.assertEqual(mask.dtype, bool)
+        self.assertEqual(mask.tolist(), self.mask)
+
+    def test_grid_mismatch(self):
+        store = WRCCClasses.GridMaskStore(self.mask_dir)
+        store.set('1', 'county', '06003', self.grid_meta, self.mask)
+        shifted = {'lat':self.grid_meta['lat'], 'lon':[[lon + 0.5 for lon in row] for row in self.grid_meta['lon']]}
+        self.assertEqual(store.get('1', 'county', '06003', shifted), None)
+        self.assertEqual(store.get('1', 'county', '06003', {'lat':self.grid_meta['lat'][0:2], 'lon':self.grid_meta['lon'][0:2]}), None)
+
+class TestOverlayStore(unittest.TestCase):
+    def setUp(self):
+        self.overlay_dir = settings.TEMP_DIR + 'test_overlays_%d/' % os.getpid()
+        self.store = WRCCClasses.OverlayStore(self.overlay_dir, levels=[None, 0.01], max_age=3600)
+        self.built = []
+        self.store.build = lambda area_type, state: self.built.append((area_type, state)) or 'Error'
+
+    def tearDown(self):
+        for f_name in os.listdir(self.overlay_dir) if os.path.isdir(self.overlay_dir) else []:
+            os.remove(self.overlay_dir + f_name)
+        if os.path.isdir(self.overlay_dir):
+            os.rmdir(self.overlay_dir)
+
+    def test_file_name(self):
+        self.assertEqual(self.store.file_name('county', 'NV', 'kml'), 'nv_county_0.kml')
+        self.assertEqual(self.store.file_name('cwa', 'ca', 'geojson', level=1), 'ca_cwa_1.geojson')
+
+    def test_write_gz(self):
+        content = '{"type":"FeatureCollection","features":[]}'
+        self.store.write('nv_county_0.geojson', content)
+        with open(self.overlay_dir + 'nv_county_0.geojson', 'r') as f:
+            self.assertEqual(f.read(), content)
+        self.assertEqual(gzip.open(self.overlay_dir + 'nv_county_0.geojson.gz', 'rb').read(), content)
+
+    def test_is_fresh(self):
+        path = self.overlay_dir + 'nv_county_0.kml'
+        self.assertFalse(self.store.is_fresh(path))
+        self.store.write('nv_county_0.kml', '<kml/>')
+        if AcisWS.get_boundary_store() is None:
+            self.assertTrue(self.store.is_fresh(path))
+            os.utime(path, (time.time() - 7200, time.time() - 7200))
+            self.assertFalse(self.store.is_fresh(path))
+
+    def test_find(self):
+        #Missing overlays are built, the build fails here
+        self.assertEqual(self.store.find('county', 'nv', 'kml', gzipped=True), None)
+        self.assertEqual(self.built, [('county', 'nv')])
+        self.assertEqual(self.store.find('county', 'nv', 'shp'), None)
+        self.assertEqual(self.store.find('county', 'nv', 'kml', level=2), None)
+        #Stale overlays are served without a rebuild
+        self.store.write('nv_county_0.kml', '<kml/>')
+        os.utime(self.overlay_dir + 'nv_county_0.kml.gz', (0, 0))
+        self.assertEqual(self.store.find('county', 'nv', 'kml', gzipped=True), 'nv_county_0.kml.gz')
+        self.assertEqual(self.store.find('county', 'nv', 'kml'), 'nv_county_0.kml')
+        self.assertEqual(self.built, [('county', 'nv')])
+
+class TestFrequencyAnalysis(unittest.TestCase):
+    def setUp(self):
+        self.piii = dict([(skew, [skew * k - 500 * (13 - k) for k in range(27)]) for skew in range(-90, 91)])
+        self.piiili = [.0001, .0005, .0010, .0050, .0100, .0200, .0250, .0400, .0500, .1000, .2000, .3000, .4296, \
+            .5000, .5704, .6000, .7000, .8000, .9000, .9500, .9600, .9750, .9800, .9900, .9950, .9990, .9995]
+        self.series = [[(yr * 37 + mon * 11) % 23 + 0.5 * mon for yr in range(30)] for mon in range(13)]
+        self.probs = [0.001, 0.01, 0.1, 0.5, 0.9, 0.99, 0.999]
+
+    def test_pintp3(self):
+        skews = [-9.5, -2.34, -0.05, 0.0, 0.55, 3.21, 9.0]
+        psd = WRCCUtils.pintp3_array(self.piiili + [0.00001, 0.99999], skews, WRCCUtils.piii_table_array(self.piii), self.piiili)
+        for i, skew in enumerate(skews):
+            for j, prob in enumerate(self.piiili + [0.00001, 0.99999]):
+                self.assertEqual(psd[i][j], WRCCUtils.Pintp3(prob, self.piii, self.piiili, len(self.piiili), skew))
+
+    def test_gev(self):
+        quantiles = WRCCUtils.gev_quantiles(self.series, self.probs)
+        for idx, series in enumerate(self.series):
+            para = WRCCUtils.Gev(dict(enumerate(series)), len(series))
+            for k, prob in enumerate(self.probs):
+                self.assertAlmostEqual(quantiles[idx][k], WRCCUtils.Quagev(prob, para), places=8)
+
+    def test_capiii(self):
+        data, counts = WRCCUtils.fa_series_array(self.series)
+        psd, ave, stdev, sk = WRCCUtils.capiii_array(data, counts, WRCCUtils.piii_table_array(self.piii), self.piiili, self.probs)[0:4]
+        for idx, series in enumerate(self.series):
+            result = WRCCUtils.Capiii(dict(enumerate(series)), len(series), self.piii, self.piiili, len(self.piiili), self.probs, len(self.probs))
+            for k, prob in enumerate(self.probs):
+                self.assertAlmostEqual(psd[idx][k], result[0][k], places=8)
+            self.assertAlmostEqual(ave[idx], result[1], places=8)
+            self.assertAlmostEqual(stdev[idx], result[2], places=8)
+            self.assertAlmostEqual(sk[idx], result[3], places=8)
+
+    def test_betap(self):
+        #Series of different lengths, Fitbetap is slow
+        series = [[1.0 + ((yr * 37 + mon * 11) % 23) * (1 + 0.1 * mon) for yr in range(6 + 3 * mon)] for mon in range(2)]
+        quantiles = WRCCUtils.betap_quantiles(series, self.probs)
+        for idx, values in enumerate(series):
+            result = WRCCUtils.Cabetap(dict(enumerate(values)), len(values), self.probs, len(self.probs))
+            for k, prob in enumerate(self.probs):
+                self.assertAlmostEqual(quantiles[idx][k] / result[k], 1.0, places=8)
+
+    def test_gamma(self):
+        #Without censored values the fit is the gamma maximum likelihood fit
+        series = [[1.0 + value for value in values] for values in self.series]
+        quantiles = WRCCUtils.gamma_quantiles(series, self.probs)
+        for idx, values in enumerate(series):
+            shape, loc, scale = stats.gamma.fit(values, floc=0)
+            for k, prob in enumerate(self.probs):
+                self.assertAlmostEqual(quantiles[idx][k] / stats.gamma.ppf(prob, shape, scale=scale), 1.0, places=4)
+        #Zeros are censored, they lie below the censoring level 0.004
+        quantiles = WRCCUtils.gamma_quantiles([[0.0] * 10 + [1.0, 2.0, 3.0] * 5], [0.1, 0.5, 0.9])
+        self.assertTrue(0.0 < quantiles[0][0] < 0.004 < quantiles[0][1] < quantiles[0][2])
+
+class TestStationTrim(unittest.TestCase):
+    def setUp(self):
+        self.form = {'variables':['maxt', 'pcpn'], 'elements':['maxt', 'pcpn'], 'start_date':'20000101', 'end_date':'20000103',
+            'data_summary':'temporal_summary', 'temporal_summary':'max', 'units':'english', 'show_flags':'F',
+            'area_type':'shape', 'shape':'-119,39,-118,39.6', 'data_type':'station', 'app_name':'multi_lister'}
+        lls = [[-118.5, 39.2], [-118.9, 39.5], [-117.5, 39.2], None]
+        self.stations = [{'meta':{'name':'S%d' % idx, 'sids':['%d 2' % idx], 'state':'NV', 'll':ll},
+            'data':[['%d' % (60 + idx), '0.%d0' % day] for day in range(3)]} for idx, ll in enumerate(lls)]
+
+    def test_generator(self):
+        #MultiStnDataStream responses hold a generator of the stations
+        results = WRCCUtils.station_data_trim_and_summary({'data':copy.deepcopy(self.stations)}, dict(self.form))
+        self.assertEqual([row[0] for row in results['smry'][1:]], ['S0 (0)', 'S1 (1)'])
+        results_stream = WRCCUtils.station_data_trim_and_summary({'data':(stn for stn in copy.deepcopy(self.stations))}, dict(self.form))
+        self.assertEqual(results_stream, results)
+
+class FakeStreamPool(object):
+    '''
+    Stands in for AcisWS.ACISConnectionPool,
+    answers every request with body
+    '''
+    def __init__(self, body, status=200):
+        self.body = body
+        self.status = status
+
+    def urlopen_stream(self, url, body, headers, timeout=None):
+        return self.status, StringIO.StringIO(self.body)
+
+class TestStreamResponse(unittest.TestCase):
+    def setUp(self):
+        self.http_pool = AcisWS._http_pool
+        self.form = {'variables':['maxt', 'pcpn'], 'elements':['maxt', 'pcpn'], 'start_date':'20000101', 'end_date':'20000103',
+            'data_summary':'none', 'temporal_summary':'max', 'spatial_summary':'mean', 'units':'english', 'show_flags':'F',
+            'start_window':'01-02', 'end_window':'01-03', 'area_type':'shape', 'shape':'-119,39,-118,39.6',
+            'data_type':'station', 'app_name':'multi_lister'}
+        #Strings with brackets and separators that must not end an item
+        stations = [{'meta':{'name':'S%d, [x]' % idx, 'sids':['%d 2' % idx], 'state':'NV', 'll':[-118.1 - 0.1 * idx, 39.1]},
+            'data':[['%d' % (60 + idx + day), '0.%d0' % day] for day in range(3)]} for idx in range(5)]
+        self.body = json.dumps({'data':stations})
+
+    def tearDown(self):
+        AcisWS._http_pool = self.http_pool
+
+    def stream(self, body, chunk_size=7):
+        AcisWS._http_pool = FakeStreamPool(body)
+        return AcisWS.make_request_stream('http://acis', {}, chunk_size=chunk_size)
+
+    def test_chunk_boundaries(self):
+        #Items are split across chunks of any size
+        for chunk_size in [1, 7, 64, 65536]:
+            req = self.stream(self.body, chunk_size=chunk_size)
+            self.assertEqual(list(req['data']), json.loads(self.body)['data'])
+
+    def test_error(self):
+        #Responses that are no data array are parsed whole
+        self.assertEqual(self.stream('{"error":"Unknown sid"}'), {'error':'Unknown sid'})
+
+    def test_empty(self):
+        self.assertEqual(list(self.stream('{"data":[]}')['data']), [])
+        self.assertEqual(list(self.stream(' { "data" : [ ] }')['data']), [])
+
+    def test_incomplete(self):
+        req = self.stream(self.body[0:-30])
+        self.assertRaises(ValueError, list, req['data'])
+
+    def test_streaming_formatters(self):
+        #Streaming formatters give the same results for a generator as for a list
+        for formatter in WRCCUtils.streaming_station_formatters:
+            for data_summary in ['none', 'temporal_summary', 'windowed_data']:
+                form = dict(self.form, data_summary=data_summary)
+                results = getattr(WRCCUtils, formatter)({'data':json.loads(self.body)['data']}, dict(form))
+                results_stream = getattr(WRCCUtils, formatter)(self.stream(self.body), dict(form))
+                self.assertEqual(results_stream, results)
+                self.assertNotEqual(results['data'] or results['smry'], [])
+
+def fake_multi_stn_data(params):
+    '''
+    Synthetic ACIS MultiStnData response for sids S0, S1, ...
+    Station Sk reports from day 4 * k on, stations without data
+    in the date range are left out like ACIS does.
+    '''
+    s, e = AcisWS._date_range(params)
+    num_els = len(AcisWS._elems_list(params))
+    data = []
+    for sid in AcisWS._sids_list(params):
+        k = int(sid[1:])
+        first = datetime.datetime(2000, 1, 1) + datetime.timedelta(days=4 * k)
+        if first > e:
+            continue
+        rows = []
+        for day in range((e - s).days + 1):
+            date = s + datetime.timedelta(days=day)
+            if date < first:
+                rows.append(['M' for el in range(num_els)])
+            else:
+                rows.append(['%d' % (k * 100 + date.day + el) for el in range(num_els)])
+        data.append({'meta':{'uid':k, 'sids':['%s 2' % sid], 'name':'Station %d' % k}, 'data':rows})
+    return {'data':data}
+
+def fake_grid_data(params):
+    '''
+    Synthetic ACIS GridData bbox response on a 0.25 degree grid,
+    rows ordered south to north, grid points on the bbox edges included
+    '''
+    W, S, E, N = [float(b) for b in params['bbox'].split(',')]
+    lats = [i * 0.25 for i in range(int(np.ceil(S / 0.25 - 1e-6)), int(np.floor(N / 0.25 + 1e-6)) + 1)]
+    lons = [j * 0.25 for j in range(int(np.ceil(W / 0.25 - 1e-6)), int(np.floor(E / 0.25 + 1e-6)) + 1)]
+    s, e = AcisWS._date_range(params)
+    data = []
+    for day in range((e - s).days + 1):
+        date = s + datetime.timedelta(days=day)
+        data.append([date.strftime('%Y-%m-%d'), [[round(lat * 10 + lon + date.day, 2) for lon in lons] for lat in lats]])
+    return {'meta':{'lat':[[lat for lon in lons] for lat in lats], 'lon':[lons for lat in lats]}, 'data':data}
+
+class TestSplitRequest(unittest.TestCase):
+    def setUp(self):
+        self.data_call_multi = AcisWS.DataCallMulti
+        self.stn_params = {'sids':','.join(['S%d' % k for k in range(10)]), 'sdate':'20000101', 'edate':'20000120',
+            'elems':[{'name':'maxt'}, {'name':'pcpn'}]}
+        self.grid_params = {'bbox':'-120,38,-119,40', 'grid':'1', 'sdate':'20000101', 'edate':'20000101', 'elems':'maxt'}
+        self.calls = []
+
+    def tearDown(self):
+        AcisWS.DataCallMulti = self.data_call_multi
+
+    def fake_data_call_multi(self, fail):
+        #Fails the pieces listed in fail on their first try
+        def data_call_multi(acis_call, params_list):
+            self.calls.append(params_list)
+            reqs = []
+            for params in params_list:
+                if params in fail:
+                    fail.remove(params)
+                    reqs.append({'error':'Timeout'})
+                else:
+                    reqs.append(fake_multi_stn_data(params))
+            return reqs
+        return data_call_multi
+
+    def test_split_stations(self):
+        pieces = AcisWS.split_request('MultiStnData', self.stn_params, max_cells=50)
+        self.assertEqual([p[0]['sids'] for p in pieces], ['S0,S1', 'S2,S3', 'S4,S5', 'S6,S7', 'S8,S9'])
+        self.assertEqual([[dp['sdate'], dp['edate']] for dp in pieces[0]], [['20000101', '20000110'], ['20000111', '20000120']])
+        self.assertEqual(AcisWS.split_request('MultiStnData', self.stn_params), [[self.stn_params]])
+
+    def test_merge_station_gaps(self):
+        #S3 and S4 have no data in the first date range, S5 to S9 have none at all
+        pieces = AcisWS.split_request('MultiStnData', self.stn_params, max_cells=50)
+        responses = [[fake_multi_stn_data(dp) for dp in ps] for ps in pieces]
+        self.assertEqual([stn['meta']['uid'] for stn in responses[1][0]['data']], [2])
+        merged = AcisWS.merge_responses('MultiStnData', pieces, responses)
+        s3 = merged['data'][3]
+        self.assertEqual(s3['meta']['uid'], 3)
+        self.assertEqual(s3['data'][0:12], [['M', 'M'] for day in range(12)])
+        self.assertEqual(s3['data'][12], ['313', '314'])
+        self.assertEqual(len(merged['data']), 5)
+        self.assertEqual(merged, fake_multi_stn_data(self.stn_params))
+
+    def test_merge_tiles(self):
+        pieces = AcisWS.split_request('GridData', self.grid_params, max_cells=300)
+        self.assertEqual([p[0]['bbox'] for p in pieces], ['-120.0,38.0,-119.0,38.5', '-120.0,38.5,-119.0,39.0',
+            '-120.0,39.0,-119.0,39.5', '-120.0,39.5,-119.0,40.0'])
+        responses = [[fake_grid_data(p) for p in ps] for ps in pieces]
+        #Grid rows on the band boundaries are returned by both bands
+        self.assertEqual(responses[0][0]['meta']['lat'][-1], responses[1][0]['meta']['lat'][0])
+        merged = AcisWS.merge_responses('GridData', pieces, responses)
+        self.assertEqual([row[0] for row in merged['meta']['lat']], [38.0 + 0.25 * i for i in range(9)])
+        self.assertEqual(merged, fake_grid_data(self.grid_params))
+        #Bands come back in any order
+        merged = AcisWS.merge_responses('GridData', pieces[::-1], responses[::-1])
+        self.assertEqual(merged, fake_grid_data(self.grid_params))
+
+    def test_round_trip(self):
+        for max_cells in [20, 50, 100, 399, 400]:
+            pieces = AcisWS.split_request('MultiStnData', self.stn_params, max_cells=max_cells)
+            responses = [[fake_multi_stn_data(dp) for dp in ps] for ps in pieces]
+            self.assertEqual(AcisWS.merge_responses('MultiStnData', pieces, responses), fake_multi_stn_data(self.stn_params))
+        params = dict(self.grid_params, edate='20000103')
+        pieces = AcisWS.split_request('GridData', params, max_cells=100)
+        self.assertTrue(len(pieces[0]) > 1)
+        responses = [[fake_grid_data(dp) for dp in ps] for ps in pieces]
+        self.assertEqual(AcisWS.merge_responses('GridData', pieces, responses), fake_grid_data(params))
+
+    def test_retry_failed_piece(self):
+        pieces = AcisWS.split_request('MultiStnData', self.stn_params, max_cells=50)
+        AcisWS.DataCallMulti = self.fake_data_call_multi([pieces[2][1]])
+        req = AcisWS.DataCallSplit('MultiStnData', self.stn_params, max_cells=50, max_retries=2)
+        self.assertEqual(req, fake_multi_stn_data(self.stn_params))
+        #Only the failed piece is asked for again
+        self.assertEqual(len(self.calls[0]), 10)
+        self.assertEqual(self.calls[1:], [[pieces[2][1]]])
+
+    def test_retry_budget(self):
+        pieces = AcisWS.split_request('MultiStnData', self.stn_params, max_cells=50)
+        fail = [pieces[0][0]] * 3
+        AcisWS.DataCallMulti = self.fake_data_call_multi(fail)
+        req = AcisWS.DataCallSplit('MultiStnData', self.stn_params, max_cells=50, max_retries=1)
+        self.assertEqual(req, {'error':'1 of 10 request pieces failed. Error: Timeout'})
+        self.assertEqual(len(self.calls), 2)
+
+class TestSingleFlight(unittest.TestCase):
+    def setUp(self):
+        self.single_flight = AcisWS.ACISSingleFlight()
+        self.num_threads = 5
+        self.release = threading.Event()
+        self.num_calls = []
+
+    def run_callers(self, request_function):
+        #The call only returns once all other callers wait for it
+        results = [None for idx in range(self.num_threads)]
+        def caller(idx):
+            try:
+                results[idx] = self.single_flight.do('StnMeta', {'state':'nv', 'meta':'uid'}, request_function)
+            except Exception, e:
+                results[idx] = e
+        threads = [threading.Thread(target=caller, args=(idx,)) for idx in range(self.num_threads)]
+        for t in threads:
+            t.start()
+        while self.single_flight.get_stats()['shared'] < self.num_threads - 1:
+            time.sleep(0.01)
+        self.release.set()
+        for t in threads:
+            t.join()
+        return results
+
+    def test_shared_response(self):
+        def request_function():
+            self.num_calls.append(1)
+            self.release.wait(10)
+            return {'meta':[{'uid':1}]}
+        results = self.run_callers(request_function)
+        self.assertEqual(len(self.num_calls), 1)
+        self.assertEqual(self.single_flight.get_stats(), {'calls':1, 'shared':self.num_threads - 1, 'shared_across_processes':0})
+        self.assertEqual(results, [{'meta':[{'uid':1}]}] * self.num_threads)
+        #Each caller gets its own copy
+        results[0]['meta'].append({'uid':2})
+        self.assertEqual(results[1], {'meta':[{'uid':1}]})
+        self.assertEqual(len(set([id(req) for req in results])), self.num_threads)
+
+    def test_shared_error(self):
+        error = ValueError('ACIS is down')
+        def request_function():
+            self.num_calls.append(1)
+            self.release.wait(10)
+            raise error
+        results = self.run_callers(request_function)
+        self.assertEqual(len(self.num_calls), 1)
+        self.assertEqual([req is error for req in results], [True] * self.num_threads)
+
+    def test_sequential_calls(self):
+        #Calls that are not in flight at the same time are not coalesced
+        for idx in range(2):
+            self.single_flight.do('StnMeta', {'state':'nv'}, lambda: self.num_calls.append(1) or {'meta':[]})
+        self.assertEqual(len(self.num_calls), 2)
+
+#Station metadata as listed by ACIS, valid_daterange of the AcisWS.SNAPSHOT_VX (maxt, mint, ..., pcpn, ...)
+SNAPSHOT_STATIONS = [
+    {'uid':1, 'name':'RENO', 'state':'NV', 'sids':['266779 2', 'KRNO 5'], 'll':[-119.78, 39.48], 'elev':4400.0,
+        'county':'32031', 'climdiv':'NV01', 'cwa':'REV', 'basin':'16050102',
+        'valid_daterange':[['1937-01-01', '2015-12-31'], [], [], [], ['1937-01-01', '2015-12-31']] + [[]] * 6},
+    {'uid':2, 'name':'CARSON CITY', 'state':'NV', 'sids':['261485 2'], 'll':[-119.77, 39.15], 'elev':4650.0,
+        'county':'32510', 'climdiv':'NV01', 'cwa':'REV', 'basin':'16050201',
+        'valid_daterange':[['1990-01-01', '1999-12-31']] + [[]] * 10},
+    {'uid':3, 'name':'ELY', 'state':'NV', 'sids':['262631 2'], 'll':[-114.84, 39.29], 'elev':6250.0,
+        'county':'32033', 'climdiv':'NV02', 'cwa':'LKN', 'basin':'16060008',
+        'valid_daterange':[[]] * 4 + [['1950-01-01', '2015-12-31']] + [[]] * 6},
+    {'uid':4, 'name':'TRUCKEE', 'state':'CA', 'sids':['049043 2'], 'll':[-120.19, 39.33], 'elev':5995.0,
+        'county':'06057', 'climdiv':'CA02', 'cwa':'REV', 'basin':'16050102',
+        'valid_daterange':[['1948-01-01', '2015-12-31']] * 11},
+    {'uid':5, 'name':'NO LOCATION', 'state':'CA', 'sids':['040000 2'], 'county':'06057',
+        'valid_daterange':[['1948-01-01', '1950-12-31']] + [[]] * 10}
+]
+
+def fake_stn_meta(params):
+    '''
+    StnMeta response of ACIS for SNAPSHOT_STATIONS
+    '''
+    vX_list = [int(el) if el.isdigit() else WRCCData.ACIS_ELEMENTS_DICT[el]['vX'] for el in AcisWS._param_list(params.get('elems', ''))]
+    sdate = params.get('sdate', '0000-00-00');edate = params.get('edate', '9999-99-99')
+    meta = []
+    for stn in SNAPSHOT_STATIONS:
+        if [area for area in AcisWS.SNAPSHOT_AREAS if area in params.keys() and \
+            stn.get(area, '').upper() not in [v.upper() for v in AcisWS._param_list(params[area])]]:
+            continue
+        if 'bbox' in params.keys():
+            W, S, E, N = [float(b) for b in AcisWS._param_list(params['bbox'])]
+            if not 'll' in stn.keys() or not (W <= stn['ll'][0] <= E and S <= stn['ll'][1] <= N):
+                continue
+        if 'sids' in params.keys() and not set(AcisWS._param_list(params['sids'])) & set(stn['sids'] + [sid.split(' ')[0] for sid in stn['sids']]):
+            continue
+        ranges = [stn['valid_daterange'][AcisWS.SNAPSHOT_VX.index(vX)] for vX in vX_list]
+        if vX_list and not [r for r in ranges if r and r[1] >= sdate and r[0] <= edate]:
+            continue
+        stn = dict(stn, valid_daterange=ranges)
+        meta_keys = AcisWS._param_list(params['meta']) if 'meta' in params.keys() else AcisWS.SNAPSHOT_DEFAULT_META
+        meta.append(dict([(key, stn[key]) for key in meta_keys if key in stn.keys()]))
+    return {'meta':meta}
+
+class TestStationSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.data_call = AcisWS.DataCall
+        self.snapshot_path = settings.TEMP_DIR + 'test_station_meta_%d.sqlite' % os.getpid()
+        self.finder_dir = settings.TEMP_DIR + 'test_station_finder_%d/' % os.getpid()
+        self.settings = dict([(key, getattr(AcisWS.settings, key)) for key in ['ACIS_STATION_SNAPSHOT'] if hasattr(AcisWS.settings, key)])
+        AcisWS.settings.ACIS_STATION_SNAPSHOT = self.snapshot_path
+        self.calls = []
+        AcisWS.DataCall = lambda acis_call, params: self.calls.append(dict(params)) or fake_stn_meta(params)
+        AcisWS.ACISStationSnapshot.build(self.snapshot_path, states=['CA', 'NV'])
+        self.calls = []
+
+    def tearDown(self):
+        AcisWS.DataCall = self.data_call
+        if hasattr(AcisWS.settings, 'ACIS_STATION_SNAPSHOT'):
+            del AcisWS.settings.ACIS_STATION_SNAPSHOT
+        for key, val in self.settings.items():
+            setattr(AcisWS.settings, key, val)
+        if AcisWS._station_snapshot is not None:
+            AcisWS._station_snapshot.close()
+            AcisWS._station_snapshot = None
+        for path in [self.snapshot_path] + [self.finder_dir + f_name for f_name in os.listdir(self.finder_dir)] if os.path.isdir(self.finder_dir) else [self.snapshot_path]:
+            if os.path.isfile(path):
+                os.remove(path)
+        if os.path.isdir(self.finder_dir):
+            os.rmdir(self.finder_dir)
+
+    def test_local_station_meta(self):
+        #Same answers as the ACIS meta the snapshot was built from
+        for params in [
+            {'state':'nv'},
+            {'state':'NV,ca', 'meta':'uid,name,county'},
+            {'county':'06057', 'meta':'name,state,sids,ll,elev,uid'},
+            {'climdiv':'nv01', 'cwa':'REV', 'meta':'uid'},
+            {'basin':'16050102', 'meta':'uid,basin'},
+            {'bbox':'-120,39,-119,40', 'meta':'uid,ll'},
+            {'bbox':'-121,39.2,-119.7,39.4', 'meta':'uid'},
+            {'sids':'266779', 'meta':'uid,sids'},
+            {'sids':'KRNO 5,049043 2', 'meta':'uid'},
+            {'state':'nv', 'elems':'maxt,pcpn', 'meta':'uid,valid_daterange'},
+            {'state':'nv,ca', 'elems':'maxt', 'sdate':'2000-01-01', 'edate':'2010-12-31', 'meta':'uid,name,valid_daterange'},
+            {'bbox':'-121,38,-114,40', 'elems':'pcpn', 'sdate':'1940-01-01', 'edate':'1945-12-31', 'meta':'uid,valid_daterange'}]:
+            self.assertEqual(AcisWS.local_station_meta(params), fake_stn_meta(params), params)
+        self.assertEqual(self.calls, [])
+
+    def test_poly(self):
+        poly = [(-121.0, 39.0), (-119.5, 39.0), (-119.5, 40.0), (-121.0, 40.0)]
+        req = AcisWS.local_station_meta({'state':'nv,ca', 'meta':'uid'}, poly=poly)
+        self.assertEqual(req, {'meta':[{'uid':1}, {'uid':2}, {'uid':4}]})
+
+    def test_fallback(self):
+        #Requests the snapshot can not answer go to ACIS
+        AcisWS.DataCall = lambda acis_call, params: self.calls.append(dict(params)) or {'meta':[]}
+        for params in [
+            {'state':'nv', 'meta':'uid,valid_daterange'},
+            {'state':'nv', 'meta':'uid,network'},
+            {'state':'nv', 'elems':'mly_maxt', 'meta':'uid'},
+            {'state':'nv', 'elems':[{'name':'maxt', 'interval':'mly'}], 'meta':'uid'},
+            {'state':'nv', 'sid':'266779', 'meta':'uid', 'output':'json'},
+            {'meta':'uid'}]:
+            self.assertEqual(AcisWS.local_station_meta(params), None)
+            self.calls = []
+            AcisWS.StnMeta(params)
+            self.assertEqual(self.calls, [params])
+        #Snapshots that are too old are not used
+        AcisWS.settings.ACIS_STATION_SNAPSHOT_MAX_AGE = -1
+        try:
+            self.assertEqual(AcisWS.local_station_meta({'state':'nv'}), None)
+        finally:
+            del AcisWS.settings.ACIS_STATION_SNAPSHOT_MAX_AGE
+        os.remove(self.snapshot_path)
+        self.assertEqual(AcisWS.local_station_meta({'state':'nv'}), None)
+
+    def test_finder_file_freshness(self):
+        f_name = AcisWS.station_finder_file_name('state', 'nv', ['maxt'], ['por', 'por'], 'any_any', True)
+        self.assertTrue(f_name.startswith('stn_') and f_name.endswith('.json.gz'))
+        self.assertEqual(AcisWS.station_finder_file_name('state', 'nv', ['maxt'], ['por', 'por'], 'any_any', True), f_name)
+        self.assertNotEqual(AcisWS.station_finder_file_name('state', 'ca', ['maxt'], ['por', 'por'], 'any_any', True), f_name)
+        f_name = AcisWS.station_finder_file_name('state', 'nv', ['maxt'], ['por', 'por'], 'any_any', False)
+        os.makedirs(self.finder_dir)
+        stn_json = {'stations':[{'name':'RENO'}]}
+        AcisWS.write_station_finder_json(self.finder_dir, f_name, None, stn_json, WRCCUtils.load_data_to_json_file)
+        self.assertEqual(AcisWS.load_station_finder_json(self.finder_dir, f_name, False), stn_json)
+        #A newer station metadata snapshot invalidates the finder file
+        AcisWS.ACISStationSnapshot.build(self.snapshot_path, states=['NV'])
+        os.utime(self.snapshot_path, (time.time() + 10, time.time() + 10))
+        self.assertEqual(AcisWS.load_station_finder_json(self.finder_dir, f_name, False), None)
+
+#General metadata of the areas as listed by ACIS, by state
+BOUNDARY_AREAS = {
+    'county':{
+        'NV':[{'id':'32031', 'name':'Washoe County', 'bbox':[-120.0, 39.0, -118.0, 42.0],
+            'geojson':{'type':'Polygon', 'coordinates':[[[-120.0, 39.0], [-118.0, 39.0], [-118.0, 42.0], [-120.0, 39.0]]]}}],
+        'CA':[{'id':'06057', 'name':'Nevada County', 'bbox':[-121.3, 39.0, -120.0, 39.5],
+            'geojson':{'type':'Polygon', 'coordinates':[[[-121.3, 39.0], [-120.0, 39.0], [-120.0, 39.5], [-121.3, 39.0]]]}}]
+    },
+    'basin':{
+        #Basins crossing state borders are listed for each state
+        'NV':[{'id':'16050102', 'name':'Truckee', 'bbox':[-120.5, 39.0, -119.0, 40.0],
+            'geojson':{'type':'MultiPolygon', 'coordinates':[[[[-120.5, 39.0], [-119.0, 39.0], [-119.0, 40.0], [-120.5, 39.0]]]]}}],
+        'CA':[{'id':'16050102', 'name':'Truckee', 'bbox':[-120.5, 39.0, -119.0, 40.0],
+            'geojson':{'type':'MultiPolygon', 'coordinates':[[[[-120.5, 39.0], [-119.0, 39.0], [-119.0, 40.0], [-120.5, 39.0]]]]}}]
+    },
+    'state':{
+        'NV':[{'id':'NV', 'name':'Nevada', 'bbox':[-120.0, 35.0, -114.0, 42.0]}],
+        'CA':[{'id':'CA', 'name':'California', 'bbox':[-124.5, 32.5, -114.1, 42.0]}]
+    }
+}
+
+def fake_general(area_type, params):
+    '''
+    General response of ACIS for BOUNDARY_AREAS
+    '''
+    areas = BOUNDARY_AREAS.get(area_type, {})
+    if 'id' in params.keys():
+        if area_type == 'state':
+            return {'meta':areas.get(params['id'].upper(), [])}
+        return {'meta':[area for state_areas in areas.values() for area in state_areas if area['id'] == params['id']][0:1]}
+    return {'meta':areas.get(params['state'].upper(), [])}
+
+class TestBoundaryStore(unittest.TestCase):
+    def setUp(self):
+        self.general = AcisWS.General
+        self.store_path = settings.TEMP_DIR + 'test_area_boundaries_%d.sqlite' % os.getpid()
+        self.settings = dict([(key, getattr(AcisWS.settings, key)) for key in ['ACIS_BOUNDARY_STORE'] if hasattr(AcisWS.settings, key)])
+        AcisWS.settings.ACIS_BOUNDARY_STORE = self.store_path
+        self.calls = []
+        AcisWS.General = lambda area_type, params: self.calls.append((area_type, dict(params))) or fake_general(area_type, params)
+        self.num_areas = AcisWS.ACISBoundaryStore.build(self.store_path, states=['CA', 'NV'])
+        self.calls = []
+
+    def tearDown(self):
+        AcisWS.General = self.general
+        if hasattr(AcisWS.settings, 'ACIS_BOUNDARY_STORE'):
+            del AcisWS.settings.ACIS_BOUNDARY_STORE
+        for key, val in self.settings.items():
+            setattr(AcisWS.settings, key, val)
+        if AcisWS._boundary_store is not None:
+            AcisWS._boundary_store.close()
+            AcisWS._boundary_store = None
+        if os.path.isfile(self.store_path):
+            os.remove(self.store_path)
+
+    def test_lookup(self):
+        #The shared basin is stored once
+        self.assertEqual(self.num_areas, 5)
+        self.assertEqual(AcisWS.local_area_meta('county', '32031'), BOUNDARY_AREAS['county']['NV'][0])
+        self.assertEqual(AcisWS.local_area_meta('state', 'nv'), BOUNDARY_AREAS['state']['NV'][0])
+        self.assertEqual(AcisWS.local_areas_of_state('basin', 'ca'), BOUNDARY_AREAS['basin']['CA'])
+        self.assertEqual(AcisWS.make_gen_call_by_state('county', 'nv'), {'meta':BOUNDARY_AREAS['county']['NV']})
+        self.assertEqual(AcisWS.get_acis_bbox_of_area('county', '06057'), [-121.3, 39.0, -120.0, 39.5])
+        self.assertEqual(AcisWS.find_geojson_of_area('county', '06057'), [-121.3, 39.0])
+        self.assertEqual(len(AcisWS.find_geojson_polygons_of_area('basin', '16050102')), 1)
+        self.assertEqual(self.calls, [])
+
+    def test_fallback(self):
+        #Areas and states that are not in the store are requested from ACIS
+        self.assertEqual(AcisWS.local_area_meta('county', '06003'), None)
+        self.assertEqual(AcisWS.local_areas_of_state('cwa', 'nv'), None)
+        self.assertEqual(AcisWS.get_acis_bbox_of_area('county', '06003'), '')
+        self.assertEqual(AcisWS.make_gen_call_by_state('cwa', 'nv'), {'meta':[]})
+        self.assertEqual([call[0] for call in self.calls], ['county', 'cwa'])
+        #Without a store everything is requested from ACIS
+        os.remove(self.store_path)
+        self.calls = []
+        self.assertEqual(AcisWS.get_acis_bbox_of_area('county', '32031'), [-120.0, 39.0, -118.0, 42.0])
+        self.assertEqual(self.calls, [('county', {'id':'32031', 'meta':'geojson,bbox,name,id'})])
+
+    def test_incomplete_store(self):
+        #Stores without a creation time were not fully written
+        os.remove(self.store_path)
+        conn = sqlite3.connect(self.store_path)
+        for statement in AcisWS.BOUNDARY_SCHEMA:
+            conn.execute(statement)
+        conn.commit();conn.close()
+        self.assertEqual(AcisWS.get_boundary_store(), None)
+        self.assertEqual(AcisWS.local_area_meta('county', '32031'), None)
+
 '''
 class TestFeedback(unittest.TestCase):
     def setUp(self):
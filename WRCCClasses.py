@@ -26,7 +26,7 @@ from ftplib import FTP
 import smtplib
 import paramiko
 
-import zipfile
+import zipfile, gzip
 try:
     import zlib
     compression = zipfile.ZIP_DEFLATED
@@ -1255,6 +1255,183 @@ class DataComparer(object):
         stats['ksp'] =  round(ks_stats[1],4)
         return stats
 
+class SodCube(object):
+    '''
+    NumPy backed SOD data of a SODDataJob.
+    Holds the daily data of all stations (or grid points) of a job,
+    indexed [station, element, year, day of year], in place of
+    the nested lists of ACIS value strings.
+    Day of year 59 is Feb 29 in all years, days ACIS did not return
+    are missing.
+
+    Keyword arguments:
+    variables    -- element list of the ACIS request
+    years        -- list of years
+    num_stations -- number of stations or grid points
+    layout       -- nested list layout the SOD application was written for:
+                    'year_element': data[stn][yr][el][doy]
+                    'element_year': data[stn][el][yr][doy]
+    grid         -- True if the data is grid point data (default False)
+    Attributes:
+    values   -- float64 values as given by WRCCUtils.decode_acis_values
+                (M is -9999.0, T and S are 0.0, NaN if not a number)
+    flags    -- uint8 flag characters, WRCCUtils.FLAG_NONE if not flagged
+    missing  -- True where the value is missing or not a number
+    has_data -- True for the stations ACIS returned data for
+    decimals -- decimals of the value strings of each element
+    dotted   -- True for elements with value strings containing a decimal point
+    num_types -- type of the values of each element given as numbers, else None
+    '''
+    def __init__(self, variables, years, num_stations, layout='year_element', grid=False):
+        self.variables = list(variables)
+        self.years = list(years)
+        self.layout = layout
+        self.grid = grid
+        shape = (num_stations, len(self.variables), len(self.years), 366)
+        self.values = np.full(shape, -9999.0)
+        self.flags = np.full(shape, WRCCUtils.FLAG_MISSING, dtype=np.uint8)
+        self.missing = np.ones(shape, dtype=bool)
+        self.has_data = np.zeros(num_stations, dtype=bool)
+        self.num_years = np.zeros(num_stations, dtype=int)
+        self.decimals = [0 for el in self.variables]
+        self.dotted = [False for el in self.variables]
+        self.num_types = [None for el in self.variables]
+
+    def __len__(self):
+        return self.values.shape[0]
+
+    def set_values(self, stn_idx, vals, yr_idx, doy_idx):
+        '''
+        Decodes the ACIS values vals[day][el] and
+        sets them at years yr_idx, days of year doy_idx of station stn_idx
+        '''
+        num_els = len(self.variables)
+        values, flags, decimals = WRCCUtils.decode_acis_values(vals, decimals=True)
+        values = values.reshape(-1, num_els).T
+        flags = flags.reshape(-1, num_els).T
+        decimals = decimals.reshape(-1, num_els).T
+        for el_idx in range(num_els):
+            if not decimals.shape[1]:
+                break
+            self.decimals[el_idx] = max(self.decimals[el_idx], int(decimals[el_idx].max()))
+            self.dotted[el_idx] = self.dotted[el_idx] or bool((decimals[el_idx] >= 0).any())
+            #Values given as numbers, not as strings
+            num_types = set(map(type, vals[el_idx::num_els])) - set([str, unicode])
+            if num_types:
+                self.num_types[el_idx] = float if float in num_types or self.num_types[el_idx] is float else int
+        self.values[stn_idx][:, yr_idx, doy_idx] = values
+        self.flags[stn_idx][:, yr_idx, doy_idx] = flags
+        self.missing[stn_idx] = (self.flags[stn_idx] == WRCCUtils.FLAG_MISSING) | np.isnan(self.values[stn_idx])
+        self.has_data[stn_idx] = True
+
+    def set_station(self, stn_idx, year_data):
+        '''
+        Sets the data of station stn_idx from the output
+        year_data[yr][el][doy] of an ACIS request grouped by year.
+        Years of 365 days get a missing Feb 29.
+        '''
+        num_els = len(self.variables)
+        num_yrs = min(len(year_data), len(self.years))
+        vals = [];yr_idx = [];doy_idx = []
+        for yr, yr_data in enumerate(year_data[0:num_yrs]):
+            length = min(len(el_data) for el_data in yr_data[0:num_els]) if yr_data else 0
+            days = range(length)
+            if length == 365:
+                days = range(59) + range(60, 366)
+            days = days[0:366]
+            for doy, day_vals in zip(days, zip(*yr_data[0:num_els])):
+                vals.extend(day_vals)
+            yr_idx.extend([yr] * len(days))
+            doy_idx.extend(days)
+        self.set_values(stn_idx, vals, np.array(yr_idx, dtype=int), np.array(doy_idx, dtype=int))
+        self.num_years[stn_idx] = num_yrs
+
+    def set_grid_point(self, loc_idx, daily_data, year_lengths):
+        '''
+        Sets the data of grid point loc_idx from the output
+        daily_data[day] = [date, el_1, el_2, ...] of a GridData request.
+        year_lengths lists the number of days of each year,
+        years of 365 days get a missing Feb 29.
+        '''
+        num_els = len(self.variables)
+        yr_idx = [];doy_idx = []
+        for yr, length in enumerate(year_lengths):
+            days = range(length)
+            if length == 365:
+                days = range(59) + range(60, 366)
+            yr_idx.extend([yr] * length)
+            doy_idx.extend(days)
+        num_days = min(len(daily_data), len(yr_idx))
+        vals = [v for day_data in daily_data[0:num_days] for v in day_data[1:num_els + 1]]
+        self.set_values(loc_idx, vals, np.array(yr_idx[0:num_days], dtype=int), np.array(doy_idx[0:num_days], dtype=int))
+        self.num_years[loc_idx] = len(year_lengths)
+
+    def element_lists(self, stn_idx, el_idx):
+        '''
+        Returns ACIS values of element el_idx of station stn_idx
+        as list of yearly lists of 366 values
+        '''
+        num_yrs = self.num_years[stn_idx]
+        values = self.values[stn_idx, el_idx, 0:num_yrs].ravel()
+        flags = self.flags[stn_idx, el_idx, 0:num_yrs].ravel()
+        num_type = self.num_types[el_idx]
+        if num_type is not None:
+            vals = [num_type(v) if v == v else v for v in values.tolist()]
+            for idx in np.nonzero(flags == WRCCUtils.FLAG_MISSING)[0].tolist():
+                vals[idx] = 'M'
+        else:
+            vals = WRCCUtils.encode_acis_values(values, flags, decimals=self.decimals[el_idx])
+        return [vals[yr * 366:(yr + 1) * 366] for yr in range(num_yrs)]
+
+    def to_lists(self, stn_idx):
+        '''
+        Returns the data of station stn_idx as the nested lists
+        of ACIS value strings SODDataJob formats without cube
+        '''
+        if not self.has_data[stn_idx]:
+            if self.grid:
+                return [[] for yr in self.years]
+            return [[] for el in self.variables]
+        el_lists = [self.element_lists(stn_idx, el_idx) for el_idx in range(len(self.variables))]
+        if self.layout == 'element_year':
+            return el_lists
+        return [list(yr_data) for yr_data in zip(*el_lists)]
+
+    def lists(self):
+        '''
+        Returns sequence of the nested lists of all stations,
+        stations are converted one at a time when accessed
+        '''
+        return SodCubeLists(self)
+
+class SodCubeLists(object):
+    '''
+    Sequence view of the nested lists of a SodCube.
+    Keeps the lists of the last accessed station only
+    so that SOD applications looping over stations
+    don't hold the lists of all stations in memory.
+    '''
+    def __init__(self, cube):
+        self.cube = cube
+        self.stn_idx = None
+        self.stn_lists = None
+
+    def __len__(self):
+        return len(self.cube)
+
+    def __getitem__(self, stn_idx):
+        if stn_idx < 0:stn_idx+=len(self.cube)
+        if not 0 <= stn_idx < len(self.cube):
+            raise IndexError('station index out of range')
+        if stn_idx != self.stn_idx:
+            self.stn_lists = self.cube.to_lists(stn_idx)
+            self.stn_idx = stn_idx
+        return self.stn_lists
+
+    def __iter__(self):
+        for stn_idx in range(len(self.cube)):
+            yield self[stn_idx]
+
 class SODDataJob(object):
     '''
     SOD Data class.
@@ -1267,9 +1444,20 @@ class SODDataJob(object):
                    keys: start_date, end_date, variables
                          and a key defining the search area, one of:
                          sid, sids,county, climdiv, cwa, basin, state, bbox
+    deadline    -- max number of seconds all ACIS calls
+                   of get_data_station/get_data_grid may take (default None: no deadline)
+    sod_cube    -- if True, data of the applications in SOD_CUBE_APPS is returned
+                   as SodCube instead of nested lists
+                   (default None: settings.SOD_DATA_CUBE, False if not set)
     '''
-    def __init__(self, app_name, data_params, app_specific_params=None):
+    #Applications that read the SodCube arrays
+    SOD_CUBE_APPS = ['Sodxtrmts']
+    def __init__(self, app_name, data_params, app_specific_params=None, deadline=None, sod_cube=None):
         self.params = data_params
+        self.deadline = deadline
+        if sod_cube is None:
+            sod_cube = getattr(settings, 'SOD_DATA_CUBE', False)
+        self.sod_cube = sod_cube
         self.app_specific_params = app_specific_params
         self.app_name = app_name
         self.station_ids = None;self.station_names=None
@@ -1654,6 +1842,12 @@ class SODDataJob(object):
                 leap_indices.append(idx)
         return leap_indices, yrs
 
+    def use_sod_cube(self):
+        '''
+        True if the data of the application is returned as SodCube
+        '''
+        return bool(self.sod_cube) and self.app_name in self.SOD_CUBE_APPS
+
     def format_data_grid(self, request, locations,variables):
         '''
         Formats output of data request dependent on
@@ -1678,6 +1872,8 @@ class SODDataJob(object):
             else:
                 #data[i] = [[] for el in variables]
                 data[i] = [[] for yr in  year_list]
+        if self.use_sod_cube():
+            data = SodCube(variables, year_list, len(locations), grid=True)
         #Sanity checks on request object
         if not request:
             error = 'Bad request, check params: %s'  % str(self.params)
@@ -1690,6 +1886,14 @@ class SODDataJob(object):
             if not 'data' in loc_request.keys():
                 error = 'No data found for parameters: %s' % str(self.params)
                 continue
+            if isinstance(data, SodCube):
+                year_lengths = [365 for yr in year_list]
+                for yr_idx in leap_indices:
+                    #Grid 1, 3 and 21 record Feb 29
+                    if self.params['grid'] in ['1','3','21']:
+                        year_lengths[yr_idx] = 366
+                data.set_grid_point(loc_idx, loc_request['data'], year_lengths)
+                continue
             start_idx = 0
             for yr_idx, yr in enumerate(year_list):
                 yr_data = [[] for el in variables]
@@ -1712,7 +1916,7 @@ class SODDataJob(object):
         '''
         Formats output of data request dependent on
         application
-        request is the output of a MultiStnData call
+        request is the output of a MultiStnData or MultiStnDataStream call
         '''
         #Set up data output dictonary
         error = ''
@@ -1728,6 +1932,12 @@ class SODDataJob(object):
             else:
                 data[i] = [[] for el in variables]
 
+        if self.use_sod_cube():
+            leap_indices, year_list = self.find_leap_yr_indices()
+            layout = 'year_element'
+            if self.app_name in ['Soddynorm', 'Soddd', 'Sodpct']:
+                layout = 'element_year'
+            data = SodCube(variables, year_list, len(station_ids), layout=layout)
         #Sanity checks on request object
         if not request:
             error = 'Bad request, check params: %s'  % str(self.params)
@@ -1758,7 +1968,9 @@ class SODDataJob(object):
             else:
                 if 'data' not in stn_data.keys():
                     continue
-                if self.app_name in ['Soddynorm', 'Soddd', 'Sodpct']:
+                if isinstance(data, SodCube):
+                    data.set_station(index, stn_data['data'])
+                elif self.app_name in ['Soddynorm', 'Soddd', 'Sodpct']:
                     for yr, el_data in enumerate(stn_data['data']):
                         for el_idx, dat in enumerate(el_data):
                             data[index][el_idx].append(dat)
@@ -1770,63 +1982,79 @@ class SODDataJob(object):
         '''
         Request SOD data from ACIS data for a station
         '''
-        variables = self.get_variable_list()
-        station_ids, station_names = self.get_station_ids_names()
-        dates = self.get_dates_list()
-        meta_dict = self.get_station_meta()
-        #Set up resultsdict
-        resultsdict = {
-                    'data':[],
-                    'dates':dates,
-                    'variables':variables,
-                    'station_ids':station_ids,
-                    'station_names':station_names,
-                    'lls':meta_dict['lls']
-        }
-        #Override el for sodxtrmts, otherwise avgt,dtr don't work
-        if self.app_name in ['Sodxtrmts','SodxtrmtsSCENIC']:
-            resultsdict['variables'] = [self.params['variable']]
-        #Make data request
-        data_params = self.set_request_params()
-        request = AcisWS.MultiStnData(data_params)
-        resultsdict['data'], resultsdict['error'] = self.format_data_station(request, station_ids, variables)
-        return resultsdict
+        with AcisWS.ACISDeadline(self.deadline, name=self.app_name):
+            variables = self.get_variable_list()
+            station_ids, station_names = self.get_station_ids_names()
+            dates = self.get_dates_list()
+            meta_dict = self.get_station_meta()
+            #Set up resultsdict
+            resultsdict = {
+                        'data':[],
+                        'dates':dates,
+                        'variables':variables,
+                        'station_ids':station_ids,
+                        'station_names':station_names,
+                        'lls':meta_dict['lls']
+            }
+            #Override el for sodxtrmts, otherwise avgt,dtr don't work
+            if self.app_name in ['Sodxtrmts','SodxtrmtsSCENIC']:
+                resultsdict['variables'] = [self.params['variable']]
+            #Make data request
+            data_params = self.set_request_params()
+            #Stations are formatted one at a time as they are parsed
+            try:
+                request = AcisWS.MultiStnDataStream(data_params)
+                resultsdict['data'], resultsdict['error'] = self.format_data_station(request, station_ids, variables)
+            except AcisWS.ACISTimeoutError, e:
+                resultsdict['error'] = str(e)
+            return resultsdict
 
     def get_data_grid(self):
         '''
         Request SOD data from ACIS for a gridpoint
         '''
-        variables = self.get_variable_list()
-        locations_list = self.set_locations_list(self.params)
-        dates = self.get_dates_list()
-        meta_dict = self.get_grid_meta()
-        #Set up resultsdict
-        resultsdict = {
-                    'data':[],
-                    'dates':dates,
-                    'variables':variables,
-                    'location_list':locations_list,
-                    'lls':meta_dict['lls']
-        }
-        if self.app_name in ['Sodxtrmts','SodxtrmtsSCENIC']:
-            resultsdict['variables'] = [self.params['variable']]
-        #Make data request
-        #Each location requires separate request
-        #request = {'meta':{'lat':'', 'lon':'','elev':''},'data':[]}
-        data = [{} for loc in locations_list]
-        for i,loc in enumerate(locations_list):
-            data_params = self.set_request_params()
-            data_params['loc'] = loc
+        with AcisWS.ACISDeadline(self.deadline, name=self.app_name):
+            variables = self.get_variable_list()
+            locations_list = self.set_locations_list(self.params)
+            dates = self.get_dates_list()
+            meta_dict = self.get_grid_meta()
+            #Set up resultsdict
+            resultsdict = {
+                        'data':[],
+                        'dates':dates,
+                        'variables':variables,
+                        'location_list':locations_list,
+                        'lls':meta_dict['lls']
+            }
+            if self.app_name in ['Sodxtrmts','SodxtrmtsSCENIC']:
+                resultsdict['variables'] = [self.params['variable']]
+            #Make data request
+            #Each location requires separate request
+            #request = {'meta':{'lat':'', 'lon':'','elev':''},'data':[]}
+            data = [{} for loc in locations_list]
+            params_list = []
+            for i,loc in enumerate(locations_list):
+                data_params = self.set_request_params()
+                data_params['loc'] = loc
+                params_list.append(data_params)
+            #Locations are requested concurrently, results are in input order
             try:
-                req = AcisWS.GridData(data_params)
-                req['meta'];req['data']
-            except Exception, e:
-                data[i]['error'] = str(e)
-                continue
-            data[i]['meta'] = req['meta']
-            data[i]['data']= req['data']
-        resultsdict['data'], resultsdict['error'] = self.format_data_grid(data, locations_list, variables)
-        return resultsdict
+                reqs = AcisWS.GridDataMulti(params_list)
+                for i, req in enumerate(reqs):
+                    if 'error' in req.keys():
+                        data[i]['error'] = str(req['error'])
+                        continue
+                    try:
+                        req['meta'];req['data']
+                    except Exception, e:
+                        data[i]['error'] = str(e)
+                        continue
+                    data[i]['meta'] = req['meta']
+                    data[i]['data']= req['data']
+                resultsdict['data'], resultsdict['error'] = self.format_data_grid(data, locations_list, variables)
+            except AcisWS.ACISTimeoutError, e:
+                resultsdict['error'] = str(e)
+            return resultsdict
 
 class SODApplication(object):
     '''
@@ -2186,6 +2414,546 @@ class GridDiffFigure(GridFigure) :
 
         return self.results
 
+class PreparedPolygon(object):
+    '''
+    Polygon prepared once for many point in polygon tests.
+    The edges of all rings are indexed in horizontal buckets
+    of equal height, so that a point is only tested against the
+    edges that cross its row. The cost per point depends on the
+    number of edges per bucket, not on the number of vertices.
+    Points are inside if a ray cast from them crosses an odd number
+    of edges (even-odd rule), holes and multipolygons are therefore
+    supported independent of the ring orientations.
+
+    Keyword arguments:
+    polygons -- geojson MultiPolygon coordinates: list of polygons,
+                each a list of rings (outer ring, then holes),
+                each ring a list of (lon, lat) pairs.
+                A single ring is accepted as well.
+    include_boundary -- if True, points on the boundary are inside
+                (point_in_or_on_poly semantics),
+                else they are outside (point_in_poly semantics)
+    '''
+    def __init__(self, polygons, include_boundary=False):
+        self.include_boundary = include_boundary
+        self.rings = [np.asarray(ring, dtype=float).reshape(-1, 2) for ring in self.find_rings(polygons)]
+        self.rings = [ring for ring in self.rings if ring.shape[0]]
+        self.num_vertices = sum([ring.shape[0] for ring in self.rings])
+        self.bbox = None
+        if not self.rings:
+            return
+        #Edges p1 -> p2, the last one closes the ring
+        p1 = np.concatenate(self.rings)
+        p2 = np.concatenate([np.roll(ring, -1, axis=0) for ring in self.rings])
+        self.x1, self.y1 = p1[:,0], p1[:,1]
+        self.x2, self.y2 = p2[:,0], p2[:,1]
+        self.bbox = [p1[:,0].min(), p1[:,1].min(), p1[:,0].max(), p1[:,1].max()]
+        self.index_edges()
+
+    def find_rings(self, polygons):
+        #Single ring
+        if polygons and self.is_point(polygons[0]):
+            return [polygons]
+        rings = []
+        for poly in polygons:
+            if poly and self.is_point(poly[0]):
+                rings.append(poly)
+            else:
+                rings.extend(poly)
+        return rings
+
+    def is_point(self, p):
+        return len(p) == 2 and np.isscalar(p[0])
+
+    def index_edges(self):
+        '''
+        Sorts the edges into horizontal buckets,
+        an edge goes into all buckets its lat range overlaps.
+        bucket_edges[bucket_start[b]:bucket_start[b + 1]]
+        are the edges of bucket b
+        '''
+        num_edges = len(self.x1)
+        self.num_buckets = max(1, num_edges / 2)
+        self.y0 = self.bbox[1]
+        self.dy = (self.bbox[3] - self.bbox[1]) / self.num_buckets
+        if self.dy <= 0:
+            self.dy = 1.0
+        b_lo = self.find_buckets(np.minimum(self.y1, self.y2))
+        b_hi = self.find_buckets(np.maximum(self.y1, self.y2))
+        counts = b_hi - b_lo + 1
+        edges = np.repeat(np.arange(num_edges), counts)
+        offsets = np.arange(edges.shape[0]) - np.repeat(np.cumsum(counts) - counts, counts)
+        buckets = np.repeat(b_lo, counts) + offsets
+        order = np.argsort(buckets, kind='mergesort')
+        self.bucket_edges = edges[order]
+        self.bucket_start = np.searchsorted(buckets[order], np.arange(self.num_buckets + 1))
+
+    def find_buckets(self, ys):
+        with np.errstate(invalid='ignore'):
+            buckets = np.floor((ys - self.y0) / self.dy)
+        return np.clip(np.nan_to_num(buckets), 0, self.num_buckets - 1).astype(int)
+
+    def contains(self, x, y):
+        return bool(self.contains_points([x], [y])[0])
+
+    def contains_points(self, xs, ys, chunk_size=50000):
+        '''
+        Returns boolean array of the shape of xs,
+        True where xs, ys lie in the polygon.
+        NaN coordinates are outside
+        '''
+        xs = np.asarray(xs, dtype=float)
+        ys = np.asarray(ys, dtype=float)
+        inside = np.zeros(xs.shape, dtype=bool)
+        if self.bbox is None:
+            return inside
+        with np.errstate(invalid='ignore'):
+            in_bbox = (xs >= self.bbox[0]) & (xs <= self.bbox[2]) & (ys >= self.bbox[1]) & (ys <= self.bbox[3])
+        idx = np.flatnonzero(in_bbox)
+        flat = inside.reshape(-1)
+        for start in range(0, idx.shape[0], chunk_size):
+            chunk = idx[start:start + chunk_size]
+            flat[chunk] = self.test_points(xs.reshape(-1)[chunk], ys.reshape(-1)[chunk])
+        return inside
+
+    def test_points(self, px, py):
+        #Pair each point with the edges of its bucket
+        buckets = self.find_buckets(py)
+        counts = self.bucket_start[buckets + 1] - self.bucket_start[buckets]
+        pt = np.repeat(np.arange(px.shape[0]), counts)
+        offsets = np.arange(pt.shape[0]) - np.repeat(np.cumsum(counts) - counts, counts)
+        e = self.bucket_edges[np.repeat(self.bucket_start[buckets], counts) + offsets]
+        x, y = px[pt], py[pt]
+        x1, y1, x2, y2 = self.x1[e], self.y1[e], self.x2[e], self.y2[e]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            #Ray casting, same arithmetic as WRCCUtils.point_in_poly
+            crosses = (y > np.minimum(y1, y2)) & (y <= np.maximum(y1, y2)) & (x <= np.maximum(x1, x2))
+            xints = (y - y1) * (x2 - x1) / (y2 - y1) + x1
+            crosses&= (x1 == x2) | (x <= xints)
+            inside = np.bincount(pt[crosses], minlength=px.shape[0]) % 2 == 1
+            if self.include_boundary:
+                #Same test as WRCCUtils.point_on_vertex, vertical edges are skipped
+                v1x = x2 - x1;v1y = y2 - y1
+                v2x = x - x1;v2y = y - y1
+                on_edge = (v1x != 0) & (v1x * v2y - v1y * v2x == 0) & (v2x / v1x > 0) & \
+                    (v1x * v1x + v1y * v1y >= v2x * v2x + v2y * v2y)
+                inside|= np.bincount(pt[on_edge], minlength=px.shape[0]) > 0
+        return inside
+
+class GridMaskStore(object):
+    '''
+    Persistent store of the raster masks of special grid areas
+    (county, climdiv, cwa, basin).
+    A mask marks the cells of the enclosing bbox grid of an area
+    that lie within the area. Masks never change for a given
+    grid and area, so they are computed once and kept on disk
+    bit-packed (numpy.packbits) in a .npy file that is memory-mapped
+    on reading. A small json header holds the grid shape and corners
+    the mask was computed for.
+
+    Keyword arguments:
+    mask_dir -- directory holding the mask files
+    '''
+    #Bump when the way masks are computed changes
+    version = 2
+
+    def __init__(self, mask_dir):
+        self.mask_dir = mask_dir
+
+    def base_path(self, grid, area_type, area_id):
+        name = '_'.join([re.sub('[^a-zA-Z0-9]', '_', str(k)) for k in [grid, area_type, area_id]])
+        return os.path.join(self.mask_dir, name)
+
+    def grid_header(self, grid_meta):
+        lats = grid_meta['lat'];lons = grid_meta['lon']
+        return {
+            'version':self.version,
+            'shape':[len(lats), len(lats[0]) if lats else 0],
+            'corners':[lats[0][0], lons[0][0], lats[-1][-1], lons[-1][-1]] if lats and lats[0] else []
+        }
+
+    def header_matches(self, header, grid_meta):
+        grid_header = self.grid_header(grid_meta)
+        if header.get('version') != self.version:
+            return False
+        if header['shape'] != grid_header['shape']:
+            return False
+        if len(header['corners']) != len(grid_header['corners']):
+            return False
+        for c1, c2 in zip(header['corners'], grid_header['corners']):
+            if abs(float(c1) - float(c2)) > 0.0001:
+                return False
+        return True
+
+    def get(self, grid, area_type, area_id, grid_meta):
+        '''
+        Returns boolean (lat x lon) mask of the area for the grid
+        given by grid_meta, None if there is no stored mask for this grid
+        '''
+        path = self.base_path(grid, area_type, area_id)
+        try:
+            with open(path + '.json', 'r') as f:
+                header = json.load(f)
+            if not self.header_matches(header, grid_meta):
+                return None
+            packed = np.load(path + '.npy', mmap_mode='r')
+        except (IOError, OSError, ValueError):
+            return None
+        shape = tuple(header['shape'])
+        num_cells = shape[0] * shape[1]
+        if packed.shape[0] * 8 < num_cells:
+            return None
+        return np.unpackbits(packed)[0:num_cells].reshape(shape).astype(bool)
+
+    def set(self, grid, area_type, area_id, grid_meta, mask):
+        '''
+        Atomically writes mask file and header, best effort
+        '''
+        path = self.base_path(grid, area_type, area_id)
+        try:
+            AcisWS.atomic_write(path + '.npy',
+                lambda f: np.save(f, np.packbits(np.asarray(mask, dtype=bool).ravel())), mode='wb')
+            AcisWS.atomic_write(path + '.json', lambda f: json.dump(self.grid_header(grid_meta), f))
+        except (IOError, OSError):
+            pass
+
+class StatTables(object):
+    '''
+    Statistical tables of the SOD applications, compiled once from the
+    text files piii.dat.2 (Pearson III frequency factors) and
+    arealstats.dat (areal parameters) into a single record kept
+    in a binary .npy file that is memory-mapped on reading.
+    The file is recompiled when a source file changes.
+
+    Keyword arguments:
+    lib_prefix    -- prefix of the source files, e.g. settings.LIB_PREFIX
+    compiled_path -- path of the compiled .npy file,
+                     None keeps the compiled tables in memory only
+    '''
+    #Bump when the record layout or the parsing changes
+    version = 1
+    #Non-exceedance probabilities of the piii.dat.2 columns
+    piii_probabilities = [.0001, .0005, .0010, .0050, .0100, .0200, .0250,\
+            .0400, .0500, .1000, .2000, .3000, .4000, .5000, \
+            .6000, .7000, .8000, .9000, .9500, .9600, .9750,\
+            .9800, .9900, .9950, .9990, .9995, .9999]
+    #Skews (times 10) of the piii.dat.2 rows
+    piii_skews = range(-90, 91)
+    #Areal parameters of the 16 Sodpiii durations
+    areal_arrays = ['amean', 'apctan', 'ask', 'acv']
+    #Annual precipitation, ratios of 6 and 12 hr to one day
+    areal_scalars = ['annpcp', 'r6to1', 'r12to1']
+    areal_labels = {'ANNUAL PRECIPITATION':'annpcp', 'RATIO  6 HR':'r6to1', 'RATIO 12 HR':'r12to1'}
+    dtype = np.dtype([('version', 'i4'), ('mtimes', 'f8', (2,)), ('piii', 'i4', (181, 27))] + \
+        [(name, 'f8', (16,)) for name in areal_arrays] + [(name, 'f8') for name in areal_scalars])
+
+    def __init__(self, lib_prefix, compiled_path=None):
+        self.lib_prefix = lib_prefix
+        self.compiled_path = compiled_path
+        self._record = None
+
+    def source_mtimes(self):
+        mtimes = []
+        for file_name in ['piii.dat.2', 'arealstats.dat']:
+            try:
+                mtimes.append(os.path.getmtime(self.lib_prefix + file_name))
+            except OSError:
+                mtimes.append(-1.0)
+        return mtimes
+
+    def parse_piii(self):
+        '''
+        Parses piii.dat.2: 11 buffer lines, columns .0001 to .5000
+        of skews -9.0 to 9.0, 2 buffer lines, columns .6000 to .9999.
+        Returns int array [skew + 90][probability]
+        '''
+        table = np.zeros((len(self.piii_skews), len(self.piii_probabilities)), dtype=int)
+        with open(self.lib_prefix + 'piii.dat.2', 'r') as f:
+            for count, line in enumerate(f, 1):
+                if count > 11 and count < 193:
+                    table[int(line[1:4]) + 90, 0:14] = [int(line[5*k:5*k+5]) for k in range(1,15)]
+                if count > 194:
+                    table[int(line[1:4]) + 90, 14:27] = [int(line[5*k:5*k+5]) for k in range(1,14)]
+        return table
+
+    def parse_areal(self):
+        '''
+        Parses arealstats.dat: each DATA line is followed by the
+        16 values of the array, each label line by the value of the scalar.
+        Returns dictionary areal[name]
+        '''
+        areal = {};name = None
+        with open(self.lib_prefix + 'arealstats.dat', 'r') as f:
+            for line in f:
+                words = line.split()
+                if 'DATA' in words:
+                    name = words[words.index('DATA') + 1].lower()
+                    areal[name] = []
+                    continue
+                labels = [key for key in self.areal_labels.keys() if line.startswith(key)]
+                if labels:
+                    name = self.areal_labels[labels[0]]
+                    areal[name] = []
+                    continue
+                if name is None:
+                    continue
+                try:
+                    areal[name]+=[float(word) for word in words]
+                except ValueError:
+                    name = None
+        for name in self.areal_arrays + self.areal_scalars:
+            length = 16 if name in self.areal_arrays else 1
+            if len(areal.get(name, [])) != length:
+                raise ValueError('arealstats.dat: expected %d values of %s' % (length, name))
+        return areal
+
+    def compile(self, mtimes):
+        record = np.zeros(1, dtype=self.dtype)
+        record['version'] = self.version
+        record['mtimes'][0] = mtimes
+        record['piii'][0] = self.parse_piii()
+        areal = self.parse_areal()
+        for name in self.areal_arrays:
+            record[name][0] = areal[name]
+        for name in self.areal_scalars:
+            record[name][0] = areal[name][0]
+        return record
+
+    def load(self, mtimes):
+        '''
+        Returns the memory-mapped compiled record,
+        None if there is no compiled file or it is out of date
+        '''
+        try:
+            record = np.load(self.compiled_path, mmap_mode='r')
+        except (IOError, OSError, ValueError):
+            return None
+        if record.dtype != self.dtype or record.shape != (1,):
+            return None
+        if record['version'][0] != self.version or record['mtimes'][0].tolist() != mtimes:
+            return None
+        return record
+
+    def save(self, record):
+        '''
+        Atomically writes the compiled file, best effort
+        '''
+        try:
+            AcisWS.atomic_write(self.compiled_path, lambda f: np.save(f, record), mode='wb')
+        except (IOError, OSError):
+            pass
+
+    def record(self):
+        '''
+        Returns the compiled tables, compiling them at first use if
+        there is no up to date compiled file
+        '''
+        if self._record is None:
+            mtimes = self.source_mtimes()
+            record = self.load(mtimes) if self.compiled_path else None
+            if record is None:
+                record = self.compile(mtimes)
+                if self.compiled_path:
+                    self.save(record)
+            self._record = record
+        return self._record
+
+    @property
+    def piii(self):
+        '''
+        Pearson III table, int array [skew + 90][probability]
+        of frequency factors times 1000
+        '''
+        return self.record()['piii'][0]
+
+    def piii_dict(self):
+        '''
+        Pearson III table as dictionary piii[skew] = list of values,
+        as read by the scalar routines (WRCCUtils.Pintp3, Capiii)
+        '''
+        return dict(zip(self.piii_skews, self.piii.tolist()))
+
+    def areal(self, name):
+        '''
+        Areal parameter name: list of the 16 durations
+        for amean, apctan, ask and acv, float for annpcp, r6to1 and r12to1
+        '''
+        return self.record()[name][0].tolist()
+
+    def pintp3(self, prnoex, skews):
+        '''
+        Interpolates the Pearson III table at all
+        non-exceedance probabilities prnoex and skews at once.
+        Returns array psd[skew][probability]
+        '''
+        return WRCCUtils.pintp3_array(prnoex, skews, self.piii, self.piii_probabilities)
+
+class OverlayStore(object):
+    '''
+    Pre-generated map overlays of the special areas (basin, climdiv,
+    county, cwa) of each state, written as KML and compact GeoJSON
+    at each simplification level, together with gzipped copies
+    that can be served as they are.
+    Overlays are stale when they are older than the local area boundary
+    store (AcisWS.ACISBoundaryStore) or, without a store, older than
+    max_age seconds. Lookups serve stale overlays as they are and only
+    build missing ones, overlay_tiles.py rebuilds the stale ones.
+
+    Keyword arguments:
+    overlay_dir -- directory holding the overlay files
+    levels -- simplification tolerances (degrees) of the levels,
+              None means not simplified
+    max_age -- max age in seconds of overlays if there is no boundary store
+    '''
+    def __init__(self, overlay_dir, levels=None, max_age=30*86400):
+        self.overlay_dir = overlay_dir
+        self.levels = levels if levels is not None else [None, 0.001, 0.01]
+        self.max_age = max_age
+
+    def file_name(self, area_type, state, file_format, level=0):
+        return '%s_%s_%d.%s' % (str(state).lower(), str(area_type), int(level), file_format)
+
+    def is_fresh(self, path):
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return False
+        store = AcisWS.get_boundary_store()
+        if store is not None:
+            return mtime >= store.mtime
+        return time.time() - mtime < self.max_age
+
+    def is_built(self, area_type, state):
+        '''
+        True if the overlays of area_type in state are fresh.
+        build writes the plain geojson of the last level last
+        '''
+        return self.is_fresh(os.path.join(self.overlay_dir,
+            self.file_name(area_type, state, 'geojson', len(self.levels) - 1)))
+
+    def find(self, area_type, state, file_format='kml', level=0, gzipped=False):
+        '''
+        Returns file name of the overlay, relative to overlay_dir,
+        None if the overlay can not be built.
+        Stale overlays are served until overlay_tiles.py refreshes them,
+        only missing overlays are built within the request.
+        area_type -- ACIS area type, one of basin, climdiv, county, cwa
+        file_format -- kml or geojson
+        '''
+        if file_format not in ['kml', 'geojson'] or not 0 <= int(level) < len(self.levels):
+            return None
+        f_name = self.file_name(area_type, state, file_format, level)
+        if gzipped:
+            f_name+='.gz'
+        if not os.path.isfile(os.path.join(self.overlay_dir, f_name)):
+            if self.build(area_type, state) != 'Success':
+                return None
+        return f_name
+
+    def build(self, area_type, state):
+        '''
+        Writes the overlays of all levels of area_type in state.
+        Returns 'Success' or error message
+        '''
+        req = AcisWS.make_gen_call_by_state(area_type, state)
+        if not req:
+            return 'No meta data found for search area %s and state %s' %(str(area_type), str(state))
+        if 'error' in req.keys():
+            return str(req['error'])
+        if not 'meta' in req.keys() or not isinstance(req['meta'], list):
+            return 'No meta data found for search area %s and state %s' %(str(area_type), str(state))
+        try:
+            if not os.path.isdir(self.overlay_dir):
+                os.makedirs(self.overlay_dir)
+            for level, tolerance in enumerate(self.levels):
+                areas = self.simplify(req['meta'], tolerance)
+                self.write(self.file_name(area_type, state, 'kml', level), self.kml(areas))
+                self.write(self.file_name(area_type, state, 'geojson', level), self.geojson(areas))
+        except (IOError, OSError), e:
+            return 'Could not write overlay: %s' % str(e)
+        return 'Success'
+
+    def simplify(self, json_data, tolerance):
+        '''
+        Returns list of (id, name, polygons) of the areas,
+        coordinates rounded to 4 decimals and rings simplified to tolerance
+        '''
+        areas = []
+        for area in json_data:
+            if not 'geojson' in area.keys() or not area['geojson']:
+                continue
+            coordinates = area['geojson']['coordinates']
+            if area['geojson'].get('type') == 'Polygon':
+                coordinates = [coordinates]
+            polygons = []
+            for poly in coordinates:
+                rings = [np.round(np.array(ring, dtype=float).reshape(-1, 2), 4) for ring in poly]
+                if tolerance is not None:
+                    rings = [WRCCUtils.simplify_ring(ring, tolerance=tolerance) for ring in rings]
+                polygons.append([ring.tolist() for ring in rings])
+            #Remove special characters from name
+            #Overlay maps and url bars do not like hashes and other weird chars
+            name = re.sub('[^a-zA-Z0-9\n\.]', ' ', area.get('name', ''))
+            areas.append((area['id'], name, polygons))
+        return areas
+
+    def kml(self, areas):
+        lines = [
+            '<?xml version="1.0" encoding="UTF-8"?>',
+            '<kml xmlns="http://www.opengis.net/kml/2.2">',
+            '  <Document>',
+            '    <Style id="multipoly">',
+            '      <LineStyle>',
+            '        <width>1.5</width>',
+            '      </LineStyle>',
+            '      <PolyStyle>',
+            '        <color>50F00014</color>',
+            '        <outline>1</outline>',
+            '        <fill>1</fill>',
+            '      </PolyStyle>',
+            '    </Style>'
+        ]
+        for ID, name, polygons in areas:
+            lines+=[
+                '    <Placemark>',
+                '      <name>%s</name>' % ID,
+                '      <description>%s, %s</description>' % (name, ID),
+                '      <styleUrl>#multipoly</styleUrl>',
+                '      <MultiGeometry>'
+            ]
+            for rings in polygons:
+                lines+=['      <Polygon>', '        <extrude>1</extrude>', '        <altitudeMode>relativeToGround</altitudeMode>']
+                for ring_idx, ring in enumerate(rings):
+                    boundary = 'outerBoundaryIs' if ring_idx == 0 else 'innerBoundaryIs'
+                    lines+=['        <%s>' % boundary, '          <LinearRing>', '            <coordinates>']
+                    lines+=['              %s,%s,0' % (lon, lat) for lon, lat in ring]
+                    lines+=['            </coordinates>', '          </LinearRing>', '        </%s>' % boundary]
+                lines.append('      </Polygon>')
+            lines+=['      </MultiGeometry>', '    </Placemark>']
+        lines+=['  </Document>', '</kml>', '']
+        return '\n'.join(lines)
+
+    def geojson(self, areas):
+        features = [{
+            'type':'Feature',
+            'id':ID,
+            'properties':{'id':ID, 'name':name},
+            'geometry':{'type':'MultiPolygon', 'coordinates':polygons}
+        } for ID, name, polygons in areas]
+        return json.dumps({'type':'FeatureCollection', 'features':features}, separators=(',', ':'))
+
+    def write(self, f_name, content):
+        '''
+        Atomically writes f_name and its gzipped copy f_name.gz
+        '''
+        def write_gz(f):
+            gz = gzip.GzipFile(fileobj=f, mode='wb', mtime=0)
+            gz.write(content)
+            gz.close()
+        path = os.path.join(self.overlay_dir, f_name)
+        AcisWS.atomic_write(path + '.gz', write_gz, mode='wb')
+        AcisWS.atomic_write(path, lambda f: f.write(content))
+
 class Logger(object):
     def __init__(self, base_dir, log_file_name, logger_name=None):
         self.base_dir = base_dir
@@ -2446,9 +3214,12 @@ class LargeDataRequest(object):
     Args:
         form:  dictionary of user input
         logger -- logger object
+        deadline -- max number of seconds the ACIS data request
+                    may take (default None: no deadline)
     '''
-    def __init__(self, form, logger, local_base_dir, ftp_server, ftp_dir, max_lines_per_file):
+    def __init__(self, form, logger, local_base_dir, ftp_server, ftp_dir, max_lines_per_file, deadline=None):
         self.form = form
+        self.deadline = deadline
         self.logger =  logger
         self.base_dir = local_base_dir
         self.ftp_server = ftp_server
@@ -2589,7 +3360,12 @@ class LargeDataRequest(object):
     def process_request(self):
         error = None
         out_files =[]
-        resultsdict = self.get_data()
+        try:
+            with AcisWS.ACISDeadline(self.deadline, name='Large data request'):
+                resultsdict = self.get_data()
+        except AcisWS.ACISTimeoutError, e:
+            self.logger.error('ERROR in get_data: ' + str(e))
+            return 'ERROR: ' + str(e), out_files
         if not resultsdict:
             error = 'ERROR: Data Request failed!'
             return error, out_files
@@ -8,12 +8,10 @@ as well as several applications used in my_acis/scenic
 from collections import defaultdict
 import numpy
 import sys, os, datetime
-import fileinput
-from scipy import stats
 from math import ceil
 
 #Local modules
-import WRCCUtils, AcisWS, WRCCData
+import WRCCUtils, AcisWS, WRCCData, WRCCClasses
 
 #Settings
 #from django.conf import settings
@@ -21,6 +19,25 @@ try:
     import my_acis.settings as settings
 except ImportError:
     import my_acis_settings as settings
+
+def sod_decode(yr_data):
+    '''
+    Decodes the daily values of one element of a station,
+    given as list of years of 366 ACIS values, with a single
+    WRCCUtils.decode_acis_values call.
+    Returns (num_yrs x 366) arrays
+        values -- float(WRCCUtils.strip_data(val)[0]), NaN where that fails
+                  (M gives -9999.0, S and T give 0.0)
+        flags  -- flag characters as uint8 (WRCCUtils.FLAG_MISSING, ...)
+        ints   -- True where int(WRCCUtils.strip_data(val)[0]) succeeds,
+                  i.e. for whole numbers written without decimal point
+    '''
+    values, flags, decimals = WRCCUtils.decode_acis_values(
+        [val for yr_vals in yr_data for val in yr_vals[0:366]], decimals=True)
+    ints = numpy.isfinite(values) & (decimals == -1) & (numpy.floor(values) == values)
+    shape = (len(yr_data), 366)
+    return values.reshape(shape), flags.reshape(shape), ints.reshape(shape)
+
 #####################################################
 #KELLY's DATA APPLICATION
 #Mostly copied straight from Kelly's Fortran programs
@@ -53,54 +70,13 @@ def Sodpiii(**kwargs):
             .9800, .9900, .9950, .9960, .9966, .9975, .9980,\
             .9990, .9995, .9996, .9998, .9999]
 
-    ppiii = [.0001, .0005, .0010, .0050, .0100, .0200, .0250,\
-            .0400, .0500, .1000, .2000, .3000, .4000, .5000, \
-            .6000, .7000, .8000, .9000, .9500, .9600, .9750,\
-            .9800, .9900, .9950, .9990, .9995, .9999,]
-    #Areal Statistics, taken from climate.dri.edu:/wrcc2/krwrcc/sep11/arealstats.dat
-    amean = [1.00, 1.50, 2.00, 3.00, 4.00, 5.00, 6.00, 7.00, \
-             9.00, 10.00, 11.00, 12.00, 14.00, 16.00, 18.00, 20.00]
-    apctan = [.024, .032, .040, .064, .077, .087, .098, .107, \
-             .116, .125, .131, .138, .171, .199, .226, .253]
-    ask = [1.20, 1.10, .92, .92, .95, 1.07, .94, .85, \
-          .80, .75, .70, .64, .46, .45, .43, .32]
-    acv = [.26, .26, .26, .27, .27, .26, .25, .24, \
-          .24, .24, .23, .23, .23, .23, .22, .21]
-    #ask = [2.00, 1.50, 1.00, .90, .85, .80, .75, .70, \
-          #.65, .60, .55, .50, .45, .40, .35, .30]
-    #acv = [.25, .25, .25, .25, .25, .25, .25, .25, \
-          #.25, .25, .25, .25, .25, .25, .25, .25]
-    #Read in piii table:
-    piii = {}
-    count = 0
-    for line in fileinput.input([settings.LIB_PREFIX + 'piii.dat.2']):
-        count+=1
-        if count > 11 and count < 193:
-            skew = line[1:4].lstrip()
-            if skew[0] == '-':
-                if skew[1] == '0' and skew[2] != '0':
-                    skew = '-%s' % skew[2]
-                elif skew[1] == '0' and skew[2] == '0':
-                    skew = 0
-            else:
-                if skew == '00':
-                    skew = 0
-                else:
-                    skew.lstrip('0')
-            skew = int(skew)
-            piii[skew] = []
-            for k in range(1,15):
-                piii[skew].append(int(line[5*k:5*k+5]))
-        if count > 194:
-            skew = line[1:4].lstrip()
-            if skew[0] == '-':
-                if skew[1] == '0':
-                    skew = '-%s' % skew[2]
-            else:
-                skew.lstrip('0')
-            skew = int(skew)
-            for k in range(1,14):
-                piii[skew].append(int(line[5*k:5*k+5]))
+    #Pearson III and areal statistics tables, compiled from
+    #settings.LIB_PREFIX + piii.dat.2 and arealstats.dat
+    tables = WRCCUtils.get_stat_tables()
+    amean = tables.areal('amean')
+    apctan = tables.areal('apctan')
+    ask = tables.areal('ask')
+    acv = tables.areal('acv')
     #Loop over stations
     for i, stn in enumerate(kwargs['station_ids']):
         variables = kwargs['variables']
@@ -473,7 +449,7 @@ def Sodpiii(**kwargs):
             results_0[i][tbl_idx][num_yrs + k]+=['--','--']
         #End numdur while loop... Phew...
         if kwargs['mean'] == 'am':stats[0] = amean
-        annpcp = 50.0 #from settings.LIB_PREFIX + arealstats.dat
+        annpcp = tables.areal('annpcp')
         if kwargs['pct_average'] == 'apct':
             for idur in range(16):stats[1][idur] = apctan[idur]*annpcp
 
@@ -482,9 +458,9 @@ def Sodpiii(**kwargs):
 
         if kwargs['cv'] == 'acv':
             for idur in range(16):stats[1][idur] = acv[idur] * stats[0][idur]
-        #Ration of 6 and 12 hr to one day (from settings.LIB_PREFIX + arealstats.dat)
-        r6to1 = 0.5
-        r12to1 = 0.75
+        #Ration of 6 and 12 hr to one day
+        r6to1 = tables.areal('r6to1')
+        r12to1 = tables.areal('r12to1')
         for idur in range(len(lisdur)):
             if kwargs['days'] == 'i':
                 if idur != numdu1:continue
@@ -495,10 +471,10 @@ def Sodpiii(**kwargs):
             ave = stats[0][idur]
             sd = stats[1][idur]
             sk = stats[3][idur]
+            #Interpolate all return periods at once
+            psds = tables.pintp3(rtnlis, [sk])[0].tolist()
             for iretrn in range(len(rtnlis)):
-                pnoexc = rtnlis[iretrn]
-                psd = WRCCUtils.Pintp3(pnoexc, piii, ppiii,len(ppiii),sk)
-                rtndur[iretrn][idur] = psd
+                rtndur[iretrn][idur] = psds[iretrn]
             #End iretrn loop
         #End idur loop
         for idur in range(len(lisdur)):
@@ -1034,11 +1010,178 @@ def SodxtrmtsSCENIC(**kwargs):
         #End of year loop
     return results
 
+#Statistics the vectorized Sodxtrmts engine computes
+XTRMTS_ENGINE_STATISTICS = ['mmax', 'mmin', 'mave', 'sd', 'rmon', 'msum']
+#Day of year index (Feb 29 is 59) of the first day of each month
+MON_START_DOYS = numpy.cumsum([0, 31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30])
+
+def sod_station_cube(data, stn_idx):
+    '''
+    Returns SodCube and station index of station stn_idx
+    of SODDataJob data given as SodCube or as nested lists data[stn][yr][el][doy]
+    '''
+    if isinstance(data, WRCCClasses.SodCube):
+        return data, stn_idx
+    el_data = data[stn_idx]
+    num_els = max([len(yr_data) for yr_data in el_data] + [0])
+    cube = WRCCClasses.SodCube(range(num_els), range(len(el_data)), 1)
+    cube.set_station(0, el_data)
+    return cube, 0
+
+def sequential_sum(values):
+    '''
+    Sums values along the last axis in order,
+    giving the same result as adding them up in a python loop
+    '''
+    zeros = numpy.zeros(values.shape[:-1] + (1,))
+    return numpy.cumsum(numpy.concatenate([zeros, values], axis=-1), axis=-1)[..., -1]
+
+def sodxtrmts_daily_values(variable, cube, stn_idx, base_temperature=None, job_stn_idx=None):
+    '''
+    Daily values [yr][doy] of variable at station stn_idx of the SodCube cube
+    as read by the Sodxtrmts day loop, -9999.0 where missing.
+    T, S and A flagged precipitation, snow, snow depth and evaporation
+    are 0.001, 245.0 and value + 100.
+    job_stn_idx is the index of the station in the job if it differs from stn_idx.
+    Returns None if the engine can't reproduce the day loop for the variable.
+    '''
+    xmiss = -9999.0
+    num_yrs = int(cube.num_years[stn_idx])
+    vals = cube.values[stn_idx, :, 0:num_yrs]
+    flags = cube.flags[stn_idx, :, 0:num_yrs]
+    with numpy.errstate(invalid='ignore'):
+        if variable in ['maxt', 'mint', 'obst', 'wdmv']:
+            miss = (flags[0] == WRCCUtils.FLAG_MISSING) | numpy.isnan(vals[0]) | (abs(vals[0] + 999.0) < 0.001)
+            return numpy.where(miss, xmiss, vals[0])
+        if variable in ['pcpn', 'snow', 'snwd', 'evap']:
+            miss = numpy.isnan(vals[0]) | (abs(vals[0] + 999.0) < 0.001)
+            daily = numpy.where(flags[0] == WRCCUtils.FLAG_ACCUMULATED, vals[0] + 100, vals[0])
+            daily[miss] = xmiss
+            daily[flags[0] == WRCCUtils.FLAG_TRACE] = 0.001
+            daily[flags[0] == WRCCUtils.FLAG_SUBSEQUENT] = 245.0
+            daily[flags[0] == WRCCUtils.FLAG_MISSING] = xmiss
+            return daily
+        if variable not in ['avgt', 'dtr', 'hdd', 'cdd', 'gdd'] or len(cube.variables) < 2:
+            return None
+        #The day loop reads maxt and mint with int(),
+        #which fails on values with decimal point
+        for el_idx in [0, 1]:
+            if cube.dotted[el_idx] or cube.num_types[el_idx] is float:
+                return None
+        maxt = vals[0];mint = vals[1]
+        miss = (flags[0] == WRCCUtils.FLAG_MISSING) | (flags[1] == WRCCUtils.FLAG_MISSING) | \
+            ~numpy.isfinite(maxt) | ~numpy.isfinite(mint) | (maxt == -999.0) | (mint == -999.0)
+        if variable == 'dtr':
+            daily = maxt - mint
+        elif variable == 'avgt':
+            daily = (maxt + mint) / 2.0
+        else:
+            try:
+                base = float(base_temperature)
+            except:
+                return None
+            if variable == 'hdd':
+                daily = base - (maxt + mint) / 2.0
+            else:
+                daily = (maxt + mint) / 2.0 - base
+            #The day loop sets negative degree days to the station index
+            daily[daily < 0] = stn_idx if job_stn_idx is None else job_stn_idx
+        daily[miss] = xmiss
+        return daily
+
+def sodxtrmts_monthly_tables(variable, statistic, daily, start_year, start_month, max_missing_days):
+    '''
+    Vectorized version of the Sodxtrmts month and day loops.
+    Computes the monthly statistic of all years and months at once
+    from the daily values daily[yr][doy] of sodxtrmts_daily_values.
+    Returns the lists table_1 (statistic), table_2 (number of missing days)
+    and annsav (flags) [yr][mon], the annual column 12 holds the initial values.
+    Returns None if the engine can't reproduce the loops for the statistic.
+    '''
+    if statistic not in XTRMTS_ENGINE_STATISTICS:
+        return None
+    num_yrs = daily.shape[0]
+    table_1 = numpy.full((num_yrs, 13), -9999.0)
+    table_2 = numpy.full((num_yrs, 13), 31, dtype=int)
+    annsav = [[' ' for mon in range(13)] for yr in range(num_yrs)]
+    if not num_yrs:
+        return table_1.tolist(), table_2.tolist(), annsav
+    #Months before the start month are taken from the following year
+    mons = numpy.arange(12)
+    s_mon = int(str(start_month).lstrip('0'))
+    src_yrs = numpy.arange(num_yrs)[:, None] + (mons < s_mon - 1)[None, :]
+    in_record = src_yrs < num_yrs
+    src_yrs = numpy.minimum(src_yrs, num_yrs - 1)
+    leap = numpy.array([WRCCUtils.is_leap_year(start_year + yr) for yr in range(num_yrs)])
+    mon_lens = numpy.tile([31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31], (num_yrs, 1))
+    mon_lens[:, 1] = numpy.where(leap[src_yrs[:, 1]], 29, 28)
+    days = numpy.arange(31)
+    doys = numpy.minimum(MON_START_DOYS[:, None] + days[None, :], 365)
+    #raw[yr][mon][day]
+    raw = daily[src_yrs[:, :, None], doys[None, :, :]]
+    valid = (days[None, None, :] < mon_lens[:, :, None]) & (raw > -9998.0)
+    sumda = valid.sum(axis=2)
+    value = raw
+    if variable in ['snow', 'pcpn', 'evap']:
+        s_flagged = abs(raw - 245.0) < 0.01
+        a_flagged = ~s_flagged & (raw > 99.99) & (raw < 240.0)
+        if statistic == 'sd' and (valid & a_flagged & in_record[:, :, None]).any():
+            #Left to the day loop, which fails on A flags for sd
+            return None
+        value = numpy.where(s_flagged, 0.0, numpy.where(a_flagged, raw - 100, raw))
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        if statistic in ['mmax', 'mmin', 'rmon']:
+            xmax = numpy.maximum(numpy.where(valid, value, -numpy.inf).max(axis=2), -9999.0)
+            xmin = numpy.minimum(numpy.where(valid, value, numpy.inf).min(axis=2), 9999.0)
+            stat = {'mmax':xmax, 'mmin':xmin, 'rmon':xmax - xmin}[statistic]
+            filled = in_record
+        elif statistic == 'mave':
+            stat = sequential_sum(numpy.where(valid, value, 0.0)) / sumda
+            filled = in_record & (sumda >= 1)
+        elif statistic == 'sd':
+            summ = sequential_sum(numpy.where(valid, value, 0.0))
+            summ2 = sequential_sum(numpy.where(valid, value * value, 0.0))
+            if variable == 'dtr':
+                #Integer sums, summ*summ/sumda is an integer division
+                summ_sq = numpy.floor_divide(summ.astype(numpy.int64) ** 2, numpy.maximum(sumda, 1))
+            else:
+                summ_sq = summ * summ / sumda
+            stat = numpy.sqrt((summ2 - summ_sq) / (sumda - 1.0))
+            filled = in_record & (sumda > 1)
+        else:
+            #msum of values rounded to 2 decimals
+            rounded = numpy.zeros(value.shape)
+            uniq, inverse = numpy.unique(value[valid], return_inverse=True)
+            rounded[valid] = numpy.array([round(v, 2) for v in uniq.tolist()] or [0.0])[inverse]
+            stat = sequential_sum(rounded)
+            if variable in ['hdd', 'cdd', 'gdd']:
+                #Estimate missing sum for degree days, using the mean of the other days
+                nummsg = mon_lens - sumda
+                if isinstance(max_missing_days, basestring):
+                    #Python 2 orders numbers before strings
+                    within = numpy.ones(nummsg.shape, dtype=bool)
+                else:
+                    within = nummsg <= max_missing_days
+                estimate = (nummsg != 0) & within & (sumda > 0.5)
+                stat = numpy.where(estimate, stat / sumda * (mon_lens - 1.0), stat)
+            filled = in_record
+            if variable in ['snow', 'pcpn', 'evap']:
+                #S flag of the last day of the month
+                last_day = raw[numpy.arange(num_yrs)[:, None], mons[None, :], mon_lens - 1]
+                for yr, mon in zip(*numpy.nonzero(in_record & (abs(last_day - 245.0) < 0.01))):
+                    annsav[yr][mon] = 'S'
+    table_1[:, 0:12][filled] = stat[filled]
+    table_2[:, 0:12][filled] = (mon_lens - sumda)[filled]
+    return table_1.tolist(), table_2.tolist(), annsav
+
 def Sodxtrmts(**kwargs):
     '''
     THIS PROGRAM PRODUCES MONTHLY AND ANNUAL TIME SERIES FOR A
     LARGE NUMBER OF PROPERTIES DERIVED FROM THE SOD DAILY DATA SET.
     '''
+    #Data is given as nested lists or, from a SODDataJob with sod_cube,
+    #as SodCube that the vectorized engine reads without converting it to lists
+    cube = kwargs['data'] if isinstance(kwargs['data'], WRCCClasses.SodCube) else None
     units = 'english'
     if 'units' in kwargs.keys():units = kwargs['units']
     mon_lens = [31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
@@ -1074,37 +1217,6 @@ def Sodxtrmts(**kwargs):
             0.2, 0.3, 0.5, 0.7, 0.8, 0.9, 0.95, 0.96, 0.9666, \
             0.975, 0.98, 0.99, 0.995, 0.996, 0.998, 0.999]
     probss = probs
-    #Read in piii table:
-    piii = {}
-    count = 0
-    for line in fileinput.input([settings.LIB_PREFIX + 'piii.dat.2']):
-        count+=1
-        if count > 11 and count < 193:
-            skew = line[1:4].lstrip()
-            if skew[0] == '-':
-                if skew[1] == '0' and skew[2] != '0':
-                    skew = '-%s' % skew[2]
-                elif skew[1] == '0' and skew[2] == '0':
-                    skew = 0
-            else:
-                if skew == '00':
-                    skew = 0
-                else:
-                    skew.lstrip('0')
-            skew = int(skew)
-            piii[skew] = []
-            for k in range(1,15):
-                piii[skew].append(int(line[5*k:5*k+5]))
-        if count > 194:
-            skew = line[1:4].lstrip()
-            if skew[0] == '-':
-                if skew[1] == '0':
-                    skew = '-%s' % skew[2]
-            else:
-                skew.lstrip('0')
-            skew = int(skew)
-            for k in range(1,14):
-                piii[skew].append(int(line[5*k:5*k+5]))
     #Loop over stations or locations
     l=[]
     if 'location_list' in kwargs.keys():l = kwargs['location_list']
@@ -1113,8 +1225,12 @@ def Sodxtrmts(**kwargs):
     for i, stn in enumerate(l):
         variables = kwargs['variables']
         variable = kwargs['variables'][0] # maxt, mint, avgt, dtr (daily temp range)
-        el_data = kwargs['data'][i]
-        num_yrs = len(el_data)
+        if cube is not None:
+            num_yrs = int(cube.num_years[i])
+            el_data = [[None] for yr in range(num_yrs)]
+        else:
+            el_data = kwargs['data'][i]
+            num_yrs = len(el_data)
         #el_data[el_idx][yr] ;
         #if variable_type is hdd, cdd, dtr or gdd: el_data[0] = maxt, el_data[1]=mint
 
@@ -1124,11 +1240,6 @@ def Sodxtrmts(**kwargs):
             fa_results[i] = []
             continue
         results[i] = [[] for k in range(num_yrs + 6)]
-        #Initialize frequency analysis result arrays:
-        proutp = [[0 for k in range(13)] for l in range(len(probs))]
-        proutg = [[0 for k in range(13)] for l in range(len(probs))]
-        proutb = [[0 for k in range(13)] for l in range(len(probs))]
-        proutc = [[0 for k in range(13)] for l in range(len(probs))]
         if 'frequency_analysis_type' in kwargs.keys():
             fa_results[i] = [['%s %s' % (str(kwargs['frequency_analysis_type']), probss[k])] for k in range(len(probss))]
         for yr in range(num_yrs):
@@ -1153,14 +1264,27 @@ def Sodxtrmts(**kwargs):
         mean_out = [0.0 for k in range(13)]
         outchr = [0 for k in range(13)]
         xmiss = -9999.0
+        #Monthly values of all years at once
+        monthly = None
+        if kwargs['statistic'] in XTRMTS_ENGINE_STATISTICS:
+            stn_cube, stn_idx = sod_station_cube(kwargs['data'], i)
+            daily = sodxtrmts_daily_values(variable, stn_cube, stn_idx, kwargs.get('base_temperature'), job_stn_idx=i)
+            if daily is not None:
+                monthly = sodxtrmts_monthly_tables(variable, kwargs['statistic'], daily, \
+                    start_year, kwargs['start_month'], kwargs['max_missing_days'])
+        if monthly is not None:
+            table_1, table_2, annsav = monthly
+        elif cube is not None:
+            #Statistics the engine does not compute read the lists
+            el_data = cube.to_lists(i)
         #Year loop
         for yr in range(num_yrs):
             annmin =  9999.0
             annmax = -9999.0
             annflg = [' ' for k in range(13)]
             icount = 0
-            #Month loop
-            for monind in range(12):
+            #Month loop, done by the vectorized engine if it handles the data
+            for monind in range(12 if monthly is None else 0):
                 nyeart = yr
                 mon =  monind + int(kwargs['start_month'].lstrip('0')) - 1
                 if mon > 11:
@@ -1589,7 +1713,6 @@ def Sodxtrmts(**kwargs):
         #End of year loop
         #Start for frequency analysis
         xdata = {}
-        xx = {}
         if kwargs['frequency_analysis'] == 'T':
             fa_type = kwargs['frequency_analysis_type']
             #fa types: p = PearsonIII, g = Generalized Extreme values
@@ -1597,6 +1720,8 @@ def Sodxtrmts(**kwargs):
         else:
             fa_type = None
 
+        #Series of the months and the annual values to analyze and their bounds
+        fa_series = [];fa_bounds = [];fa_numnz = []
         for monind in range(13):
             if monind <= 11:
                 nmo = monind + int(kwargs['start_month'].lstrip('0')) - 1
@@ -1618,7 +1743,6 @@ def Sodxtrmts(**kwargs):
                         numdat+=1
                         xdata[numdat-1] = dat
                         if dat > 0.005:numnz+=1
-                        xx[numdat-1] = dat
                         #Note that xmax, xmin were re-determinde in capiii
                 #End year loop
             if numdat < 5:
@@ -1645,58 +1769,30 @@ def Sodxtrmts(**kwargs):
                 else:
                     vmax = 365.24
 
-            xdata_list = [val for key, val in xdata.iteritems()]
-            xx_list = [val for key, val in xx.iteritems()]
-            #Frequency Analysis routines
+            #xdata holds values of earlier months beyond numdat
+            fa_series.append([xdata[k] for k in range(numdat)])
+            fa_bounds.append([vmin, vmax])
+            fa_numnz.append(numnz)
+            #End monind loop
+        #Frequency Analysis routines, all monthly/annual series are fitted at once
+        if fa_type in ['p', 'g', 'b', 'c'] and fa_series:
             if fa_type == 'p': #Pearson III
-                #(psd, ave, stdev, sk, cv, xmax, xmin) = WRCCUtils.Capiii(xdata, numdat, piii, piiili,len(piiili), pnlist,len(pnlist))
-                shape, loc, scale = stats.gamma.fit(xdata_list)
+                tables = WRCCUtils.get_stat_tables()
+                data, counts = WRCCUtils.fa_series_array(fa_series)
+                psd, ave, stdev = WRCCUtils.capiii_array(data, counts, tables.piii, tables.piii_probabilities, probss)[0:3]
+                quantiles = ave[:, None] + stdev[:, None]*psd
+            elif fa_type == 'g': #Generalized Extreme Values
+                quantiles = WRCCUtils.gev_quantiles(fa_series, probs)
+            elif fa_type == 'b': #Beta-P
+                quantiles = WRCCUtils.betap_quantiles(fa_series, probss)
+            else: #Censored Gamma, all zero if there are no values above 0.005
+                quantiles = WRCCUtils.gamma_quantiles(fa_series, probss)
+                quantiles[numpy.array(fa_numnz) < 1] = 0.0
+            fa_bounds = numpy.array(fa_bounds)
+            quantiles = numpy.clip(quantiles, fa_bounds[:, 0:1], fa_bounds[:, 1:2]).tolist()
+            for monind in range(len(fa_series)):
                 for k in range(len(probss)): #len(probss) = 24
-                    proutp[k][monind] = stats.gamma.ppf(probs[k],shape,loc=loc,scale=scale)
-                    if proutp[k][monind] < vmin:proutp[k][monind] = vmin
-                    if proutp[k][monind] > vmax:proutp[k][monind] = vmax
-                    '''
-                    for j in range(len(pnlist)):  #len(pnlist) = 47
-                        if (pnlist[j] - probss[k]) < 0.00001:
-                            proutp[k][monind] = ave + stdev*psd[j]
-                            if proutp[k][monind] < vmin:proutp[k][monind] = vmin
-                            if proutp[k][monind] > vmax:proutp[k][monind] = vmax
-                    '''
-                    fa_results[i][k].append('%.2f' % proutp[k][monind])
-
-            elif fa_type == 'g':
-                #para = WRCCUtils.Gev(xx, numdat)
-                shape, loc, scale = stats.genextreme.fit(xx_list)
-                #Compute Quantiles:
-                #rsultsg = WRCCUtils.Quantgev(para, probs, len(probs))
-                for k in range(len(probs)):
-                    proutg[k][monind] = stats.genextreme.ppf(probs[k],shape,loc=loc,scale=scale)
-                    #proutg[k][monind] = rsultsg[k]
-                    if proutg[k][monind] < vmin:proutg[k][monind] = vmin
-                    if proutg[k][monind] > vmax:proutg[k][monind] = vmax
-                    fa_results[i][k].append('%.2f' % proutg[k][monind])
-            elif fa_type == 'b':
-                #rsultb = WRCCUtils.Cabetap(xdata, numdat, probss,len(probss))
-                shape_a, shape_b, loc, scale = stats.beta.fit(xdata_list)
-                for k in range(len(probss)):
-                    #proutb[k][monind] = rsultb[k]
-                    proutb[k][monind] = stats.beta.ppf(probs[k],shape_a, shape_b, loc=loc, scale=scale )
-                    if proutb[k][monind] < vmin:proutb[k][monind] = vmin
-                    if proutb[k][monind] > vmax:proutb[k][monind] = vmax
-                    fa_results[i][k].append('%.2f' % proutg[k][monind])
-            elif fa_type == 'c':
-                if numnz >= 1:
-                    rsultc = WRCCUtils.Cagamma(xdata, numdat, probss, len(probss))
-                    for k in range(len(probss)):
-                        proutc[k][monind] = rsultsc[k]
-                        if proutc[k][monind] < vmin:proutc[k][monind] = vmin
-                        if proutc[k][monind] > vmax:proutc[k][monind] = vmax
-                        fa_results[i][k].append('%.2f' % proutc[k][monind])
-                else:
-                    for k in range(len(probbs)):
-                        proutc[k][monind] = 0.0
-                        fa_results[i][k].append('%.2f' % proutc[k][monind])
-            #End monind loop
+                    fa_results[i][k].append('%.2f' % quantiles[monind][k])
     #return results, fa_results
     return results
 
@@ -1764,40 +1860,25 @@ def Sodthr(**kwargs):
         for table in range(3):
             results[i][table] = [[999.9 for k in range(12)] for thresh in range(numthr)]
         #Initialize data arrays
-        yr_doy_data = [[999.9 for doy in range(366)] for yr in range(num_yrs)]
         ndiff = [[999 for j in range(2)] for yr in range(num_yrs)]
         nts =[[[999 for k in range(3)]for j in range(2)]for yr in range(num_yrs)]
         thrpct = [[[999.9 for k in range(11)] for thresh in range(numthr)] for period in range(3)]
-        #Populate yr_doy_data dealing with flags on original data
-        for yr in range(num_yrs):
-            for doy in range(366):
-                if el_type in ['dtr','avgt']:
-                    dat_x = el_data[yr][0][doy]
-                    dat_n = el_data[yr][1][doy]
-                    val_x, flag_x = WRCCUtils.strip_data(dat_x)
-                    val_n, flag_n = WRCCUtils.strip_data(dat_n)
-                    if flag_x == 'M' or flag_n == 'M':
-                        continue
-                    try:
-                        nval_x = int(val_x)
-                        nval_n = int(val_n)
-                    except:
-                        continue
-
-                    if el_type == 'dtr':
-                        val = nval_x - nval_n
-                    elif el_type == 'avgt':
-                        val = (nval_x + nval_n)/2.0
-                else:
-                    dat = el_data[yr][0][doy]
-                    val, flag = WRCCUtils.strip_data(dat)
-                    if flag == 'M':
-                        continue
-                    try:
-                        float(val)
-                    except:
-                        continue
-                yr_doy_data[yr][doy] = float(val)
+        #Populate yr_doy_data dealing with flags on original data,
+        #all values of an element are decoded at once
+        yr_doy_data = numpy.full((num_yrs, 366), 999.9)
+        if el_type in ['dtr','avgt']:
+            val_x, flag_x, int_x = sod_decode([yr_data[0] for yr_data in el_data])
+            val_n, flag_n, int_n = sod_decode([yr_data[1] for yr_data in el_data])
+            valid = (flag_x != WRCCUtils.FLAG_MISSING) & (flag_n != WRCCUtils.FLAG_MISSING) & int_x & int_n
+            if el_type == 'dtr':
+                vals = val_x - val_n
+            else:
+                vals = (val_x + val_n)/2.0
+        else:
+            vals, flags = sod_decode([yr_data[0] for yr_data in el_data])[0:2]
+            valid = (flags != WRCCUtils.FLAG_MISSING) & ~numpy.isnan(vals)
+        yr_doy_data[valid] = vals[valid]
+        yr_doy_data = yr_doy_data.tolist()
 
         #Get day of year of start, mid and endpoint
         ndoyst = WRCCUtils.Catoju(most, ndyst)
@@ -2003,7 +2084,9 @@ def Sodthr(**kwargs):
                             array[icount -1] = nts[yr][period][0]
                     #End year loop
                 if icount >= 5:
-                    pctile, sort, xmed = WRCCUtils.pctil('Sodthr', array, icount, 5)
+                    #Sort once for both percentile sets
+                    sort = WRCCUtils.pctil_sort(array, icount)
+                    pctile, sort, xmed = WRCCUtils.pctil('Sodthr', array, icount, 5, sort=sort)
                     thrpct[period][ithr - 1][5] = xmed
                     thrpct[period][ithr - 1][2] = pctile[0]
                     thrpct[period][ithr - 1][4] = pctile[1]
@@ -2013,7 +2096,7 @@ def Sodthr(**kwargs):
                     thrpct[period][ithr - 1][10] = sort[icount - 1]
 
                 if icount >= 10:
-                    pctile, sort, xmed = WRCCUtils.pctil('Sodthr', array, icount, 10)
+                    pctile, sort, xmed = WRCCUtils.pctil('Sodthr', array, icount, 10, sort=sort)
                     thrpct[period][ithr - 1][1] = pctile[0]
                     thrpct[period][ithr - 1][3] = pctile[2]
                     thrpct[period][ithr - 1][7] = pctile[6]
@@ -2085,70 +2168,45 @@ def Sodpct(**kwargs):
             results[i] = {}
             continue
         #for each yr in record and each dy of year find values for percentile caculation
-        yr_doy_data = [[9999.0 for doy in range(366)] for yr in range(num_yrs)]
         accum = [9999.0 for yr in range(num_yrs)]
         results[i] = [[] for doy in range(366)] #results[i][doy] will have 21 entries: 15 thresholds and some html info
-        for yr in range(num_yrs):
-            for doy in range(366):
-                val = None
-                #check if we have to compute values from maxt, mint
-                if el_type in ['dtr', 'hdd', 'cdd', 'gdd', 'avgt']:
-                    dat_x = el_data[0][yr][doy]
-                    dat_n = el_data[1][yr][doy]
-                    val_x, flag_x = WRCCUtils.strip_data(dat_x)
-                    val_n, flag_n = WRCCUtils.strip_data(dat_n)
-                    if flag_x == 'M' or flag_n == 'M':
-                        continue
-                    try:
-                        nval_x = int(val_x)
-                        nval_n = int(val_n)
-                    except:
-                        continue
-
-                    if el_type == 'dtr':
-                        val = nval_x - nval_n
-                    elif el_type == 'avgt':
-                        val = (nval_x + nval_n)/2.0
-                    elif el_type in ['hdd','cdd']:
-                        ave = val = (nval_x + nval_n)/2.0
-                        if el_type == 'hdd':
-                            val = float(kwargs['base_temperature']) - ave
-                        else:
-                            val = ave - float(kwargs['base_temperature'])
-                        if val < 0:
-                            val = 0
-                    elif el_type == 'gdd':
-                        high = nval_x
-                        low = nval_n
-                        if high > kwargs['max_temperature']:
-                            high = kwargs['max_temperature']
-                        if low < kwargs['min_temperature']:
-                            low = kwargs['min_temperature']
-                        val = (high + low)/2.0 - float(kwargs['base_temperature'])
-                elif el_type in ['snow', 'snwd', 'pcpn']: #Deal with T,S,A flags
-                    dat = el_data[yr][doy]
-                    val, flag = WRCCUtils.strip_data(dat)
-                    if flag == 'T':
-                        val = 0.001
-                    if ia == 'a': #if kwargs['ia'] == 'i', S,A flags are treated as missing
-                        if flag == 'S':
-                            val+=2000.0
-                        elif flag == 'A':
-                            val+=3000.0
-                    try:
-                        float(val)
-                    except:
-                        continue
+        #Values of each year and day of year for the percentile calculation,
+        #all values of an element are decoded at once
+        yr_doy_data = numpy.full((num_yrs, 366), 9999.0)
+        #check if we have to compute values from maxt, mint
+        if el_type in ['dtr', 'hdd', 'cdd', 'gdd', 'avgt']:
+            val_x, flag_x, int_x = sod_decode(el_data[0])
+            val_n, flag_n, int_n = sod_decode(el_data[1])
+            valid = (flag_x != WRCCUtils.FLAG_MISSING) & (flag_n != WRCCUtils.FLAG_MISSING) & int_x & int_n
+            if el_type == 'dtr':
+                vals = val_x - val_n
+            elif el_type == 'avgt':
+                vals = (val_x + val_n)/2.0
+            elif el_type in ['hdd','cdd']:
+                ave = (val_x + val_n)/2.0
+                if el_type == 'hdd':
+                    vals = float(kwargs['base_temperature']) - ave
                 else:
-                    dat = el_data[yr][doy]
-                    val, flag = WRCCUtils.strip_data(dat)
-                    if flag == 'M':
-                        continue
-                    try:
-                        float(val)
-                    except:
-                        continue
-                yr_doy_data[yr][doy] = float(val)
+                    vals = ave - float(kwargs['base_temperature'])
+                with numpy.errstate(invalid='ignore'):
+                    vals[valid & (vals < 0)] = 0
+            elif el_type == 'gdd':
+                with numpy.errstate(invalid='ignore'):
+                    high = numpy.where(val_x > kwargs['max_temperature'], kwargs['max_temperature'], val_x)
+                    low = numpy.where(val_n < kwargs['min_temperature'], kwargs['min_temperature'], val_n)
+                vals = (high + low)/2.0 - float(kwargs['base_temperature'])
+        elif el_type in ['snow', 'snwd', 'pcpn']: #Deal with T,S,A flags
+            vals, flags = sod_decode(el_data)[0:2]
+            vals[flags == WRCCUtils.FLAG_TRACE] = 0.001
+            if ia == 'a': #if kwargs['ia'] == 'i', S,A flags are treated as missing
+                vals[flags == WRCCUtils.FLAG_SUBSEQUENT]+=2000.0
+                vals[flags == WRCCUtils.FLAG_ACCUMULATED]+=3000.0
+            valid = ~numpy.isnan(vals)
+        else:
+            vals, flags = sod_decode(el_data)[0:2]
+            valid = (flags != WRCCUtils.FLAG_MISSING) & ~numpy.isnan(vals)
+        yr_doy_data[valid] = vals[valid]
+        yr_doy_data = yr_doy_data.tolist()
         #Prepare method of looping, if seasoal accumulations are required
         monlo = 1
         monhi = 12
@@ -2285,8 +2343,11 @@ def Sodpct(**kwargs):
                         number+=1
                         array[number]=accum[acc_idx]
                 out = [9999.0 for k in range(17)] # low, high and 15 percentages
+                if number >= 3:
+                    #Sort once for all percentile sets
+                    sort = WRCCUtils.pctil_sort(array, number)
                 if number >= 10:
-                    pctile, sort = WRCCUtils.pctil('Sodpct', array, number, 10)
+                    pctile, sort = WRCCUtils.pctil('Sodpct', array, number, 10, sort=sort)
                     out[2] = pctile[0]
                     out[3] = pctile[1]
                     out[5] = pctile[2]
@@ -2297,16 +2358,16 @@ def Sodpct(**kwargs):
                     out[13] = pctile[7]
                     out[14] = pctile[8]
                 if number >= 20:
-                    pctile, sort = WRCCUtils.pctil('Sodpct', array, number, 20)
+                    pctile, sort = WRCCUtils.pctil('Sodpct', array, number, 20, sort=sort)
                     out[1] = pctile[0]
                     out[15] = pctile[18]
                 if number >= 4:
-                    pctile, sort = WRCCUtils.pctil('Sodpct', array, number, 4)
+                    pctile, sort = WRCCUtils.pctil('Sodpct', array, number, 4, sort=sort)
                     out[4] = pctile[0]
                     out[8] = pctile[1]
                     out[12] = pctile[2]
                 if number >= 3:
-                    pctile, sort = WRCCUtils.pctil('Sodpct', array, number, 3)
+                    pctile, sort = WRCCUtils.pctil('Sodpct', array, number, 3, sort=sort)
                     out[6] = pctile[0]
                     out[10] =  pctile[1]
                     out[0] = sort[0]
@@ -3621,6 +3682,13 @@ def Sodpad(**kwargs):
             results[i]={}
             continue
         s_count = 0
+        #Decode all values of the station at once
+        values, flags = sod_decode([yr_data[0] for yr_data in el_data])[0:2]
+        values = values.tolist()
+        flags = [yr_flags.tostring() for yr_flags in flags]
+        #Accumulated values redistributed to days not visited yet
+        #(back into the last year) are decoded when we get there
+        redistributed = set()
         #Take care of data flags, Feb 29's are set to 99.00, missing data to 99.99
         #Kelly: don't do leap years, too complicated
         for yr in range(num_yrs):
@@ -3631,7 +3699,9 @@ def Sodpad(**kwargs):
                     el_data[yr][0][doy] = 99.00
                     continue
 
-                val, flag = WRCCUtils.strip_data(str(el_data[yr][0][doy]))
+                val = values[yr][doy];flag = flags[yr][doy]
+                if (yr, doy) in redistributed or numpy.isnan(val):
+                    val, flag = WRCCUtils.strip_data(str(el_data[yr][0][doy]))
                 if flag == 'M':
                     el_data[yr][0][doy] = 99.99
                 elif flag == 'S':
@@ -3645,6 +3715,7 @@ def Sodpad(**kwargs):
                             el_data[yr][0][k] = val_new
                             for k in range(365,365-(s_count-doy),-1):
                                 el_data[yr-1][0][k] = val_new
+                                redistributed.add(((yr-1) % num_yrs, k))
                     else:
                         for k in range (doy,doy-s_count,-1):
                             el_data[yr][0][k] = val_new
@@ -3764,52 +3835,41 @@ def Soddd(**kwargs):
     #Loop over stations
     for i, stn in enumerate(kwargs['station_ids']):
         yrs = max(len(kwargs['data'][i][j]) for j in range(len(kwargs['variables'])))
-        dd = [[-9999.0 for day in range(366)] for yr in range(yrs)]
-        year = int(kwargs['dates'][0][0:4]) -1
-        for yr in range(yrs):
-            year+=1
-            for doy in range(366):
-                #if not WRCCUtils.is_leap_year(year) and doy ==60:
-                #    continue
-                maxt = str(kwargs['data'][i][0][yr][doy])
-                mint = str(kwargs['data'][i][1][yr][doy])
-                val_x, flag_x = WRCCUtils.strip_data(maxt)
-                val_n, flag_n = WRCCUtils.strip_data(mint)
-                try:
-                    val_x = int(val_x)
-                    val_n = int(val_n)
-                except:
-                    continue
-                #Truncation if desired
-                #if 'trunc_high' in kwargs.keys() and val_x > kwargs['trunc_high']:
-                if 'trunc_high' in kwargs.keys() and int(val_x) > int(kwargs['trunc_high']):
-                    val_x = kwargs['trunc_high']
-                #if 'trunc_low' in kwargs.keys() and val_n < kwargs['trunc_low']:
-                if 'trunc_low' in kwargs.keys() and int(val_n) < int(kwargs['trunc_low']):
-                    val_n = kwargs['trunc_low']
-                ave = (val_x + val_n)/2.0
-                #Implement skip days if desired
-                if 'skip_max_above' in kwargs.keys() and int(val_x) > int(kwargs['skip_max_above']):
-                    if doy != 60 or not WRCCUtils.is_leap_year(year):
-                        dd[yr][doy] = 0
-                        continue
-                if 'skip_min_below' in kwargs.keys() and int(val_n)  < int(kwargs['skip_min_below']):
-                    if doy != 60 or not WRCCUtils.is_leap_year(year):
-                        dd[yr][doy] = 0
-                        continue
-                #NCDC roundoff of ave if desired
-                if kwargs['ncdc_round']:
-                    ave = numpy.ceil(ave)
-                #Compute dd
-                if kwargs['a_b'] == 'b':
-                    dd[yr][doy] = float(kwargs['base_temp']) - ave
-                else:
-                    dd[yr][doy] = ave - float(kwargs['base_temp'])
-                if dd[yr][doy] < 0:
-                    dd[yr][doy] = 0
-                #NCDC roundoff of dd if desired
-                if kwargs['ncdc_round']:
-                    dd[yr][doy] = numpy.ceil(dd[yr][doy])
+        #Decode all values of the station at once,
+        #days whose max or min are no whole numbers have no degree days
+        val_x, flag_x, int_x = sod_decode(kwargs['data'][i][0])
+        val_n, flag_n, int_n = sod_decode(kwargs['data'][i][1])
+        with numpy.errstate(invalid='ignore'):
+            #Truncation if desired
+            if 'trunc_high' in kwargs.keys():
+                val_x = numpy.where(val_x > int(kwargs['trunc_high']), kwargs['trunc_high'], val_x)
+            if 'trunc_low' in kwargs.keys():
+                val_n = numpy.where(val_n < int(kwargs['trunc_low']), kwargs['trunc_low'], val_n)
+            ave = (val_x + val_n)/2.0
+            #Implement skip days if desired, not on Feb 29 of leap years
+            skip = numpy.zeros(ave.shape, dtype=bool)
+            if 'skip_max_above' in kwargs.keys():
+                skip|= numpy.trunc(val_x) > int(kwargs['skip_max_above'])
+            if 'skip_min_below' in kwargs.keys():
+                skip|= numpy.trunc(val_n) < int(kwargs['skip_min_below'])
+            start_year = int(kwargs['dates'][0][0:4])
+            leap = numpy.array([WRCCUtils.is_leap_year(start_year + yr) for yr in range(yrs)], dtype=bool)
+            skip[leap, 60] = False
+            #NCDC roundoff of ave if desired
+            if kwargs['ncdc_round']:
+                ave = numpy.ceil(ave)
+            #Compute dd
+            if kwargs['a_b'] == 'b':
+                dd = float(kwargs['base_temp']) - ave
+            else:
+                dd = ave - float(kwargs['base_temp'])
+            dd[dd < 0] = 0
+        #NCDC roundoff of dd if desired
+        if kwargs['ncdc_round']:
+            dd = numpy.ceil(dd)
+        dd[skip] = 0
+        dd[~(int_x & int_n)] = -9999.0
+        dd = dd.tolist()
 
         #Summarize:
         mon_lens = [31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
@@ -3925,60 +3985,63 @@ def Soddynorm(**kwargs):
             if not kwargs['data'][i][j]:
                 continue
             el_data = kwargs['data'][i][j]
+            #Decode all values of the element at once
+            values, flags = sod_decode(el_data)[0:2]
             if el == 'pcpn': #deal with S, A and T flags
                 s_count = 0
-                for yr in range(len(el_data)):
-                    for doy in range(366):
-                        val, flag = WRCCUtils.strip_data(str(el_data[yr][doy]))
-                        if flag == 'S':
-                            s_count+=1
-                        elif flag == 'A':
-                            s_count+=1
-                            val_new = float(val)/s_count
-                            if s_count > doy: #need to jump back to last year
-                                for k in range(doy):
-                                    el_data[yr][k] = val_new
-                                for k in range(365,365-(s_count-doy),-1):
-                                    el_data[yr-1][k] = val_new
-                            else:
-                                for k in range (doy,doy-s_count,-1):
-                                    el_data[yr][k] = val_new
-                            s_count = 0
-                        elif flag == 'T':
-                            if val ==' ' or not val:
-                                #el_data[yr][doy] = 0.0025
-                                el_data[yr][doy] = 0.0
-                            else:
-                                try:
-                                    float(val)
-                                    if abs(100*int(val) - float(100*int(val))) < 0.05:
-                                        el_data[yr][doy] = 0.00025
-                                    else:
-                                        el_data[yr][doy] = float(val)
-                                except:
-                                    el_data[yr][doy] = 0.0
-            #loop over day of year and compute averages
+                #Accumulated values redistributed to days not visited yet
+                #(back into the last year) have no flags any more
+                redistributed = set()
+                flagged = (flags == WRCCUtils.FLAG_SUBSEQUENT) | (flags == WRCCUtils.FLAG_ACCUMULATED) | \
+                    (flags == WRCCUtils.FLAG_TRACE)
+                for yr, doy in zip(*[idx.tolist() for idx in numpy.nonzero(flagged)]):
+                    if (yr, doy) in redistributed:
+                        continue
+                    flag = chr(flags[yr][doy])
+                    if flag == 'S':
+                        s_count+=1
+                    elif flag == 'A':
+                        s_count+=1
+                        val = values[yr][doy]
+                        if numpy.isnan(val):
+                            val = WRCCUtils.strip_data(str(el_data[yr][doy]))[0]
+                        val_new = float(val)/s_count
+                        if s_count > doy: #need to jump back to last year
+                            days = [(yr, k) for k in range(doy)] + \
+                                [((yr-1) % len(el_data), k) for k in range(365,365-(s_count-doy),-1)]
+                            redistributed.update(days[doy:])
+                        else:
+                            days = [(yr, k) for k in range (doy,doy-s_count,-1)]
+                        for y, k in days:
+                            values[y][k] = float(str(val_new))
+                            flags[y][k] = WRCCUtils.FLAG_NONE
+                        s_count = 0
+                    else:
+                        val = WRCCUtils.strip_data(str(el_data[yr][doy]))[0]
+                        if val ==' ' or not val:
+                            #val_new = 0.0025
+                            val_new = 0.0
+                        else:
+                            try:
+                                float(val)
+                                if abs(100*int(val) - float(100*int(val))) < 0.05:
+                                    val_new = 0.00025
+                                else:
+                                    val_new = float(val)
+                            except:
+                                val_new = 0.0
+                        values[yr][doy] = val_new
+                        flags[yr][doy] = WRCCUtils.FLAG_NONE
+            #loop over day of year and compute averages,
+            #days are in the columns of the values
+            valid = (flags != WRCCUtils.FLAG_MISSING) & ~numpy.isnan(values)
             for doy in range(366):
-                yr_count = 0
-                vals=[]
-                sm  = 0
-                sms = 0
-                n = 0
                 ave = 0
                 std = 0
-                for yr in range(len(el_data)):
-                    val, flag = WRCCUtils.strip_data(str(el_data[yr][doy]))
-                    if flag == 'M' :
-                        continue
-                    else:
-                        try:
-                            vals.append(float(val))
-                            yr_count+=1
-                            sm+=float(val)
-                            sms+= float(val)**2
-                            n+=1
-                        except:
-                            continue
+                doy_vals = values[:,doy][valid[:,doy]].tolist()
+                yr_count = n = len(doy_vals)
+                sm = sum(doy_vals)
+                sms = sum([val**2 for val in doy_vals])
 
                 if sms > 0:
                     if el in ['maxt', 'mint']:
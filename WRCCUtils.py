@@ -6,15 +6,16 @@ Module WRCCUtils
 
 import datetime as dt
 import calendar, time, sys, os
-import re, json
+import re, json, gzip
 import numpy as np
-import scipy, math
+import scipy, scipy.special, math
 from collections import defaultdict, Mapping, Iterable
 import smtplib
 from email.mime.text import MIMEText
 from ftplib import FTP
 import colorsys
-import copy
+import copy, itertools
+import threading
 
 from osgeo import gdal, ogr, osr
 
@@ -54,6 +55,10 @@ special_grid_areas = ['county', 'county_warning_area','basin','climate_division'
 station_reduction_areas = ['county', 'county_warning_area','basin',\
 'climate_division','state','bounding_box']
 grid_reduction_areas = ['state','bounding_box']
+#Station formatters that walk through MultiStnData results
+#one station at a time and can be fed a MultiStnDataStream response
+streaming_station_formatters = ['station_data_trim_and_summary',\
+'format_station_no_summary','format_station_windowed_data','format_station_temporal_summary']
 
 today = set_back_date(0)
 today_year = today[0:4]
@@ -666,6 +671,10 @@ def check_request_for_data(req,meta_keys,data_key):
 
 def check_data_and_dates(data_key,req, dates):
     error = None
+    #Streamed data (MultiStnDataStream generator) can only be
+    #iterated once, it is not checked here
+    if not isinstance(req[data_key], (list, tuple)):
+        return error
     #Sanity check on data
     if not req[data_key] or len(req[data_key]) <1:
         error = 'No data found for these parameters.'
@@ -702,27 +711,27 @@ def request_and_format_multiple_gridpoints(form):
     data = [[date] for date in dates]
     for i in range(len(data)):
         data[i]+= [[] for j in range(len(form['variables']))]
-    #Loop over locations and rquest data for each point
+    #Request data for all points concurrently
+    params_list = []
     for lon_idx, lon in enumerate(lons):
         lat = lons_lats[2*lon_idx + 1]
         params_single = copy.deepcopy(params)
         params_single['loc'] = lon + ',' + lat
         del params_single['locs']
-        form_single = copy.deepcopy(form)
+        params_list.append(params_single)
+    reqs = AcisWS.GridDataMulti(params_list)
+    #Loop over locations and format data for each point
+    for lon_idx, lon in enumerate(lons):
+        lat = lons_lats[2*lon_idx + 1]
         #del form['locations']
         form['location'] = lon + ',' + lat
-        request_data = getattr(AcisWS,'GridData')
-        #Make data request
-        try:
-            req = request_data(params_single)
-        except Exception, e:
-            error = 'Data request failed with error: %s.' %str(e)
-            requestdict['error'].append(error)
-            continue
-
+        req = reqs[lon_idx]
         #Sanity checks
         if req is None or  (not 'data' in req.keys() and not 'smry' in req.keys()):
-            error = 'No data found for these parameters.'
+            if req and 'error' in req.keys():
+                error = 'Data request failed with error: %s.' %str(req['error'])
+            else:
+                error = 'No data found for these parameters.'
             requestdict['error'].append(error)
             continue
         #Add meta for this point
@@ -776,13 +785,19 @@ def request_and_format_data(form):
         resultsdict['error'].append( error)
         return resultsdict
 
+    #Set request parameters
+    params = set_acis_params(form)
     if data_type == 'station':
         if 'station_id' in form.keys(): request_data = getattr(AcisWS,'StnData')
+        elif AcisWS.request_needs_split('MultiStnData', params):
+            #Oversized requests are split, run concurrently and merged
+            request_data = getattr(AcisWS,'MultiStnDataSplit')
+        elif WRCCData.STATION_DATA_FORMATTER[form['area_type']][form['data_summary']] in streaming_station_formatters:
+            #Stations are parsed and formatted one at a time
+            request_data = getattr(AcisWS,'MultiStnDataStream')
         else: request_data = getattr(AcisWS,'MultiStnData')
     if data_type == 'grid':
-        request_data = getattr(AcisWS,'GridData')
-    #Set request parameters
-    params = set_acis_params(form)
+        request_data = getattr(AcisWS,'GridDataSplit')
     #Make data request
     try:
         req = request_data(params)
@@ -981,16 +996,8 @@ def station_data_trim_and_summary(req,form):
     unit_convert = getattr(thismodule,'convert_nothing')
     if 'units' in form.keys() and form['units'] == 'metric':
         unit_convert = getattr(thismodule,'convert_to_metric')
-    #Station loop over data
-    for stn_idx, stn_data in enumerate(req[data_key]):
-        try:
-            lon = stn_data['meta']['ll'][0]
-            lat = stn_data['meta']['ll'][1]
-        except:
-            continue
-        point_in = PointIn(lon, lat, poly)
-        if not point_in:
-            continue
+    #Station loop over the data of the stations in the shape
+    for stn_data in iter_stations_in_shape(req[data_key], poly, PointIn):
         #point is in shape, add to data and compute summary
         key_order_list = ['name', 'sids','state','ll']
         meta_display_list = metadict_to_display_list(stn_data['meta'], key_order_list,form)
@@ -998,22 +1005,26 @@ def station_data_trim_and_summary(req,form):
         #new_meta.append(stn_data['meta'])
         stn_name = str(stn_data['meta']['name'])
         new_data.append([])
+        #Decode all values of the station at once
+        #If user asked for flags/obstime
+        #data el_data is a list and we need to pick the correct value
+        vals, flags = decode_acis_values([el_data[0] if isinstance(el_data, list) else el_data \
+            for date_data in stn_data['data'] for el_data in date_data])
+        flags = flags.tostring()
+        vals = vals.tolist()
+        val_idx = -1
         for date_idx, date_data in enumerate(stn_data['data']):
             d_data = [format_date(dates[date_idx],sep)]
             for el_idx, el_data in enumerate(date_data):
-                #If user asked for flags/obstime
-                #data el_data is a list and we need to pick the correct value
+                val_idx+=1
                 obs_time = None
-                if isinstance(el_data, list):
-                    val = el_data[0]
-                    if len(el_data) >1:
-                        obs_time = el_data[1]
-                else:
-                    val = el_data
-                #Strip flag from data
-                strp_val, flag = strip_data(val)
-
+                if isinstance(el_data, list) and len(el_data) >1:
+                    obs_time = el_data[1]
+                strp_val = vals[val_idx];flag = flags[val_idx]
                 try:
+                    if np.isnan(strp_val):
+                        #No number, keep the stripped value string
+                        strp_val = strip_data(el_data[0] if isinstance(el_data, list) else el_data)[0]
                     val = unit_convert(form['variables'][el_idx],float(strp_val))
                     #Don't include -9999 (Missing) values
                     if abs(float(strp_val) + 9999) > 0.001 and abs(float(strp_val) + 999) > 0.0001:
@@ -1049,10 +1060,9 @@ def station_data_trim_and_summary(req,form):
             except:
                 stn_ids = ' ()'
             row = [stn_name + stn_ids]
-            if point_in:
-                for el_idx, el in enumerate(form['variables']):
-                    row.append(convert_nothing(el,compute_statistic(smry_data[el_idx],form['temporal_summary'])))
-                new_smry.append(row)
+            for el_idx, el in enumerate(form['variables']):
+                row.append(convert_nothing(el,compute_statistic(smry_data[el_idx],form['temporal_summary'])))
+            new_smry.append(row)
     #Compute spatial summary
     if form['data_summary'] == 'spatial_summary':
         for date_idx in range(len(dates)):
@@ -1113,63 +1123,58 @@ def grid_data_trim_and_summary(req,form):
     else:
         new_smry = []
     new_data = [];new_meta = []
-    #find the polygon of the special shape
-    #and the function to test if a point lies within the shape
-    poly, PointIn = set_poly_and_PointIn(form)
     #Set unit converter
     unit_convert = getattr(thismodule,'convert_nothing')
     if 'units' in form.keys() and form['units'] == 'metric':
         unit_convert = getattr(thismodule,'convert_to_metric')
-    #lat,lon loop over data
-    for grid_idx in xrange(len(req['meta']['lat'])):
-        lat = req['meta']['lat'][grid_idx][0]
-        new_lons = [];new_lats = [];new_elevs = []
-        for lon_idx in xrange(len(req['meta']['lon'][grid_idx])):
-            lon = req['meta']['lon'][grid_idx][lon_idx]
-            #lon_data = [[[] for el in form['variables']] for d in range(len(req[data_key]))]
-            point_in = PointIn(lon, lat, poly)
-            if not point_in:
-                continue
-            #points is in shape, add tp data and compute summary
-            elev = set_grid_elev(req['meta']['elev'][grid_idx][lon_idx], unit_convert)
-            meta_dict = write_grid_metadict(lat,lon,elev)
-            meta_display_list = metadict_to_display_list(meta_dict, meta_dict.keys(),form)
-            new_meta.append(meta_display_list)
-            new_lons.append(lon)
-            new_elevs.append(elev)
-            new_data.append([])
-            for date_idx, date_data in enumerate(req[data_key]):
-                d_data = [format_date(date_data[0],sep)]
-                for el_idx,el in enumerate(form['variables']):
-                    try:
-                        v = float(date_data[el_idx+1][grid_idx][lon_idx])
-                        d = unit_convert(el, float(v))
-                        #d_data.append(round(d,4))
-                        d_data.append(d)
-                        if abs(v + 9999) > 0.001 and abs(v + 999) > 0.0001:
-                            if form['data_summary'] == 'spatial_summary':
-                                smry_data[date_idx][el_idx].append(d)
-                            if form['data_summary'] == 'temporal_summary':
-                                smry_data[el_idx].append(d)
-                    except:
-                        d_data.append(convert_nothing(el,date_data[el_idx+1][grid_idx][lon_idx]))
-                new_data[-1].append(d_data)
-            #Wndowed Data
-            if form['data_summary'] == 'windowed_data':
-                sd = form['start_date']
-                ed = form['end_date']
-                sw = form['start_window']
-                ew = form['end_window']
-                new_data[-1] = get_windowed_data(new_data[-1], sd, ed, sw, ew)
-            new_data[-1].insert(0,header_data)
+    #Grid points that lie within the special shape
+    grid_in = special_area_grid_mask(req, form)
+    #Metadata and data of the points in the shape, in lat, lon order
+    lats = np.asarray(req['meta']['lat'])[grid_in].tolist()
+    lons = np.asarray(req['meta']['lon'])[grid_in].tolist()
+    elevs = np.asarray(req['meta']['elev'])[grid_in].tolist()
+    #pts_data[date_idx][el_idx] -- values of the points in the shape
+    pts_data = [[np.asarray(date_data[el_idx+1], dtype=object)[grid_in].tolist() \
+        for el_idx in range(len(form['variables']))] for date_data in req[data_key]]
+    for pt_idx, lat in enumerate(lats):
+        lon = lons[pt_idx]
+        elev = set_grid_elev(elevs[pt_idx], unit_convert)
+        meta_dict = write_grid_metadict(lat,lon,elev)
+        meta_display_list = metadict_to_display_list(meta_dict, meta_dict.keys(),form)
+        new_meta.append(meta_display_list)
+        new_data.append([])
+        for date_idx, date_data in enumerate(req[data_key]):
+            d_data = [format_date(date_data[0],sep)]
+            for el_idx,el in enumerate(form['variables']):
+                val = pts_data[date_idx][el_idx][pt_idx]
+                try:
+                    v = float(val)
+                    d = unit_convert(el, float(v))
+                    #d_data.append(round(d,4))
+                    d_data.append(d)
+                    if abs(v + 9999) > 0.001 and abs(v + 999) > 0.0001:
+                        if form['data_summary'] == 'spatial_summary':
+                            smry_data[date_idx][el_idx].append(d)
+                        if form['data_summary'] == 'temporal_summary':
+                            smry_data[el_idx].append(d)
+                except:
+                    d_data.append(convert_nothing(el,val))
+            new_data[-1].append(d_data)
+        #Wndowed Data
+        if form['data_summary'] == 'windowed_data':
+            sd = form['start_date']
+            ed = form['end_date']
+            sw = form['start_window']
+            ew = form['end_window']
+            new_data[-1] = get_windowed_data(new_data[-1], sd, ed, sw, ew)
+        new_data[-1].insert(0,header_data)
 
-            #Temporal summary
-            if form['data_summary'] == 'temporal_summary':
-                row = [str(round(lon,4)) + ',' + str(round(lat,4))]
-                if point_in:
-                    for el_idx, el in enumerate(form['variables']):
-                        row.append(convert_nothing(el,compute_statistic(smry_data[el_idx],form['temporal_summary'])))
-                new_smry.append(row)
+        #Temporal summary
+        if form['data_summary'] == 'temporal_summary':
+            row = [str(round(lon,4)) + ',' + str(round(lat,4))]
+            for el_idx, el in enumerate(form['variables']):
+                row.append(convert_nothing(el,compute_statistic(smry_data[el_idx],form['temporal_summary'])))
+            new_smry.append(row)
 
     #Compute spatial summary
     if form['data_summary'] == 'spatial_summary':
@@ -1539,16 +1544,17 @@ def format_station_spatial_summary(req,form):
         meta_display_list = metadict_to_display_list(stn_data['meta'], key_order_list,form)
         new_meta.append(meta_display_list)
         #new_meta.append(stn_data['meta'])
+        #Decode all values of the station at once
+        vals, flags = decode_acis_values([el_data for date_data in stn_data['data'] for el_data in date_data])
+        valid = (~np.isnan(vals) & (np.abs(vals + 9999) > 0.001) & (np.abs(vals + 999) > 0.001)).tolist()
+        vals = vals.tolist()
+        val_idx = 0
         for date_idx,date_data in enumerate(stn_data['data']):
             for el_idx, el_data in enumerate(date_data):
-                strp_val, flag = strip_data(el_data)
-                try:
-                    v = float(strp_val)
-                    if abs(v + 9999)> 0.001 and abs(v + 999)> 0.001:
-                        val = unit_convert(form['variables'][el_idx],v)
-                        smry_data[date_idx][el_idx].append(val)
-                except:
-                    pass
+                if valid[val_idx]:
+                    val = unit_convert(form['variables'][el_idx],vals[val_idx])
+                    smry_data[date_idx][el_idx].append(val)
+                val_idx+=1
                 #Compute spatial summary at last station iteration
                 if stn_idx == len(req['data']) -1:
                     el = form['variables'][el_idx]
@@ -3177,143 +3183,184 @@ def is_leap_year(year):
 ###############################
 #GEOSPATIAL
 ##############################
-def read_shapefile(app_name,shp_file):
+def read_shapefile(app_name,shp_file,tolerance=None,max_vertices=None):
     '''
     reads shapefile and converts coordinates to
-    lon, lat strings for each polygon found
+    lon, lat arrays for each polygon found
     Args:
         app_name: application name
         shp_file: path to shapefile
+        tolerance: optional simplification tolerance in degrees
+        max_vertices: optional target number of vertices per feature,
+                      defaults to settings.SHAPEFILE_MAX_VERTICES
     Returns:
-        feats_lls: List of list containing
-                   polygon coords of multi polygons
-                   for each feature in shapefile
+        feats_polygons: List containing the polygons of each feature
+                   in shapefile, see geometry_to_polygons.
+                   Holes are kept, the polygons of a feature
+                   can be passed to WRCCClasses.PreparedPolygon
+    '''
+    if max_vertices is None:
+        max_vertices = getattr(AcisWS.settings, 'SHAPEFILE_MAX_VERTICES', None)
+    return list(iter_shapefile_polygons(shp_file, tolerance=tolerance, max_vertices=max_vertices))
+
+def feat_id_to_lls(app_name,geom_info):
+    '''
+    Args:
+        app_name: application name
+        geom_info:{
+            'input_geom':
+            'input_geom_type':
+            'proj_geom'
+        }
+    Return:
+        polygons: List of polygons of the feature, see geometry_to_polygons.
+                  Holes are kept
+    '''
+    #POINTS and LINES are not allowed
+    if geom_info['input_geom_type'] not in ['POLYGON', 'MULTIPOLYGON']:
+        return []
+    return geometry_to_polygons(geom_info['proj_geom'])
+
+def iter_shapefile_polygons(shp_file, decimals=4, tolerance=None, max_vertices=None):
+    '''
+    Reads shapefile feature by feature and yields the
+    polygons of each feature projected to WGS84,
+    see geometry_to_polygons.
+    Args:
+        shp_file: path to shapefile
+        decimals: coordinates are rounded to decimals
+        tolerance: optional simplification tolerance in degrees
+        max_vertices: optional target number of vertices per feature
     '''
-    feats_lls= [] #each poly is a ll_string in this list
     ## Project all coordinates to WGS84
     output_osr = osr.SpatialReference()
     output_osr.ImportFromEPSG(4326)  ## WGS84
-    ##output_osr.ImportFromEPSG(4269)  ## NAD83
     ## Get the spatial reference
     input_ds = ogr.Open(shp_file)
     if not input_ds:
-        return []
+        return
     input_layer = input_ds.GetLayer()
-    ## Get the projection
-    input_osr = input_layer.GetSpatialRef()
     ## Build the tranform object for projecting the coordinates
-    tx = osr.CoordinateTransformation(input_osr, output_osr)
-    #Loop over feature ids
+    tx = osr.CoordinateTransformation(input_layer.GetSpatialRef(), output_osr)
     ## Iterate through the features
     input_ftr = input_layer.GetNextFeature()
     while input_ftr:
-        polys_ll = []
-        input_fid = input_ftr.GetFID()
-        input_geom = input_ftr.GetGeometryRef()
         ## Project a copy of the geometry
-        proj_geom = input_geom.Clone()
+        proj_geom = input_ftr.GetGeometryRef().Clone()
         proj_geom.Transform(tx)
-        geom_info = {
-            'input_geom':input_geom,
-            'input_geom_type':input_geom.GetGeometryName(),
-            'proj_geom':proj_geom
-        }
-        multi_polys_lls = feat_id_to_lls(app_name,geom_info)
-        feats_lls.append(multi_polys_lls)
-        ## Get the next feature
+        yield geometry_to_polygons(proj_geom, decimals=decimals,
+            tolerance=tolerance, max_vertices=max_vertices)
         input_ftr = input_layer.GetNextFeature()
-    return feats_lls
 
-def feat_id_to_lls(app_name,geom_info):
+def geometry_to_polygons(geom, decimals=4, tolerance=None, max_vertices=None):
     '''
+    Returns the polygons of an ogr POLYGON or MULTIPOLYGON geometry
+    as list of polygons, each a list of rings (outer ring, then holes),
+    each ring a closed (n x 2) float array of lon, lat.
+    Other geometry types have no polygons.
     Args:
-        app_name: application name
-        geom_info:{
-            'input_geom':
-            'input_geom_type':
-            'proj_geom'
-        }
-    Return:
-        polys_lls: List of list containing
-                  polygon coords of multi polygons
-    '''
-    multi_polys_lls = []# Eash multi poly is a list item
-    #Extract lon, lat coordinates from different geometry types
-    #1.POINT and MULTIPOINT -- Not allowed
-    if geom_info['input_geom_type'] in  ['POINT','MULTIPOINT']:
-        '''
-        ll_str = ''
-        for i in range(0, geom_info['proj_geom'].GetPointCount()):
-            pt = geom_info['proj_geom'].GetPoint(i)
-            ll_str+=str(round(pt[0],4)) + ',' + str(round(pt[1],4)) + ','
-        #Remove last comma
-        ll_str = ll_str[0:-1]
-        '''
-        return multi_poly_lls
-    #2.LINES, MULTILINESTRINGS -- not allowed
-    if geom_info['input_geom_type'] in ['LINE','MULTILINESTRING']:
-        return multi_poly_lls
-    #3.POLYGONS
-    if geom_info['input_geom_type'] in ['POLYGON']:
-
-        #FIX ME: NEED TO DEAL WITH HOLY POLYS
-        #Check that polygon has no hole
-        if len(range(geom_info['proj_geom'].GetGeometryCount())) > 1:
-            return multi_polys_lls
-
-        ll_str = ''
-        ll_list = []
-        ## POLYGONS are made up of LINEAR RINGS
-        for i in range(0, geom_info['proj_geom'].GetGeometryCount()):
-            sub_geom = geom_info['proj_geom'].GetGeometryRef(i)
-            ## LINEAR RINGS are made up of POINTS
-            for j in range(0, sub_geom.GetPointCount()):
-                pt = sub_geom.GetPoint(j)
-                ll = str(round(pt[0],4)) + ',' + str(round(pt[1],4))
-                if ll in ll_list:
-                    if j != sub_geom.GetPointCount() - 1:
-                        continue
-                ll_str+=ll + ','
-                ll_list.append(ll)
-                #Close poly if user hasn't
-                if j == 0:first = ll
-                if j == sub_geom.GetPointCount() - 1:
-                    if ll != first:
-                        ll_str+=first + ','
-                        ll_list.append(first)
-        #Remove last comma
-        ll_str = ll_str[0:-1]
-        multi_polys_lls.append(ll_str)#save poly in first multi polygon slot
-    #4.MULTIPOLYGONS
-    if geom_info['input_geom_type'] in ['MULTIPOLYGON']:
-        polys_lls = []
-        #MULTIPOLYGONS are made of polygons
-        ll_list = []
-        for i in range(0, geom_info['proj_geom'].GetGeometryCount()):
-            poly = geom_info['proj_geom'].GetGeometryRef(i)
-            ll_str = ''#each poly gets its own ll string
-            ll_list.append([])
-            ## POLYGONS are made up of LINEAR RINGS
-            for j in range(0, poly.GetGeometryCount()):
-                linear_ring = poly.GetGeometryRef(j)
-                for k in range(0, linear_ring.GetPointCount()):
-                    pt = linear_ring.GetPoint(k)
-                    ll = str(round(pt[0],4)) + ',' + str(round(pt[1],4))
-                    if ll in ll_list:
-                        if k != poly.GetGeometryCount() - 1:
-                            continue
-                    ll_str+=ll + ','
-                    ll_list[-1].append(ll)
-                    #Close poly if user hasn't
-                    if k == 0:first = ll
-                    if k == poly.GetGeometryCount() - 1:
-                        if ll != first:
-                            ll_str+=first + ','
-                            ll_list[-1].append(ll)
-            #Remove last comma
-            ll_str = ll_str[0:-1]
-            multi_polys_lls.append(ll_str)
-    return multi_polys_lls
+        geom: ogr geometry
+        decimals: coordinates are rounded to decimals
+        tolerance: optional simplification tolerance in degrees
+        max_vertices: optional target number of vertices of all rings,
+                      shared among the rings by their number of vertices
+    '''
+    geom_type = geom.GetGeometryName()
+    if geom_type == 'POLYGON':
+        polys = [geom]
+    elif geom_type == 'MULTIPOLYGON':
+        polys = [geom.GetGeometryRef(i) for i in range(geom.GetGeometryCount())]
+    else:
+        return []
+    polygons = [[ring_to_array(poly.GetGeometryRef(j), decimals=decimals) \
+        for j in range(poly.GetGeometryCount())] for poly in polys]
+    if tolerance is None and max_vertices is None:
+        return polygons
+    num_vertices = sum([ring.shape[0] for rings in polygons for ring in rings])
+    for rings in polygons:
+        for j, ring in enumerate(rings):
+            ring_max = None
+            if max_vertices is not None and num_vertices > max_vertices:
+                ring_max = int(max_vertices * ring.shape[0] / float(num_vertices))
+            rings[j] = simplify_ring(ring, tolerance=tolerance, max_vertices=ring_max)
+    return polygons
+
+def ring_to_array(ring_geom, decimals=4):
+    '''
+    Returns the closed ring of an ogr LINEARRING
+    as (n x 2) float array of lon, lat.
+    Coordinates are rounded to decimals and
+    repeated vertices are dropped.
+    '''
+    points = ring_geom.GetPoints() or []
+    last = len(points) - 1
+    seen = set();lls = []
+    for j, pt in enumerate(points):
+        ll = (round(pt[0], decimals), round(pt[1], decimals))
+        #Closing vertex repeats the first one
+        if ll in seen and j != last:
+            continue
+        seen.add(ll)
+        lls.append(ll)
+    #Close poly if user hasn't
+    if lls and lls[-1] != lls[0]:
+        lls.append(lls[0])
+    return np.array(lls, dtype=float).reshape(-1, 2)
+
+def douglas_peucker_weights(points):
+    '''
+    Douglas-Peucker simplification of the polyline points (n x 2),
+    computed once for all tolerances.
+    Returns the weight of each vertex: the vertex is kept by the
+    simplification with tolerance t if its weight is > t.
+    End points have infinite weight.
+    '''
+    n = points.shape[0]
+    weights = np.zeros(n)
+    weights[0] = weights[-1] = np.inf
+    stack = [(0, n - 1, np.inf)]
+    while stack:
+        first, last, parent_weight = stack.pop()
+        if last - first < 2:
+            continue
+        a = points[first];b = points[last]
+        p = points[first + 1:last]
+        ab = b - a
+        length = math.sqrt(ab[0]**2 + ab[1]**2)
+        if length == 0:
+            #Closed ring, distance to the end points
+            dists = np.sqrt(((p - a)**2).sum(axis=1))
+        else:
+            dists = np.abs(ab[0] * (p[:,1] - a[1]) - ab[1] * (p[:,0] - a[0])) / length
+        k = int(np.argmax(dists))
+        #Weights can not exceed the weight of the parent split
+        weight = min(dists[k], parent_weight)
+        weights[first + 1 + k] = weight
+        stack.append((first, first + 1 + k, weight))
+        stack.append((first + 1 + k, last, weight))
+    return weights
+
+def simplify_ring(ring, tolerance=None, max_vertices=None):
+    '''
+    Douglas-Peucker simplification of the closed ring (n x 2 array).
+    Keeps the vertices that deviate more than tolerance (degrees)
+    from the simplified ring, at most max_vertices of them.
+    Rings are never simplified to less than a triangle.
+    '''
+    n = ring.shape[0]
+    if n <= 4:
+        return ring
+    weights = douglas_peucker_weights(ring)
+    keep = np.ones(n, dtype=bool)
+    if tolerance is not None:
+        keep&= weights > tolerance
+    if max_vertices is not None and max_vertices < keep.sum():
+        #Keep the max_vertices vertices of largest weight
+        order = np.argsort(-weights, kind='mergesort')
+        keep[order[max(max_vertices, 4):]] = False
+    if keep.sum() < 4:
+        keep[np.argsort(-weights, kind='mergesort')[0:4]] = True
+    return ring[keep]
 
 def shapefile_to_ll(app_name, shp_file, feature_id):
     poly_ll = ''
@@ -3703,6 +3750,44 @@ def check_for_file(dir_location, file_name):
     return file_exists
 
 
+_overlay_store = None
+_overlay_store_lock = threading.Lock()
+
+def get_overlay_store():
+    '''
+    Returns the store of pre-generated overlays or None
+    if it is switched off via settings.OVERLAY_DIR = None
+    '''
+    global _overlay_store
+    with _overlay_store_lock:
+        if _overlay_store is None:
+            settings = AcisWS.settings
+            overlay_dir = getattr(settings, 'OVERLAY_DIR', settings.TEMP_DIR + 'overlays/')
+            if not overlay_dir:
+                return None
+            _overlay_store = WRCCClasses.OverlayStore(overlay_dir,
+                levels=getattr(settings, 'OVERLAY_LEVELS', None),
+                max_age=getattr(settings, 'OVERLAY_MAX_AGE', 30*86400))
+    return _overlay_store
+
+def find_overlay_file(area_type, state, file_format='kml', level=0, gzipped=False):
+    '''
+    Returns file name, relative to settings.OVERLAY_DIR, of the
+    pre-generated overlay of the areas of area_type in state.
+    Missing overlays are built, stale ones are served as they are.
+    Returns None if there is no overlay store or the overlay can not be built.
+    area_type -- form area type (county_warning_area, climate_division, basin, county)
+    file_format -- kml or geojson
+    level -- simplification level, 0 is not simplified
+    '''
+    store = get_overlay_store()
+    if store is None or str(area_type) not in WRCCData.SEARCH_AREA_FORM_TO_ACIS.keys():
+        return None
+    acis_area_type = WRCCData.SEARCH_AREA_FORM_TO_ACIS[str(area_type)]
+    if acis_area_type not in ['basin', 'climdiv', 'county', 'cwa']:
+        return None
+    return store.find(acis_area_type, state, file_format=file_format, level=level, gzipped=gzipped)
+
 def generate_kml_file(area_type, state, kml_file_name, dir_location):
     '''
     This functions makes a call to ACIS General
@@ -4117,6 +4202,24 @@ def point_in_circle(x,y,circle):
     except:
         return False
 
+def points_in_circle(xs, ys, circle):
+    '''
+    Vectorized point_in_circle.
+    xs, ys -- arrays of lons, lats
+    circle -- [lon, lat, radius], radius in meters
+    Returns boolean array, NaN coordinates are outside
+    '''
+    R = 6378.1 #Radius of the Earth in km
+    xs = np.asarray(xs, dtype=float)
+    ys = np.asarray(ys, dtype=float)
+    dlat = np.radians(ys - circle[1])
+    dlon = np.radians(xs - circle[0])
+    #Haversine Formula
+    a = np.sin(dlat/2)**2 + np.sin(dlon/2)**2 * np.cos(np.radians(ys))*math.cos(math.radians(circle[1]))
+    with np.errstate(invalid='ignore'):
+        dist = R*2*np.arctan2(np.sqrt(a), np.sqrt(1-a))
+        return dist <= circle[2] / 1000.0
+
 def point_on_boundary(x, y, poly):
     n = len(poly)
     for i in range(n):
@@ -4201,6 +4304,196 @@ def point_in_poly(x,y,poly):
         pass
     return inside
 
+def points_in_poly(xs, ys, poly):
+    '''
+    Vectorized point_in_poly ("Ray Casting Method"),
+    loops over the polygon edges instead of the points.
+    xs, ys -- arrays of x (lon), y (lat) coordinates
+    poly   -- list of (x,y) or [x,y] pairs
+    Returns boolean array, same boundary semantics as point_in_poly
+    '''
+    xs = np.asarray(xs, dtype=float)
+    ys = np.asarray(ys, dtype=float)
+    inside = np.zeros(xs.shape, dtype=bool)
+    n = len(poly)
+    if n == 0:
+        return inside
+    with np.errstate(invalid='ignore'):
+        p1x,p1y = [float(p) for p in poly[0]]
+        for i in range(n+1):
+            p2x,p2y = [float(p) for p in poly[i % n]]
+            if p1y != p2y:
+                crosses = (ys > min(p1y,p2y)) & (ys <= max(p1y,p2y)) & (xs <= max(p1x,p2x))
+                if p1x != p2x:
+                    xints = (ys-p1y)*(p2x-p1x)/(p2y-p1y)+p1x
+                    crosses&= xs <= xints
+                inside^= crosses
+            p1x,p1y = p2x,p2y
+    return inside
+
+def points_in_or_on_poly(xs, ys, poly):
+    '''
+    Vectorized point_in_or_on_poly,
+    loops over the polygon edges instead of the points.
+    xs, ys -- arrays of x (lon), y (lat) coordinates
+    poly   -- list of (x,y) or [x,y] pairs
+    Returns boolean array, same boundary semantics as point_in_or_on_poly
+    '''
+    xs = np.asarray(xs, dtype=float)
+    ys = np.asarray(ys, dtype=float)
+    on_boundary = np.zeros(xs.shape, dtype=bool)
+    n = len(poly)
+    if n == 0:
+        return on_boundary
+    with np.errstate(invalid='ignore', divide='ignore'):
+        p1x,p1y = [float(p) for p in poly[0]]
+        for i in range(n+1):
+            p2x,p2y = [float(p) for p in poly[i % n]]
+            #Check if point is on boundary,
+            #vertical edges are skipped like in point_on_vertex
+            v1x = p2x - p1x
+            v1y = p2y - p1y
+            if v1x != 0:
+                v2x = xs - p1x
+                v2y = ys - p1y
+                on_boundary|= (v1x * v2y - v1y * v2x == 0) & (v2x / v1x > 0) & \
+                    (v1x * v1x + v1y * v1y >= v2x * v2x + v2y * v2y)
+            p1x,p1y = p2x,p2y
+    return on_boundary | points_in_poly(xs, ys, poly)
+
+def point_in_prepared_poly(x, y, prepared_poly):
+    '''
+    Determine if a point is inside a WRCCClasses.PreparedPolygon
+    '''
+    return prepared_poly.contains(x, y)
+
+def points_in_prepared_poly(xs, ys, prepared_poly):
+    '''
+    Vectorized point_in_prepared_poly
+    '''
+    return prepared_poly.contains_points(xs, ys)
+
+#Vectorized versions of the point in shape tests
+POINTS_IN = {
+    'point_in_poly':'points_in_poly',
+    'point_in_or_on_poly':'points_in_or_on_poly',
+    'point_in_circle':'points_in_circle',
+    'point_in_prepared_poly':'points_in_prepared_poly'
+}
+
+#Polygons with more vertices are tested via the edge index
+#of a WRCCClasses.PreparedPolygon
+PREPARED_POLY_MIN_VERTICES = 64
+
+def shape_mask(xs, ys, poly, PointIn):
+    '''
+    Tests all points xs, ys in one pass with the vectorized version
+    of PointIn (as returned by set_poly_and_PointIn).
+    Returns boolean array of the shape of xs
+    '''
+    xs = np.asarray(xs, dtype=float)
+    ys = np.asarray(ys, dtype=float)
+    if getattr(PointIn, '__name__', None) in ['point_in_poly', 'point_in_or_on_poly'] \
+        and len(poly) >= PREPARED_POLY_MIN_VERTICES:
+        include_boundary = PointIn.__name__ == 'point_in_or_on_poly'
+        return WRCCClasses.PreparedPolygon(poly, include_boundary=include_boundary).contains_points(xs, ys)
+    if getattr(PointIn, '__name__', None) in POINTS_IN.keys():
+        return getattr(thismodule, POINTS_IN[PointIn.__name__])(xs, ys, poly)
+    mask = np.zeros(xs.shape, dtype=bool)
+    for idx in np.ndindex(xs.shape):
+        mask[idx] = PointIn(xs[idx], ys[idx], poly)
+    return mask
+
+def iter_stations_in_shape(stations, poly, PointIn, batch_size=500):
+    '''
+    Yields the stations of the MultiStnData results stations
+    that lie in the shape, testing batch_size stations at a time
+    with shape_mask. stations is iterated once, so it can be
+    the generator of a MultiStnDataStream response.
+    Stations without valid ll are skipped.
+    '''
+    stations = iter(stations)
+    while True:
+        batch = list(itertools.islice(stations, batch_size))
+        if not batch:
+            break
+        lls = []
+        for stn_data in batch:
+            try:
+                lls.append([float(stn_data['meta']['ll'][0]), float(stn_data['meta']['ll'][1])])
+            except:
+                lls.append([np.nan, np.nan])
+        lls = np.array(lls, dtype=float)
+        stns_in = shape_mask(lls[:,0], lls[:,1], poly, PointIn) & ~np.isnan(lls[:,0])
+        for stn_idx, stn_data in enumerate(batch):
+            if stns_in[stn_idx]:
+                yield stn_data
+
+def grid_shape_mask(grid_meta, poly, PointIn):
+    '''
+    Returns boolean (lat x lon) mask of the grid points of an ACIS
+    GridData request (meta lat, lon arrays) that lie in the shape
+    '''
+    lats = np.asarray(grid_meta['lat'], dtype=float)
+    lons = np.asarray(grid_meta['lon'], dtype=float)
+    return shape_mask(lons, lats, poly, PointIn)
+
+_grid_mask_store = None
+_grid_mask_store_lock = threading.Lock()
+
+def get_grid_mask_store():
+    '''
+    Returns the store of special grid area masks or None
+    if it is switched off via settings.GRID_MASK_DIR = None
+    '''
+    global _grid_mask_store
+    with _grid_mask_store_lock:
+        if _grid_mask_store is None:
+            settings = AcisWS.settings
+            mask_dir = getattr(settings, 'GRID_MASK_DIR', settings.TEMP_DIR + 'grid_masks/')
+            if not mask_dir:
+                return None
+            _grid_mask_store = WRCCClasses.GridMaskStore(mask_dir)
+    return _grid_mask_store
+
+def grid_mask_key(form):
+    '''
+    Returns (grid, area_type, area_id) of special grid area
+    requests whose mask can be stored, None for other requests
+    '''
+    if not 'grid' in form.keys():
+        return None
+    #Only requests whose shape set_poly_and_PointIn takes from one area geojson
+    for key in ['shape', 'locations', 'location', 'bounding_box', 'state']:
+        if key in form.keys():
+            return None
+    area_types = [a for a in special_grid_areas if a != 'shape' and a in form.keys()]
+    if len(area_types) != 1:
+        return None
+    return (form['grid'], area_types[0], form[area_types[0]])
+
+def special_area_grid_mask(req, form):
+    '''
+    Returns boolean (lat x lon) mask of the grid points of
+    GridData request req that lie in the special area of form.
+    Masks of county, climdiv, cwa and basin areas are read from
+    the grid mask store, so that the area geojson is only fetched
+    and tested against the grid once per grid and area
+    '''
+    store = get_grid_mask_store()
+    key = grid_mask_key(form)
+    if store is not None and key is not None:
+        mask = store.get(key[0], key[1], key[2], req['meta'])
+        if mask is not None:
+            return mask
+    #find the polygon of the special shape
+    #and the function to test if a point lies within the shape
+    poly, PointIn = set_poly_and_PointIn(form)
+    mask = grid_shape_mask(req['meta'], poly, PointIn)
+    if store is not None and key is not None:
+        store.set(key[0], key[1], key[2], req['meta'], mask)
+    return mask
+
 def set_poly_and_PointIn(prms):
     poly = None;PointIn=None
     if 'shape' in prms.keys():
@@ -4234,20 +4527,26 @@ def set_poly_and_PointIn(prms):
             poly = [(shape[2*idx],shape[2*idx+1]) for idx in range(len(shape)/2)]
             PointIn = getattr(thismodule,'point_in_or_on_poly')
             return poly, PointIn
+        area = None
         if 'basin' in prms.keys():
-            sh = AcisWS.find_geojson_of_area('basin', prms['basin'])
+            area = ('basin', prms['basin'])
         if 'location' in prms.keys():
             s = prms['location'].replace(' ','').split(',')
             sh = [(s[0],s[1])]
         if 'county_warning_area' in prms.keys():
-            sh = AcisWS.find_geojson_of_area('cwa', prms['county_warning_area'])
+            area = ('cwa', prms['county_warning_area'])
         if 'climate_division' in prms.keys():
-            sh = AcisWS.find_geojson_of_area('climdiv', prms['climate_division'])
+            area = ('climdiv', prms['climate_division'])
         if 'county' in prms.keys():
-            sh = AcisWS.find_geojson_of_area('county', prms['county'])
+            area = ('county', prms['county'])
         if 'bounding_box' not in prms.keys() and not 'state' in prms.keys():
-            poly = [(s[0],s[1]) for s in sh]
-            PointIn = getattr(thismodule,'point_in_poly')
+            if area is not None:
+                #All parts and holes of the area boundary
+                poly = WRCCClasses.PreparedPolygon(AcisWS.find_geojson_polygons_of_area(area[0], area[1]))
+                PointIn = getattr(thismodule,'point_in_prepared_poly')
+            else:
+                poly = [(s[0],s[1]) for s in sh]
+                PointIn = getattr(thismodule,'point_in_poly')
     return poly, PointIn
 
 def check_for_int(string):
@@ -4362,6 +4661,23 @@ def load_data_to_json_file(path_to_file, data):
         pass
     '''
 
+def load_data_to_gzip_json_file(path_to_file, data):
+    '''
+    Writes data to gzip compressed json file,
+    the web server can hand it out as is with Content-Encoding: gzip
+    '''
+    with gzip.open(path_to_file, 'wb') as f:
+        json.dump(data, f, separators=(',',':'))
+
+def load_json_data_from_gzip_file(path_to_json_file):
+    json_data = None
+    try:
+        with gzip.open(path_to_json_file, 'rb') as json_f:
+            json_data = json.loads(json_f.read())
+    except:
+        pass
+    return json_data
+
 def load_json_data_from_file(path_to_json_file):
     json_data = None
     try:
@@ -4558,6 +4874,150 @@ def strip_data(val):
             strp_val = v
     return strp_val, flag
 
+#Flags of decoded ACIS values, the flag character as uint8
+FLAG_NONE = ord(' ')
+FLAG_MISSING = ord('M')
+FLAG_TRACE = ord('T')
+FLAG_SUBSEQUENT = ord('S')
+FLAG_ACCUMULATED = ord('A')
+
+def decode_acis_values(vals, add=None, decimals=False):
+    '''
+    Bulk version of strip_data followed by float().
+    Decodes a list of ACIS data values in one pass.
+    Args:
+        vals: list of ACIS values ('0.52', 'M', 'T', '1.10A', 75, ...)
+              or of lists [value, add1, add2, ...] if the request
+              asked for additional info (ACIS 'add' parameter)
+        add:  the ACIS 'add' parameter of the request, e.g. 'f,t'.
+              The flag of list values is taken from the 'f' entry
+              if the value itself carries none, obs times from the 't' entry.
+        decimals: if True, also return the decimals of the value strings
+    Returns:
+        values -- float64 array, NaN where float(strip_data(val)[0]) fails
+                  (M gives -9999.0, T and S give 0.0 like in strip_data)
+        flags  -- uint8 array of the flag characters (FLAG_NONE, FLAG_MISSING, ...)
+        If add contains 't', obs_times -- int array, -1 where there is no obs time
+        If decimals, decimals -- int array of the number of digits after the decimal
+                    point of the value strings, -1 where there is no decimal point
+    '''
+    add_list = [a.strip() for a in add.split(',')] if isinstance(add, basestring) else list(add or [])
+    n = len(vals)
+    list_flags = None;obs_times = None
+    if n and isinstance(vals[0], (list, tuple)):
+        if 'f' in add_list:
+            f_idx = add_list.index('f') + 1
+            list_flags = [str(v[f_idx])[0:1] if len(v) > f_idx else '' for v in vals]
+        if 't' in add_list:
+            t_idx = add_list.index('t') + 1
+            obs_times = np.array([v[t_idx] if len(v) > t_idx and check_for_int(v[t_idx]) else -1 \
+                for v in vals], dtype=int)
+        vals = [v[0] if isinstance(v, (list, tuple)) and v else '' for v in vals]
+    if set(map(type, vals)) == set([str]):
+        strs = np.array(vals, dtype=str)
+    else:
+        strs = np.array([v if isinstance(v, str) else str(v) for v in vals], dtype=str)
+    if strs.dtype.itemsize == 0 or not n:
+        strs = strs.astype('S1')
+    chars = strs.view(np.uint8).reshape(n, strs.dtype.itemsize)
+    lengths = (chars != 0).sum(axis=1)
+    rows = np.arange(n)
+    last = np.where(lengths > 0, chars[rows, np.maximum(lengths - 1, 0)], 0)
+    last_is_digit = (last >= ord('0')) & (last <= ord('9'))
+    #Length without leading minus sign
+    minus = chars[:,0] == ord('-')
+    pos_lengths = lengths - minus
+    single = pos_lengths == 1
+    flags = np.full(n, FLAG_NONE, dtype=np.uint8)
+    values = np.full(n, np.nan)
+    #Values of more than one character with trailing flag
+    trailing = (pos_lengths > 1) & ~last_is_digit
+    flags[trailing] = last[trailing]
+    chars = chars.copy()
+    chars[rows[trailing], lengths[trailing] - 1] = 0
+    numeric = (pos_lengths > 1) | (single & last_is_digit)
+    values[numeric] = parse_decimals(chars[numeric], minus[numeric], strs.dtype)
+    if decimals:
+        dots = chars == ord('.')
+        value_decimals = np.where(numeric & dots.any(axis=1), \
+            lengths - trailing - dots.argmax(axis=1) - 1, -1)
+    #Single flag characters
+    single_flag = single & ~last_is_digit & np.in1d(last, [FLAG_MISSING, FLAG_TRACE, FLAG_SUBSEQUENT, FLAG_ACCUMULATED, FLAG_NONE])
+    flags[single_flag] = last[single_flag]
+    values[single_flag & ((last == FLAG_TRACE) | (last == FLAG_SUBSEQUENT))] = 0.0
+    values[single_flag & (last == FLAG_MISSING)] = -9999.0
+    if list_flags is not None:
+        list_flag_codes = np.array([ord(f) if f else FLAG_NONE for f in list_flags], dtype=np.uint8)
+        no_flag = flags == FLAG_NONE
+        flags[no_flag] = list_flag_codes[no_flag]
+    out = (values, flags)
+    if obs_times is not None:
+        out+=(obs_times,)
+    if decimals:
+        out+=(value_decimals,)
+    return out
+
+def parse_decimals(chars, minus, str_dtype):
+    '''
+    float() of the strings given as rows of the uint8 array chars.
+    Plain decimals ([-]digits[.digits]) are parsed with array arithmetic,
+    which gives the same correctly rounded result as float().
+    Other strings are converted one by one, NaN if float() fails.
+    '''
+    values = np.full(chars.shape[0], np.nan)
+    if not chars.shape[0]:
+        return values
+    digits = (chars >= ord('0')) & (chars <= ord('9'))
+    dots = chars == ord('.')
+    signs = np.zeros(chars.shape, dtype=bool)
+    signs[:,0] = minus
+    plain = ((digits | dots | signs | (chars == 0)).all(axis=1)) & (dots.sum(axis=1) <= 1) & \
+        digits.any(axis=1) & (digits.sum(axis=1) <= 15)
+    mantissa = np.zeros(chars.shape[0])
+    for j in range(chars.shape[1]):
+        mantissa = np.where(digits[:,j], mantissa * 10 + (chars[:,j].astype(float) - ord('0')), mantissa)
+    frac_digits = (digits & (np.cumsum(dots, axis=1) > 0)).sum(axis=1)
+    values[plain] = np.where(minus[plain], -1.0, 1.0) * mantissa[plain] / 10.0**frac_digits[plain]
+    for idx in np.flatnonzero(~plain).tolist():
+        try:
+            values[idx] = float(chars[idx].view(str_dtype)[0])
+        except ValueError:
+            pass
+    return values
+
+def encode_acis_values(values, flags=None, decimals=None):
+    '''
+    Reverse of decode_acis_values:
+    Returns list of ACIS value strings of the values and flags.
+    M, T and S flags replace the values they stand for
+    (-9999 or NaN, 0.0), other flags are appended,
+    NaN values without flag become empty strings.
+    If decimals is given, values are written with that many decimals
+    like ACIS does ('0.00', '75'), else in their shortest form.
+    '''
+    values = np.asarray(values, dtype=float)
+    if flags is None:
+        flags = np.full(values.shape, FLAG_NONE, dtype=np.uint8)
+    encoded = []
+    for v, f in zip(values.tolist(), np.asarray(flags, dtype=np.uint8).tolist()):
+        #Flags that stand for the value
+        if (f == FLAG_MISSING and (v != v or v == -9999)) or \
+            (f in [FLAG_TRACE, FLAG_SUBSEQUENT] and v == 0):
+            encoded.append(chr(f))
+            continue
+        if v != v:
+            val_str = ''
+        elif decimals is not None:
+            val_str = '%.*f' % (decimals, v)
+        elif v == int(v) and abs(v) < 1e15:
+            val_str = str(int(v))
+        else:
+            val_str = repr(v)
+        if f != FLAG_NONE:
+            val_str+=chr(f)
+        encoded.append(val_str)
+    return encoded
+
 def show_flag_on_val(val, flag):
     '''
     Add flags to data vals:
@@ -4953,7 +5413,32 @@ def bcof(n, normlz=True):
         C = ['%.6f' % (c/float(S)) for c in C ]
     return C
 
-def pctil(app_name, data, number, npctil):
+def pctil_sort(data, number):
+    '''
+    Sorts data[0], ..., data[number - 1] in ascending order for pctil.
+    Gives the same sort as the selection sort pctil used to do:
+    NaN and values above 100000000.0 are never selected, their slots at the
+    end of the sort hold the largest value + 1 if that is at most 100000000.0
+    and some value was selected, else 100000000.0.
+    Equal values are selected last first.
+    '''
+    xmax = -100000000.0
+    dummy = [data[i] for i in range(number)]
+    for i in range(number):
+        try:
+            xmax = max(xmax,dummy[i])
+        except:
+            pass
+    #Sorting is stable, reverse so that equal values come last first
+    sort = sorted([val for val in reversed(dummy) if val <= 100000000.0])
+    if len(sort) < number:
+        if sort and xmax + 1 <= 100000000.0:
+            sort+=[xmax + 1 for i in range(number - len(sort))]
+        else:
+            sort+=[100000000.0 for i in range(number - len(sort))]
+    return sort
+
+def pctil(app_name, data, number, npctil, sort=None):
     '''
     Routine to compute percentiles, needed for Sodpct
 
@@ -4962,28 +5447,12 @@ def pctil(app_name, data, number, npctil):
     data     -- data array
     number   -- number of data variables
     npctil   -- number of percentiles
+    sort     -- data sorted by pctil_sort, sorted here if not given.
+                Pass it when computing several percentile sets of the same data
     '''
-    xmax = -100000000.0
-    dummy = [data[i] for i in range(number)]
-    sort = [0.0 for i in range(number)]
+    if sort is None:
+        sort = pctil_sort(data, number)
     pctile = [0.0 for i in range(npctil-1)]
-    for i in range(number):
-        try:
-            xmax = max(xmax,dummy[i])
-        except:
-            pass
-    for islow in range(number):
-        xmin = 100000000.0
-        # For each variable of sort, find lowest of the vaues
-        iskip = None
-        for ifast in range(number):
-            if dummy[ifast] <= xmin:
-                xmin = dummy[ifast]
-                iskip = ifast
-
-        sort[islow] = xmin
-        if iskip is not None:
-            dummy[iskip] = xmax + 1
     #Find the median:
     if number % 2  == 0:
         xmed = (sort[number/2 - 1 ] + sort[(number/2)]) / 2
@@ -5940,28 +6409,570 @@ def Gampctle(pcentile, beta, alpha):
     return x
 
 def Cagamma(rdata, numdat, pnlist, numpn):
-    cen_level = 0.004
-    #Initialize counters
-    sumx = 0.0
-    sumlnx = 0.0
-    num_cen = 0
-    num_wet = 0
-
-    for i in range(numdat):
-        if rdata[i] > cen_level:
-            sumx+=rdata[i]
-            sumlnx+= np.log(rdata[i])
-            num_wet+=1
+    '''
+    Censored gamma values of the numpn probabilities pnlist
+    for the numdat values rdata, values up to 0.004 are censored.
+    Fitted by the batched routines (gamma_quantiles)
+    '''
+    return gamma_quantiles([[rdata[i] for i in range(numdat)]], pnlist[0:numpn])[0].tolist()
+
+#####################################
+#Batched frequency analysis routines
+#####################################
+#Array versions of the routines above, fitting many data series
+#and evaluating all probabilities at once.
+#Series are packed into float arrays [series][value], padded with NaN
+
+_stat_tables = None
+_stat_tables_lock = threading.Lock()
+
+def get_stat_tables():
+    '''
+    Returns the statistical tables (Pearson III, areal parameters)
+    of settings.LIB_PREFIX, compiled to settings.STAT_TABLES_FILE.
+    settings.STAT_TABLES_FILE = None keeps the compiled tables in memory only
+    '''
+    global _stat_tables
+    with _stat_tables_lock:
+        if _stat_tables is None:
+            settings = AcisWS.settings
+            _stat_tables = WRCCClasses.StatTables(settings.LIB_PREFIX,
+                getattr(settings, 'STAT_TABLES_FILE', settings.TEMP_DIR + 'stat_tables.npy'))
+            #Compile or map the tables while holding the lock
+            _stat_tables.record()
+    return _stat_tables
+
+def fa_series_array(series_list, sort=False):
+    '''
+    Packs the data series of series_list into a float array
+    data[series][value], padded with NaN.
+    If sort is True, the values of each series are sorted in ascending order.
+    Returns data and the array of series lengths
+    '''
+    counts = np.array([len(series) for series in series_list], dtype=int)
+    data = np.full((len(series_list), max(counts.tolist() + [1])), np.nan)
+    for idx, series in enumerate(series_list):
+        data[idx, 0:counts[idx]] = sorted(series) if sort else list(series)
+    return data, counts
+
+def piii_table_array(piii):
+    '''
+    Pearson III table piii[skew] = [values of the probabilities in piiili]
+    of skews -90 to 90 as int array [skew + 90][probability]
+    '''
+    return np.array([piii[skew] for skew in range(-90, 91)])
+
+def pintp3_array(prnoex, skews, piii_table, piiili):
+    '''
+    Pintp3 for all non-exceedance probabilities prnoex and skews at once.
+
+    Keyword arguments:
+    prnoex     -- list of probabilities of non-exceedance
+    skews      -- list of skewnesses
+    piii_table -- Pearson III table as returned by piii_table_array
+    piiili     -- list of probabilities in the table
+
+    Output:
+    psdout -- array [skew][probability] of the probabilities of non-exceedance
+              expressed in standard deviations
+    '''
+    piiili = np.asarray(piiili, dtype=float)
+    prnoex = np.asarray(prnoex, dtype=float)[None, :]
+    skews = np.clip(np.asarray(skews, dtype=float), -9.0, 9.0)[:, None]
+    nsklo = np.array([max(int(round(10.0*skew)), -90) for skew in skews[:, 0].tolist()], dtype=int)
+    nskhi = np.minimum(nsklo + 1, 90)
+    #Table columns enclosing the probabilities
+    iretrn = np.searchsorted(piiili, prnoex[0], side='right')
+    npnohi = np.where(iretrn == len(piiili), len(piiili) - 1, iretrn)
+    npnolo = np.where(iretrn == 0, 0, npnohi - 1)
+    pnoxlo = (piiili[npnolo] - np.where(iretrn == 0, 0.00001, 0.0))[None, :]
+    pnoxhi = piiili[npnohi][None, :]
+    y1 = piii_table[nsklo + 90][:, npnolo] / 1000.0
+    y2 = piii_table[nskhi + 90][:, npnolo] / 1000.0
+    y3 = piii_table[nskhi + 90][:, npnohi] / 1000.0
+    y4 = piii_table[nsklo + 90][:, npnohi] / 1000.0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t = np.where(abs(pnoxhi - pnoxlo) > 0.000001, (prnoex - pnoxlo) / (pnoxhi - pnoxlo), 0.0)
+    u = (10.0 * skews - nsklo[:, None]) / 1.0
+    a1 = u * (y2 - y1) + y1
+    a2 = u * (y3 - y4) + y4
+    return t * (a2 - a1) + a1
+
+def capiii_array(data, counts, piii_table, piiili, pnlist):
+    '''
+    Capiii of all series of data[series][value] at once.
+    counts is the number of values of each series,
+    values below -9998 are missing.
+    Returns arrays psd[series][probability], ave, stdev, sk, cv, xmax, xmin
+    '''
+    with np.errstate(invalid='ignore', divide='ignore'):
+        valid = (np.arange(data.shape[1])[None, :] < counts[:, None]) & (data >= -9998.0)
+        vals = np.where(valid, data, 0.0)
+        count = valid.sum(axis=1).astype(float)
+        summ = vals.sum(axis=1)
+        summ2 = (vals*vals).sum(axis=1)
+        summ3 = (vals*vals*vals).sum(axis=1)
+        xmax = np.maximum(np.where(valid, data, -np.inf).max(axis=1), -9999.0)
+        xmin = np.minimum(np.where(valid, data, np.inf).min(axis=1), 9999.0)
+        ave = np.where(count > 0.5, summ / count, 0.0)
+        stdev = np.where(count > 1.5, np.sqrt((summ2 - summ*summ/count)/(count - 1.0)), 0.0)
+        cv = np.where(abs(ave) > 0.00001, stdev / ave, 0.0)
+        h1 = summ / count
+        h2 = summ2 / count
+        h3 = summ3 / count
+        xm2 = h2 - h1*h1
+        xm3 = h3 - 3.0*h1*h2 + 2.0*h1*h1*h1
+        sk = np.where((count > 1.5) & (abs(xm2) > 0.000001), xm3 / (xm2*np.sqrt(xm2)), 0.0)
+    psd = pintp3_array(pnlist, sk, piii_table, piiili)
+    return psd, ave, stdev, sk, cv, xmax, xmin
+
+def samlmr_array(x_sorted, counts, nmom, a, b):
+    '''
+    Samlmr of all series of x_sorted[series][value] at once,
+    values of each series in ascending order.
+    The probability weighted moments are sums of the data
+    with the vector of weights of the sorted positions.
+    Returns array xmom[series][moment]
+    '''
+    n = counts.astype(float)[:, None]
+    pos = np.arange(1, x_sorted.shape[1] + 1, dtype=float)[None, :]
+    x = np.where(pos <= n, x_sorted, 0.0)
+    summ = [x.sum(axis=1)]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if a != 0 or b != 0:
+            #Plotting-Position estimates of PWM's
+            ppos = (pos + a) / (n + b)
+            term = x
+            for j in range(1, nmom):
+                term = term*ppos
+                summ.append(term.sum(axis=1))
+            summ = [s / n[:, 0] for s in summ]
         else:
-            num_cen+=1
-    #Calculate parameters
-    shape = -999
-    scale = -999
-    shape, scale, nocon = Cengam(num_cen, num_wet, cen_level, sumx, sumlnx)
-    #Calculate values
-    for i in range(numpn):
-        psd[i] = Gampctle(pnlist[i], scale, shape)
-    return psd
+            #Unbiased estimates of pwm's
+            term = x;z = pos;y = n[:, 0];dz = n[:, 0]
+            summ[0] = summ[0] / dz
+            for j in range(1, nmom):
+                z = z - 1
+                term = term*z
+                y = y - 1
+                dz = dz*y
+                summ.append(term.sum(axis=1) / dz)
+        #L-Moments
+        k = nmom
+        p0 = 1
+        if nmom - nmom / 2 * 2 == p0:p0 = -1
+        for kk in range(1,nmom):
+            ak = k
+            p0 = -p0
+            p =  p0
+            temp = p * summ[0]
+            for i in range(k-1):
+                ai = i+1
+                p = -p*(ak+ai-1) * (ak - ai) / (ai**2)
+                temp = temp + p*summ[i+1]
+            summ[k-1] = temp
+            k-=1
+        xmom = [summ[0], summ[1]]
+        for k in range(2, nmom):
+            xmom.append(np.where(abs(summ[1]) > 0.001, summ[k] / summ[1], 0.0))
+    return np.array(xmom).T
+
+def dlgama_array(x):
+    '''
+    Dlgama of all values of the array x
+    '''
+    c = [0.91893, 0.83333, -0.27777, 0.79365, \
+        -0.59523, 0.84175, -0.19175, 0.64102]
+    s1 = -0.57721 #Euler constant
+    s2 = 0.82246  #pi**2/12
+    x = np.asarray(x, dtype=float)
+    dlgama = np.zeros(x.shape)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        near2 = abs(x - 2) <= 1.0e-7
+        near1 = ~near2 & (abs(x - 1) <= 1.0e-7)
+        near0 = ~near2 & ~near1 & (abs(x) <= 1.0e-7)
+        rest = ~(near2 | near1 | near0)
+        xx = x - 2
+        dlgama[near2] = (np.log(x - 1) + xx*(s1+xx*s2))[near2]
+        xx = x - 1
+        dlgama[near1] = (xx*(s1+xx*s2))[near1]
+        dlgama[near0] = (-np.log(x) + s1*x)[near0]
+        #Reduce to dlgama(x+n) where x+n >= 13
+        y = x.copy()
+        z = np.ones(x.shape)
+        small = rest & (y < 13)
+        reduce = small.copy()
+        while reduce.any():
+            z = np.where(reduce, z*y, z)
+            y = np.where(reduce, y + 1, y)
+            reduce = reduce & (y < 13)
+        sum1 = np.where(small, -np.log(z), 0.0)
+        #Use asymtotic expansion if y >=13
+        sum1 = sum1 + ((y - 0.5)* np.log(y) -y +c[0])
+        z = 1 / y*y
+        sum2 = np.where(y < 1.0e9, ((((((c[7]*z + c[6])*z + c[5])*z + c[4])*z + c[3])*z + c[2])*z +c[1]) / y, 0.0)
+        dlgama[rest] = (sum1 + sum2)[rest]
+    return dlgama
+
+def pelgev_array(xmom):
+    '''
+    Pelgev of all L-moments xmom[series][moment] at once.
+    Returns array para[series] = [location, scale, shape],
+    -9999 for series with invalid L-moments
+    '''
+    eu = 0.57721566
+    dl2 = 0.69314718
+    dl3 = 1.0986123
+    z0 = 0.63092975
+    c = [7.817740,2.930462,13.641492,17.206675]
+    maxit = 20
+    xmom = np.asarray(xmom, dtype=float)
+    t3 = xmom[:, 2]
+    para = np.full((xmom.shape[0], 3), -9999.0)
+    with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+        ok = ~((xmom[:, 1] <= 0) | (abs(t3) > 1))
+        #Initial estimate of k
+        z = 2 /(t3 + 3) - z0
+        g = z*(c[0] + z*(c[1] + z*(c[2] + z*c[3])))
+        #Newton-Raphson, if required
+        newton = ok & ((t3 < - 0.1) | (t3 > 0.5))
+        g = np.where(newton & (t3 < -0.9), 1 - np.log(1 + t3) / dl2, g)
+        t0 = (t3 + 3) / 2
+        for it in range(1, maxit+1):
+            if not newton.any():
+                break
+            x2 = 2.0**(-g)
+            x3 = 3.0**(-g)
+            xx2 = 1 - x2
+            xx3 = 1 - x3
+            t = xx3 / xx2
+            deri = (xx2*x3*dl3 - xx3*x2*dl2) / (xx2*xx2)
+            gold = g
+            g = np.where(newton, g - (t -t0) / deri, g)
+            newton = newton & ~((abs(g - gold) < 1.0e-6) | ((g > 1) & (abs(g - gold) <= 1.0e-6*g)))
+        gam = np.exp(dlgama_array(1+g))
+        scale = np.where(abs(g) >= 1.0e-5, xmom[:, 1]*g / (gam*(1 - 2.0**(-g))), xmom[:, 1] / dl2)
+        loc = np.where(abs(g) >= 1.0e-5, xmom[:, 0] - scale*(1 - gam) / g, xmom[:, 0] - eu * scale)
+    para[ok, 0] = loc[ok]
+    para[ok, 1] = scale[ok]
+    para[ok, 2] = np.where(abs(g) >= 1.0e-5, g, 0.0)[ok]
+    return para
+
+def quagev_array(probs, para):
+    '''
+    Quagev of all probabilities probs and GEV parameters para[series] at once.
+    Returns array of quantiles [series][probability]
+    '''
+    f = np.asarray(probs, dtype=float)[None, :]
+    para = np.asarray(para, dtype=float)
+    u = para[:, 0:1];a = para[:, 1:2];g = para[:, 2:3]
+    with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+        inside = (f > 0) & (f < 1)
+        y = -np.log(np.where(inside, f, 0.5))
+        y = 1.0 - np.exp(-g*y) / g
+        quagev = np.where(g != 0, u + a*y, 0.0)
+        edge = ((f == 0) & (g < 0)) | ((f == 1) & (g > 0))
+        quagev = np.where(inside, quagev, np.where(edge, u + a / g, 0.0))
+    return np.where(a > 0, quagev, 0.0)
+
+def gev_quantiles(series_list, probs):
+    '''
+    GEV quantiles [series][probability] of all series of series_list,
+    parameters from the L-moments of the series (Gev)
+    '''
+    x_sorted, counts = fa_series_array(series_list, sort=True)
+    xmom = samlmr_array(x_sorted, counts, 3, -0.35, 0)
+    return quagev_array(probs, pelgev_array(xmom))
+
+def betap_terms(theta, beta, x, valid):
+    '''
+    x/beta, its log, the mask of values the beta-P
+    routines compute regularly ((x/beta)**theta does not overflow) and (x/beta)**theta
+    of the values x[series][value], parameters are arrays [series].
+    Values outside the mask valid are set to beta
+    '''
+    theta = theta[:, None];beta = beta[:, None]
+    xb = np.where(valid, x, beta)/beta
+    lxb = np.log(xb)
+    regular = lxb <= 85.0/theta
+    xbt = np.where(regular, xb, 1.0)**theta
+    return xb, lxb, regular, xbt
+
+def betap_sum(valid, regular, terms, large_terms):
+    '''
+    Sums over the valid values of each series of the terms of the
+    beta-P routines, large_terms where (x/beta)**theta would overflow
+    '''
+    return np.where(valid, np.where(regular, terms, large_terms), 0.0).sum(axis=1)
+
+def dda_array(alpha, theta, beta, x, valid):
+    xb, lxb, regular, xbt = betap_terms(theta, beta, x, valid)
+    return valid.sum(axis=1)/alpha - betap_sum(valid, regular, np.log(1.0 + xbt), theta[:, None]*lxb)
+
+def ddt_array(alpha, theta, beta, x, valid):
+    xb, lxb, regular, xbt = betap_terms(theta, beta, x, valid)
+    a = alpha[:, None]
+    return valid.sum(axis=1)/beta + betap_sum(valid, regular, lxb - (a + 1.0)*(lxb/(1.0 + xbt))*xbt, -a*lxb)
+
+def ddb_array(alpha, theta, beta, x, valid):
+    xb, lxb, regular, xbt = betap_terms(theta, beta, x, valid)
+    a = alpha[:, None]
+    ddb = -valid.sum(axis=1) + betap_sum(valid, regular, (a + 1.0)*(xbt/(1.0 + xbt)), a + 1)
+    return theta*ddb/beta
+
+def betapll_array(alpha, theta, beta, x, valid):
+    xb, lxb, regular, xbt = betap_terms(theta, beta, x, valid)
+    a = alpha[:, None];t = theta[:, None]
+    return valid.sum(axis=1)*np.log(alpha*theta/beta) + \
+        betap_sum(valid, regular, (t - 1.0)*lxb - (a + 1.0)*np.log(1+xbt), -(1.0 + a*t)*lxb)
+
+def inv_array(matrices):
+    '''
+    Inverses of the stack of matrices [series][i][j],
+    NaN for the singular ones
+    '''
+    try:
+        return np.linalg.inv(matrices)
+    except np.linalg.LinAlgError:
+        inverses = np.full(matrices.shape, np.nan)
+        for idx, matrix in enumerate(matrices):
+            try:
+                inverses[idx] = np.linalg.inv(matrix)
+            except np.linalg.LinAlgError:
+                pass
+        return inverses
+
+def fitbetap_array(x, counts):
+    '''
+    Fitbetap of all series of x[series][value] at once,
+    the values of each series sorted in ascending order.
+    counts is the number of values of each series.
+    The iterations run for all series together,
+    each series stops when its estimates converged.
+    Returns arrays alpha, theta, beta, rll, itact
+    '''
+    x = np.asarray(x, dtype=float)
+    counts = np.asarray(counts, dtype=int)
+    num = x.shape[0]
+    rows = np.arange(num)
+    valid = np.arange(x.shape[1])[None, :] < counts[:, None]
+    itmax = 2000
+    epsilon = 0.0005
+    efd = 0.00001
+    pinit = [.1, .2, .5, 1.0, 2.0, 5.0, 10.0, 20.0, 50.0, 100.0, 200.0, 500.0, 1000.0]
+    trllbst = -1.0e20
+    with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+        tbeta = 1.01*x[:, 0]
+        ig = np.array([int(round(0.8*float(n+1))) for n in counts.tolist()], dtype=int)
+        factor = -np.log(1.0 - 0.8)/np.log(x[rows, ig-1]/tbeta)
+        alpha0 = np.zeros(num);beta0 = np.zeros(num);theta0 = np.zeros(num)
+        chosen = np.zeros(num, dtype=bool)
+        for ith in range(13):
+            tthet = np.full(num, pinit[ith]*100.0)
+            talph = factor / tthet
+            test = betapll_array(talph, tthet, tbeta, x, valid)
+            new = ~chosen & (test > trllbst)
+            alpha0 = np.where(new, talph, alpha0)
+            beta0 = np.where(new, tbeta, beta0)
+            theta0 = np.where(new, tthet, theta0)
+            chosen|= new
+        #Begin iterations
+        rll0 = betapll_array(alpha0, theta0, beta0, x, valid)
+        bestll = rll0.copy()
+        besta = alpha0.copy();bestb = beta0.copy();bestt = theta0.copy()
+        dlambda = np.full(num, 0.001)
+        adj = np.zeros((3, num))
+        itact = np.zeros(num, dtype=int)
+        #Series still iterating
+        active = np.ones(num, dtype=bool)
+        for it in range(itmax):
+            if not active.any():
+                break
+            itact[active] = it
+            ea = efd*alpha0
+            et = efd*theta0
+            eb = efd*beta0
+            score = [dda_array(alpha0, theta0, beta0, x, valid), ddt_array(alpha0, theta0, beta0, x, valid), \
+                ddb_array(alpha0, theta0, beta0, x, valid)]
+            finf = np.zeros((num, 3, 3))
+            finf[:, 0, 0] = (dda_array(alpha0 + ea, theta0, beta0, x, valid) - dda_array(alpha0-ea, theta0, beta0, x, valid))/2.0*ea
+            finf[:, 1, 1] = (ddt_array(alpha0, theta0 + et, beta0, x, valid) - ddt_array(alpha0, theta0 -et, beta0, x, valid))/2.0*et
+            finf[:, 2, 2] = (ddb_array(alpha0, theta0, beta0 + eb, x, valid) - ddb_array(alpha0, theta0, beta0 - eb, x, valid))/2.0*eb
+            #Fitbetap's mixed derivatives are differences of equal terms
+            finf[:, 0, 1] = (ddt_array(alpha0 + ea, theta0, beta0, x, valid) - ddt_array(alpha0-ea, theta0, beta0, x, valid))/4.0*ea
+            finf[:, 1, 0] = finf[:, 0, 1]
+            for i in range(3):
+                finf[:, i, i]*=(1.0 + dlambda)
+            finv = np.full((num, 3, 3), np.nan)
+            finv[active] = inv_array(finf[active])
+            for i in range(3):
+                for j in range(3):
+                    adj[j] = np.where(active, adj[i] + finv[:, i, j]*score[j], adj[j])
+            alpha = abs(alpha0 - adj[0])
+            alpha = np.where(alpha/alpha0 > 1.1, 1.1*alpha0, alpha)
+            alpha = np.where(alpha/alpha0 < 0.9, 0.9*alpha0, alpha)
+            beta = abs(beta0 - adj[2])
+            beta = np.where(beta/beta0 > 1.1, 1.1*beta0, beta)
+            beta = np.where(beta/beta0 < 0.9, 0.9*beta0, beta)
+            theta = abs(theta0 - adj[1])
+            theta = np.where(theta/theta0 > 1.1, 1.1*theta0, theta)
+            theta = np.where(theta/theta0 < 0.9, 0.9*theta0, theta)
+            #Try to ensure that this is an improvement
+            iflag = np.zeros(num, dtype=bool)
+            backing = active.copy()
+            for iback in range(4):
+                rll = betapll_array(alpha, theta, beta, x, valid)
+                better = backing & (rll > bestll)
+                bestll = np.where(better, rll, bestll)
+                besta = np.where(better, alpha, besta)
+                bestb = np.where(better, beta, bestb)
+                bestt = np.where(better, theta, bestt)
+                worse = backing & (rll < rll0)
+                iflag|= worse
+                alpha = np.where(worse, (alpha + alpha0)/2, alpha)
+                beta = np.where(worse, (beta + beta0)/2, beta)
+                theta = np.where(worse, (theta + theta0)/2, theta)
+                dlambda = np.where(worse, dlambda*2, dlambda)
+                done = backing & ~worse & ~iflag
+                dlambda = np.where(done, dlambda/2, dlambda)
+                backing&= ~done
+            #Test for convergence if no backing off the parameter estimates
+            #was necessary
+            moved = (abs((alpha -alpha0)/alpha0) >= epsilon) | \
+                (abs((beta -beta0)/beta0) >= epsilon) | \
+                (abs((theta -theta0)/theta0) >= epsilon)
+            moving = active & ~iflag & moved
+            alpha0 = np.where(moving, alpha, alpha0)
+            theta0 = np.where(moving, theta, theta0)
+            beta0 = np.where(moving, beta, beta0)
+            active&= ~(~iflag & ~moved)
+    return besta, bestt, bestb, bestll, itact
+
+def pintbetap_array(alpha, beta, theta, probs):
+    '''
+    Pintbetap of all probabilities probs and parameters
+    of the series at once.
+    Returns array psd[series][probability]
+    '''
+    prob = np.asarray(probs, dtype=float)[None, :]
+    alpha = np.asarray(alpha, dtype=float)[:, None]
+    beta = np.asarray(beta, dtype=float)[:, None]
+    theta = np.asarray(theta, dtype=float)[:, None]
+    with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+        regular = -1.0*np.log(1.0 - prob) < 31.0*alpha*np.log(2.0)
+        psd = beta*((((1.0 - prob)**(-1.0/alpha)) - 1.0)**(1.0/theta))
+        psd_large = beta*((1.0 - prob)**(-1.0/(alpha*theta)))
+    return np.where(regular, psd, psd_large)
+
+def betap_quantiles(series_list, probs):
+    '''
+    Beta-P quantiles [series][probability] of all series of series_list (Cabetap)
+    '''
+    x_sorted, counts = fa_series_array(series_list, sort=True)
+    alpha, theta, beta, rll, itact = fitbetap_array(x_sorted, counts)
+    return pintbetap_array(alpha, beta, theta, probs)
+
+def cengam_censored(nc, c, shape, scale):
+    '''
+    Censored part nc*log(Gammp(shape, c/scale)) of the
+    log likelihood of the arrays of series, 0 where nc is 0
+    '''
+    return np.where(nc > 0, nc*np.log(scipy.special.gammainc(shape, c/scale)), 0.0)
+
+def cengam_loglike(nc, nw, c, sumx, sumlnx, shape, scale):
+    '''
+    Rloglike of the arrays of series: log likelihood of the gamma distribution
+    of nw values with sums sumx and sumlnx and of nc values censored below c
+    '''
+    rloglike = -nw*(shape*np.log(scale) + scipy.special.gammaln(shape)) + (shape - 1.0)*sumlnx - sumx/scale
+    return rloglike + cengam_censored(nc, c, shape, scale)
+
+def cengam_array(nc, nw, c, sumx, sumlnx):
+    '''
+    Cengam of all series at once: maximum likelihood estimates of the
+    gamma distribution of nw values with sums sumx and sumlnx and of
+    nc values censored below c, arrays [series].
+    The uncensored part of the derivatives of the log likelihood is
+    analytic, the censored part nc*log(Gammp(shape, c/scale))
+    is differentiated numerically.
+    Returns arrays shape, scale, nocon (1 where the iterations did not converge)
+    '''
+    itmax = 1000
+    epsilon = 0.001
+    #Relative step of the numerical derivatives
+    dp = 0.0001
+    nc = np.asarray(nc, dtype=float);nw = np.asarray(nw, dtype=float)
+    sumx = np.asarray(sumx, dtype=float);sumlnx = np.asarray(sumlnx, dtype=float)
+    with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+        #Initial parameter guesses
+        sx = np.where(nc == 0, sumx, sumx + nc*c/10.0)
+        slx = np.where(nc == 0, sumlnx, sumlnx + nc*np.log(c/10.0))
+        amean = sx/(nc + nw)
+        gmean = np.exp(slx/(nc + nw))
+        y = np.log(amean/gmean)
+        shape = np.where(y <= 0.5772, (.5000876+.1648852*y-.0544274*y**2)/y, \
+            (8.898919+9.05995*y+.9775373*y**2)/(y*(17.79728+11.968477*y+y**2)))
+        shape = np.where(y <= 0, np.sqrt(amean), shape)
+        shape = np.where(y > 17.0, 0.05, shape)
+        scale = amean/shape
+        nocon = np.ones(len(nc), dtype=int)
+        active = np.ones(len(nc), dtype=bool)
+        #Begin iterations
+        for it in range(itmax):
+            if not active.any():
+                break
+            oldll = cengam_loglike(nc, nw, c, sumx, sumlnx, shape, scale)
+            #Censored part of the score and information
+            da = dp*shape
+            db = dp*scale
+            cen0 = cengam_censored(nc, c, shape, scale)
+            cenap = cengam_censored(nc, c, shape + da, scale)
+            cenam = cengam_censored(nc, c, shape - da, scale)
+            cenbp = cengam_censored(nc, c, shape, scale + db)
+            cenbm = cengam_censored(nc, c, shape, scale - db)
+            cenab = cengam_censored(nc, c, shape + da, scale + db) - cengam_censored(nc, c, shape + da, scale - db) - \
+                cengam_censored(nc, c, shape - da, scale + db) + cengam_censored(nc, c, shape - da, scale - db)
+            dlda = sumlnx - nw*(np.log(scale) + scipy.special.digamma(shape)) + (cenap - cenam)/(2.0*da)
+            dldb = -shape*nw/scale + sumx/scale**2 + (cenbp - cenbm)/(2.0*db)
+            d2lda2 = -nw*scipy.special.polygamma(1, shape) + (cenap - 2.0*cen0 + cenam)/da**2
+            d2ldb2 = shape*nw/scale**2 - 2.0*sumx/scale**3 + (cenbp - 2.0*cen0 + cenbm)/db**2
+            d2ldab = -nw/scale + cenab/(4.0*da*db)
+            #Newton step with the inverse of the information matrix
+            det = d2lda2*d2ldb2 - d2ldab**2
+            shapen = np.maximum(shape - (d2ldb2*dlda - d2ldab*dldb)/det, 0.001)
+            scalen = np.maximum(scale - (d2lda2*dldb - d2ldab*dlda)/det, 0.001)
+            #Test whether this is an improvement, else back off
+            ki = np.zeros(len(nc), dtype=int)
+            for k in range(5):
+                worse = cengam_loglike(nc, nw, c, sumx, sumlnx, shapen, scalen) < oldll
+                ki+= worse
+                shapen = np.where(worse, (shape + shapen)/2.0, shapen)
+                scalen = np.where(worse, (scale + scalen)/2.0, scalen)
+            #Test for convergence
+            converged = (ki == 0) & (abs(shape - shapen) <= epsilon) & (abs(scale - scalen) <= epsilon)
+            shape = np.where(active, shapen, shape)
+            scale = np.where(active, scalen, scale)
+            nocon[active & converged] = 0
+            active&= ~converged
+    return shape, scale, nocon
+
+def gamma_quantiles(series_list, probs, cen_level=0.004):
+    '''
+    Censored gamma quantiles [series][probability] of all series of series_list (Cagamma),
+    values up to cen_level are censored
+    '''
+    data, counts = fa_series_array(series_list)
+    valid = np.arange(data.shape[1])[None, :] < counts[:, None]
+    wet = valid & (data > cen_level)
+    nw = wet.sum(axis=1)
+    nc = (valid & ~wet).sum(axis=1)
+    sumx = np.where(wet, data, 0.0).sum(axis=1)
+    sumlnx = np.where(wet, np.log(np.where(wet, data, 1.0)), 0.0).sum(axis=1)
+    shape, scale, nocon = cengam_array(nc, nw, cen_level, sumx, sumlnx)
+    #Gampctle: gamma variates of the probabilities, searched for between 0 and 100*scale
+    shape = shape[:, None];scale = scale[:, None]
+    with np.errstate(invalid='ignore'):
+        return np.minimum(scale*scipy.special.gammaincinv(shape, np.asarray(probs, dtype=float)[None, :]), 100.0*scale)
 
 def get_calc_from_single_station(req, calculation,variable):
     if 'data' not in req.keys(): return []
@@ -58,7 +58,6 @@ param_check_function = {
     'filter_type':'check_filter_type',
     'filter_days':'check_max_missing_days'
 }
-
 ########################################
 # PARAMETER CHECK FUNCTIONS
 ########################################
@@ -247,14 +246,27 @@ class Wrapper:
         self.variables  = [];self.station_ids = []
         self.station_names  = []
         self.station_states = []
+        self.error = None
 
     def get_data(self):
         #(self.data, self.dates, self.variables, self.station_ids, self.station_names) = \
         #AcisWS.get_sod_data(self.params, self.app_name)
         DJ = WRCCClasses.SODDataJob(self.app_name,self.params)
         #self.station_ids, self.station_names = DJ.get_station_ids_names()
-        data = DJ.get_data_station()
-        meta_dict = DJ.get_station_meta()
+        #All ACIS calls of the wrapper share one deadline and retry budget
+        #settings.ACIS_WRAPPER_DEADLINE = None: no deadline
+        deadline = getattr(AcisWS.settings, 'ACIS_WRAPPER_DEADLINE', None)
+        retries = getattr(AcisWS.settings, 'ACIS_WRAPPER_RETRIES', 4)
+        try:
+            with AcisWS.ACISDeadline(deadline, retries=retries, name=self.app_name):
+                data = DJ.get_data_station()
+                meta_dict = DJ.get_station_meta()
+        except AcisWS.ACISTimeoutError, e:
+            self.error = str(e)
+            return {}
+        if data.get('error') and not data.get('data'):
+            self.error = data['error']
+            return {}
         self.station_names = meta_dict['names']
         self.station_states = meta_dict['states']
         self.station_ids = meta_dict['ids']
@@ -375,7 +387,7 @@ def sodxtrmts_wrapper(argv, offline = False):
     #Get data
     data = SX_wrapper.get_data()
     if not data:
-        format_sodxtrmts_results_web([], [], {'error':'No data found!'}, {}, {}, '0000', '0000')
+        format_sodxtrmts_results_web([], [], {'error':SX_wrapper.error or 'No data found!'}, {}, {}, '0000', '0000')
         sys.exit(1)
     #Run app
     results= SX_wrapper.run_app(data)
@@ -433,7 +445,7 @@ def sodsum_wrapper(argv, offline = False):
     #Get data
     data = SS_wrapper.get_data()
     if not data:
-        format_sodsum_results_web({}, {}, {'error':'No data found!'},{})
+        format_sodsum_results_web({}, {}, {'error':SS_wrapper.error or 'No data found!'},{})
         sys.exit(1)
     #Run app
     results = SS_wrapper.run_app(data)
@@ -536,13 +548,13 @@ def sodsumm_wrapper(argv,offline=False):
     #Get data
     data = SS_wrapper.get_data()
     if not data:
-        format_results([],'',{'error':'No data found!'}, ss_wrapper)
+        format_results([],args['table_name'],{'error':SS_wrapper.error or 'No data found!'}, SS_wrapper)
         sys.exit(1)
     #Run app
     results = SS_wrapper.run_app(data)
     #Format results
     if not data or ('error' in data.keys() and data['error']) or not results:
-        format_results([],table_name, {'error': 'No Data found!'}, SS_wrapper)
+        format_results([],args['table_name'], {'error': 'No Data found!'}, SS_wrapper)
         #results = []
         if not offline:
             print_sodsumm_footer_web(app_params)
@@ -640,7 +652,7 @@ def soddyrec_wrapper(argv, offline=False):
     #Get data
     data = SR_wrapper.get_data()
     if not data:
-        format_results([],{},{'error':'No data found!'})
+        format_results([],{},{'error':SR_wrapper.error or 'No data found!'})
         sys.exit(1)
     #run app
     results = SR_wrapper.run_app(data)
@@ -710,7 +722,7 @@ def soddynorm_wrapper(argv, offline = False):
     #Get data
     data = SN_wrapper.get_data()
     if not data:
-        format_soddynorm_results_web([],{},{'error':'No data found!'})
+        format_soddynorm_results_web([],{},{'error':SN_wrapper.error or 'No data found!'})
         sys.exit(1)
     #run app
     results = SN_wrapper.run_app(data)
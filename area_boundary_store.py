@@ -0,0 +1,29 @@
+#!/usr/bin/python
+'''
+Script to refresh the local area boundary store
+Run weekly as cron job, e.g.
+0 4 * * 0 python /path/to/area_boundary_store.py
+Requests the boundaries of all US counties, climdivs, cwas and basins
+and the state bboxes from ACIS and replaces the store at
+settings.ACIS_BOUNDARY_STORE that AcisWS looks up
+special area geojson and bboxes in.
+'''
+import AcisWS
+
+try:
+    import my_acis.settings as settings
+except ImportError:
+    import my_acis_settings as settings
+
+store_path = getattr(settings, 'ACIS_BOUNDARY_STORE', settings.TEMP_DIR + 'area_boundaries.sqlite')
+
+def refresh_store(logger):
+    if not store_path:
+        return None
+    logger.info('Refreshing area boundary store %s' % store_path)
+    #The old store is kept if the refresh fails
+    num_areas = AcisWS.ACISBoundaryStore.build(store_path, logger=logger)
+    return 'Wrote %s areas' % str(num_areas)
+
+if __name__ == '__main__':
+    AcisWS.run_cron_job('area_boundary_store', refresh_store)
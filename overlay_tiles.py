@@ -0,0 +1,40 @@
+#!/usr/bin/python
+'''
+Script to pre-generate the map overlays of all states
+Run after area_boundary_store.py as cron job, e.g.
+0 5 * * 0 python /path/to/overlay_tiles.py
+Writes KML and GeoJSON overlays of the basins, climdivs,
+counties and cwas of each state at each simplification level,
+with gzipped copies, to settings.OVERLAY_DIR.
+Overlays that are newer than the area boundary store are kept,
+web requests serve stale overlays until they are rebuilt here.
+'''
+import AcisWS, WRCCUtils, WRCCData
+
+try:
+    import my_acis.settings as settings
+except ImportError:
+    import my_acis_settings as settings
+
+area_types = ['basin', 'climdiv', 'county', 'cwa']
+
+def generate_overlays(logger):
+    store = WRCCUtils.get_overlay_store()
+    if store is None:
+        return None
+    logger.info('Generating overlays in %s' % store.overlay_dir)
+    num_errors = 0
+    for state in sorted(set(WRCCData.STATE_CHOICES)):
+        for area_type in area_types:
+            if store.is_built(area_type, state.lower()):
+                continue
+            status = store.build(area_type, state.lower())
+            if status != 'Success':
+                logger.error('%s %s: %s' % (state, area_type, status))
+                num_errors+=1
+    if num_errors:
+        raise ValueError('%d overlays could not be generated' % num_errors)
+    return 'Generated overlays'
+
+if __name__ == '__main__':
+    AcisWS.run_cron_job('overlay_tiles', generate_overlays)
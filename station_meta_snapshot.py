@@ -0,0 +1,28 @@
+#!/usr/bin/python
+'''
+Script to refresh the local station metadata snapshot
+Run nightly as cron job, e.g.
+0 3 * * * python /path/to/station_meta_snapshot.py
+Requests the metadata of all US stations from ACIS
+and replaces the snapshot at settings.ACIS_STATION_SNAPSHOT
+that AcisWS.StnMeta answers station metadata requests from.
+'''
+import AcisWS
+
+try:
+    import my_acis.settings as settings
+except ImportError:
+    import my_acis_settings as settings
+
+snapshot_path = getattr(settings, 'ACIS_STATION_SNAPSHOT', settings.TEMP_DIR + 'station_meta.sqlite')
+
+def refresh_snapshot(logger):
+    if not snapshot_path:
+        return None
+    logger.info('Refreshing station metadata snapshot %s' % snapshot_path)
+    #The old snapshot is kept if the refresh fails
+    num_stations = AcisWS.ACISStationSnapshot.build(snapshot_path, logger=logger)
+    return 'Wrote %s stations' % str(num_stations)
+
+if __name__ == '__main__':
+    AcisWS.run_cron_job('station_meta_snapshot', refresh_snapshot)